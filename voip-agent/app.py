@@ -7,19 +7,35 @@ import pwd
 import os
 import wave
 import concurrent.futures
+import threading
+import time
 from enum import Enum
 from aiohttp import web
 from prometheus_client import Gauge, generate_latest
 from aioari import connect
 from utils import get_env, setup_log
 from rtp_fixed import RTPProcessor
+from ringbuffer import AudioRingBuffer
 from vad import VadController
-from stt import STTWorker
-from tts import TTSWorker
+from vad_batch import VadScheduler
+from stt import STTWorker, STTResult, EMPTY_RESULT
+from stt_service import STTService, STTOverloaded, STTDeadlineExceeded
+from stt_batch import STTBatcher
+from endpointer import create_endpointer, SPECULATE, CANCEL, END
+from turn_gate import TurnGate
+from metrics import endpoint_speculations, endpoint_silence_timeout, turn_gate_suppressed, turn_gate_saved_seconds
+from metrics import tts_splice_chars
+from tts import TTSWorker, TTSError
+from tts_pool import TTSPool
+from tts_cache import TTSCache
+from tts_splice import PhraseSplicer
 from dtmf import DTMFHandler
 
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
+WELCOME_TEXT = ("Hola, soy tu asistente virtual. Por favor, mantente en línea y háblame después del tono. "
+                "Puedes interrumpirme en cualquier momento.")
+
 class ConversationState(Enum):
     LISTENING = "listening"
     PROCESSING = "processing"
@@ -39,10 +55,23 @@ class VoIPAgent:
         self.rtp_out_port = int(get_env("RTP_OUT_PORT", 5002))
         self.prometheus_port = int(get_env("PROMETHEUS_PORT", 9091))
         self.n8n_webhook = get_env("N8N_WEBHOOK", "http://localhost:5679/webhook/voip-agent")
-        self.stt = STTWorker()
-        self.tts = TTSWorker()
-        self.rtp = RTPProcessor()
+        # "rtp": streaming RTP saliente; "file": archivo .slin + channel.play
+        self.playback_mode = get_env("PLAYBACK_MODE", "rtp")
+        # Un solo VadController (y un solo silero) compartido con STT
         self.vad = VadController()
+        self.stt = STTWorker(vad=self.vad)
+        # Servicio de STT con hilos y cola propios (no compite con TTS/VAD en self.executor)
+        self.stt_service = STTService(self.stt)
+        # Micro-lotes de transcripciones finales entre llamadas (STT_BATCH_WINDOW_MS=0 desactiva)
+        self.stt_batcher = STTBatcher(self.stt_service)
+        if self.stt_batcher.window <= 0:
+            self.stt_batcher = None
+        # Piper en procesos aparte (TTS_POOL=0: en hilos de self.executor)
+        self.tts_pool = TTSPool() if get_env("TTS_POOL", "1") == "1" else None
+        self.tts = TTSWorker(load_model=self.tts_pool is None)
+        self.rtp = RTPProcessor()
+        # Frecuencia del audio de salida: la del stream RTP (8 o 16 kHz) o 8 kHz para archivos .slin
+        self.output_rate = self.rtp.sample_rate if self.playback_mode == "rtp" else 8000
         self.ari = None
         self.dtmf = None
         self.stt_latency = Gauge("stt_latency_seconds", "Latencia de STT")
@@ -53,44 +82,133 @@ class VoIPAgent:
         self.active_channels = {}
         # ThreadPool para operaciones síncronas
         self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        # VAD por lotes entre canales (una pasada de silero por tick para todas las llamadas)
+        self.vad_scheduler = VadScheduler(self.vad, self.executor) if get_env("VAD_BATCH", "1") == "1" else None
         # Events para playback
         self.playback_events = {}
         # Estados de conversación por canal
         self.conversation_states = {}
         # Eventos de interrupción
         self.interrupt_events = {}
-        # Cache de TTS para respuestas comunes
-        self.tts_cache = {}
+        # Cache de TTS en disco por texto, voz y formato (persiste entre reinicios)
+        self.tts_cache = TTSCache(f"{os.path.basename(self.tts.voice)}@{self.tts.rate}")
+        # Respuestas por plantilla: partes fijas desde la cache, sólo el hueco pasa por Piper
+        self.splicer = PhraseSplicer()
         # Sesión HTTP reutilizable
         self.http_session = None
-        # Buffer de audio por canal
+        # Ring buffer de audio por canal
         self.audio_buffers = {}
+        self.max_utterance_seconds = float(get_env("MAX_UTTERANCE_SECONDS", 5))
+        self.pre_roll_ms = int(get_env("PRE_ROLL_MS", 300))
+        # STT incremental: re-decodifica la expresión cada STT_PARTIAL_MS mientras se habla
+        self.stt_streaming = get_env("STT_STREAMING", "1") == "1"
+        self.stt_partial_ms = int(get_env("STT_PARTIAL_MS", 400))
+        self.partial_tasks = {}
+        # Filtro de turnos sin voz o alucinados antes del LLM; tras varios seguidos se pide repetir
+        self.turn_gate = TurnGate()
+        self.gate_reprompt_after = int(get_env("GATE_REPROMPT_AFTER", 2))
+        self.reprompt_text = "Disculpa, no pude entender. ¿Puedes repetir?"
+        self.suppressed_turns = {}
+        # Latencias medias de LLM y TTS (media móvil) para estimar lo ahorrado por el filtro
+        self.llm_seconds_avg = None
+        self.tts_seconds_avg = None
         # Tiempos de última actividad
         self.last_activity = {}
 
     async def metrics_handler(self, request):
         return web.Response(body=generate_latest(), content_type="text/plain")
 
-    async def process_audio(self, audio_data):
+    async def tts_cache_handler(self, request):
+        return web.json_response(self.tts_cache.stats())
+
+    async def transcribe_utterance(self, channel_id, audio_data, sample_rate, speech_segments=None):
+        """STT de la expresión sin cerrar el stream de la llamada, para poder lanzarlo de
+        forma especulativa y descartarlo. En modo incremental devuelve el texto de la cola
+        sin confirmar; si no, la transcripción completa.
+
+        `speech_segments` son los segmentos de voz del VAD en streaming (relativos a la
+        expresión): se recorta el silencio y STT no repite ninguna pasada de VAD."""
+        stt_stream = self.stt.streams.get(channel_id) if channel_id else None
+        if stt_stream:
+            pending = self.partial_tasks.get(channel_id)
+            if pending and not pending.done():
+                # shield: si se descarta la especulación, el parcial en curso sigue. Queda en
+                # partial_tasks para que schedule_partial no lance otro `update` sobre el mismo
+                # stream mientras éste corre (las pasadas de un stream van de a una)
+                await asyncio.shield(pending)
+            if speech_segments is not None:
+                if not speech_segments:
+                    return EMPTY_RESULT
+                # Sólo el silencio final: las posiciones confirmadas del stream son relativas al inicio
+                _, end = self.stt.speech_bounds(speech_segments, len(audio_data), sample_rate)
+                audio_data = audio_data[:end]
+            if self.stt_batcher:
+                return await self.stt_batcher.decode_tail(stt_stream, audio_data)
+            return await self.stt_service.decode_tail(stt_stream, audio_data)
+        if self.stt_batcher:
+            if speech_segments is None:
+                # Sin segmentos del VAD en streaming: silero antes de decodificar, como process_audio
+                return await self.stt_batcher.transcribe(audio_data, sample_rate, vad_check=True)
+            if not speech_segments:
+                return EMPTY_RESULT
+            start, end = self.stt.speech_bounds(speech_segments, len(audio_data), sample_rate)
+            return await self.stt_batcher.transcribe(audio_data[start:end], sample_rate)
+        return await self.stt_service.transcribe(audio_data, sample_rate, speech_segments)
+
+    async def process_audio(self, audio_data, sample_rate=8000, channel_id=None, speculative=None,
+                            speech_segments=None):
         start_time = asyncio.get_event_loop().time()
 
-        # STT asíncrono usando ThreadPoolExecutor
-        loop = asyncio.get_event_loop()
-        transcription = await loop.run_in_executor(
-            self.executor, self.stt.process_audio, audio_data
-        )
+        # STT en el servicio dedicado (cola acotada con plazo por petición); si hubo STT
+        # especulativo sobre esta misma expresión, se usa su resultado
+        stt_stream = self.stt.streams.get(channel_id) if channel_id else None
+        try:
+            result = None
+            if speculative is not None and not speculative.cancelled():
+                try:
+                    result = await speculative
+                    endpoint_speculations.labels(outcome="used").inc()
+                except (STTOverloaded, STTDeadlineExceeded):
+                    result = None
+                except asyncio.CancelledError:
+                    # Sólo se ignora si se canceló la especulación; si es esta tarea
+                    # (p. ej. la llamada colgó) la cancelación se propaga
+                    if asyncio.current_task().cancelling() or not speculative.cancelled():
+                        raise
+                    result = None
+            if result is None:
+                result = await self.transcribe_utterance(channel_id, audio_data, sample_rate, speech_segments)
+            if stt_stream:
+                event = stt_stream.finish(result)
+                result = STTResult(event["text"], event["avg_logprob"], event["no_speech_prob"])
+        except (STTOverloaded, STTDeadlineExceeded) as e:
+            self.logger.warning(f"STT no disponible para canal {channel_id}: {e}")
+            if stt_stream:
+                stt_stream.reset()
+            return None
 
         self.stt_latency.set(asyncio.get_event_loop().time() - start_time)
-        if not transcription:
+        text = result.text
+        if not text:
             self.logger.error("No se obtuvo transcripción")
             return None
-        text = " ".join(transcription) if isinstance(transcription, list) else transcription
         self.logger.info(f"Transcripción: {text}")
 
+        # Filtro antes del LLM: silencio, ruido o frases fantasma de Whisper
+        speech_ratio = None
+        if speech_segments is not None and len(audio_data):
+            speech_ratio = sum(end - start for start, end in speech_segments) / len(audio_data)
+        reason = self.turn_gate.check(text, result.avg_logprob, result.no_speech_prob, speech_ratio)
+        if reason:
+            return self.suppress_turn(channel_id, text, reason)
+        self.suppressed_turns.pop(channel_id, None)
+
         # LLM request
         start_time = asyncio.get_event_loop().time()
         response = await self.send_to_n8n(text)
-        self.llm_latency.set(asyncio.get_event_loop().time() - start_time)
+        elapsed = asyncio.get_event_loop().time() - start_time
+        self.llm_latency.set(elapsed)
+        self.llm_seconds_avg = self.moving_average(self.llm_seconds_avg, elapsed)
 
         if not response:
             self.logger.error("No se obtuvo respuesta de n8n")
@@ -98,6 +216,26 @@ class VoIPAgent:
         self.logger.info(f"Respuesta LLM: {response}")
         return response
 
+    @staticmethod
+    def moving_average(current, value, alpha=0.2):
+        return value if current is None else current + alpha * (value - current)
+
+    def suppress_turn(self, channel_id, text, reason):
+        """Descarta un turno filtrado; devuelve la frase para pedir repetir (en cache) o None"""
+        turn_gate_suppressed.labels(reason=reason).inc()
+        count = self.suppressed_turns.get(channel_id, 0) + 1
+        self.suppressed_turns[channel_id] = count
+        self.logger.info(f"Turno descartado ({reason}) en canal {channel_id}: {text!r}")
+        # Cada turno descartado ahorra el LLM; el TTS sólo si no se pide repetir
+        if self.llm_seconds_avg:
+            turn_gate_saved_seconds.labels(stage="llm").inc(self.llm_seconds_avg)
+        if count >= self.gate_reprompt_after:
+            self.suppressed_turns[channel_id] = 0
+            return self.reprompt_text
+        if self.tts_seconds_avg:
+            turn_gate_saved_seconds.labels(stage="tts").inc(self.tts_seconds_avg)
+        return None
+
     async def send_to_n8n(self, transcription):
         try:
             async with aiohttp.ClientSession() as session:
@@ -124,6 +262,9 @@ class VoIPAgent:
                 channel_info = event['channel']
                 channel_id = channel_info['id']
                 channel_name = channel_info['name']
+                if channel_name.startswith("UnicastRTP/"):
+                    # Canal ExternalMedia creado por nosotros para el stream RTP
+                    return
                 caller_number = channel_info.get('caller', {}).get('number', 'unknown')
                 self.logger.info(f"Procesando llamada de {caller_number} en canal {channel_name}")
                 channel_obj = await self.ari.channels.get(channelId=channel_id)
@@ -133,13 +274,13 @@ class VoIPAgent:
                 # Registrar canal como activo
                 self.active_channels[channel_id] = {
                     'channel': channel_obj,
-                    'processing_task': None
+                    'processing_task': None,
+                    'external_channel': None
                 }
 
                 # Inicializar estado de conversación
                 self.conversation_states[channel_id] = ConversationState.LISTENING
 
-                await self.play_welcome_message(channel_obj)
                 # Crear tarea de procesamiento de audio y guardar referencia
                 processing_task = asyncio.create_task(self.start_audio_processing(channel_obj))
                 self.active_channels[channel_id]['processing_task'] = processing_task
@@ -169,6 +310,9 @@ class VoIPAgent:
                         channel_data['processing_task'].cancel()
                         self.logger.info(f"Tarea de procesamiento cancelada para canal {channel_id}")
                     
+                    # Colgar canal ExternalMedia y cerrar su stream RTP
+                    await self.close_external_media(channel_id, channel_data.get('external_channel'))
+
                     # Remover del diccionario de canales activos
                     del self.active_channels[channel_id]
                     self.logger.info(f"Canal {channel_id} limpiado del estado activo")
@@ -192,35 +336,9 @@ class VoIPAgent:
     async def play_welcome_message(self, channel):
         try:
             self.logger.info("Reproduciendo mensaje de bienvenida")
-            welcome_text = "Hola, soy tu asistente virtual. Por favor, mantente en línea y háblame después del tono. Puedes interrumpirme en cualquier momento."
-            try:
-                start_time = asyncio.get_event_loop().time()
-                # TTS asíncrono
-                loop = asyncio.get_event_loop()
-                rate, audio = await loop.run_in_executor(
-                    self.executor, self.tts.synthesize, welcome_text
-                )
-                self.tts_latency.set(asyncio.get_event_loop().time() - start_time)
-                self.logger.info("TTS completado exitosamente")
-            except Exception as tts_error:
-                self.logger.error(f"Error en TTS: {tts_error}")
-                await self.play_simple_tone(channel)
-                return
-
             # NO MUTAR entrada - permitir barge-in
             self.logger.info("Manteniendo audio entrante activo para barge-in")
-            tts_filename = f"{channel.id.replace('.', '_')}"
-            tts_file = f"/var/lib/asterisk/sounds/tts/{tts_filename}.slin"
-            audio_int16 = (audio * 0.7).astype(np.int16)
-
-            # Escritura asíncrona de archivo
-            await self.write_audio_file(tts_file, audio_int16.tobytes())
-
-            self.logger.info(f"Archivo TTS SLIN creado: {tts_file}")
-
-            # Reproducir con soporte para barge-in
-            await self.play_with_bargein(channel, f"sound:tts/{tts_filename}", tts_file)
-
+            await self.speak_cached(channel, WELCOME_TEXT)
         except Exception as e:
             self.logger.error(f"Error reproduciendo mensaje de bienvenida: {e}")
 
@@ -362,6 +480,138 @@ class VoIPAgent:
                 self.conversation_states[channel_id] = ConversationState.LISTENING
             raise
 
+    async def stream_with_bargein(self, channel, audio_int16):
+        """Reproduce audio por RTP en streaming con soporte para barge-in"""
+        channel_id = channel.id
+        playback = self.rtp.play(channel_id, audio_int16)
+        if playback is None:
+            self.logger.error(f"No se pudo iniciar streaming RTP para canal {channel_id}")
+            return False
+        self.logger.info(f"Streaming RTP iniciado para canal {channel_id}: {len(audio_int16)} samples")
+        return await self.wait_playback(channel, playback)
+
+    async def speak_streaming(self, channel, text):
+        """Sintetiza y reproduce `text` por oraciones con barge-in.
+
+        La síntesis corre en el pool de TTS (o en un hilo) y cada segmento se encola en la reproducción RTP en
+        cuanto está listo (sin huecos si Piper va más rápido que el tiempo real). Si el
+        llamante interrumpe, la síntesis se abandona tras el segmento en curso. Las
+        respuestas completas (no interrumpidas) se guardan en la cache de TTS.
+        """
+        channel_id = channel.id
+        playback = self.rtp.start_playback(channel_id)
+        if playback is None:
+            self.logger.error(f"No se pudo iniciar streaming RTP para canal {channel_id}")
+            return False
+        loop = asyncio.get_event_loop()
+        segments = []
+        start_time = time.perf_counter()
+
+        async def produce():
+            try:
+                async for segment in self.synthesize_stream(text):
+                    if not segments:
+                        elapsed = time.perf_counter() - start_time
+                        self.tts_latency.set(elapsed)
+                        self.logger.info(f"Primer audio TTS en {elapsed * 1000:.0f} ms para canal {channel_id}")
+                    segments.append(segment)
+                    playback.write((segment * 0.7).astype(np.int16))
+            finally:
+                playback.finish()
+            return time.perf_counter() - start_time
+
+        producer = asyncio.create_task(produce())
+        try:
+            interrupted = await self.wait_playback(channel, playback)
+        except BaseException:
+            producer.cancel()
+            raise
+        if interrupted:
+            # Barge-in: la síntesis se abandona tras el segmento en curso
+            producer.cancel()
+            return True
+        try:
+            synth_seconds = await producer
+        except Exception as e:
+            self.logger.error(f"Error en síntesis por oraciones: {e}")
+            return False
+        self.tts_seconds_avg = self.moving_average(self.tts_seconds_avg, synth_seconds)
+        if segments:
+            audio = (np.concatenate(segments) * 0.7).astype(np.int16)
+            await loop.run_in_executor(self.executor, self.tts_cache.store, text, self.output_rate, audio)
+        return False
+
+    async def synthesize(self, text, fallback=True):
+        """(rate, audio) de Piper a la frecuencia de salida, en el pool de procesos o en un hilo"""
+        if self.tts_pool:
+            return await self.tts_pool.synthesize(text, self.output_rate, fallback)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self.tts.synthesize, text, self.output_rate, fallback)
+
+    async def synthesize_stream(self, text):
+        """Segmentos por oración de `text` a medida que Piper los genera"""
+        if self.tts_pool:
+            async for segment in self.tts_pool.synthesize_stream(text, self.output_rate):
+                yield segment
+            return
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def produce():
+            try:
+                for segment in self.tts.synthesize_stream(text, self.output_rate):
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, segment)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        producer = loop.run_in_executor(self.executor, produce)
+        try:
+            while (segment := await queue.get()) is not None:
+                yield segment
+            await producer
+        finally:
+            cancelled.set()
+
+    async def wait_playback(self, channel, playback):
+        """Espera el fin de una reproducción RTP o la interrupción del llamante (barge-in)"""
+        channel_id = channel.id
+        try:
+            self.conversation_states[channel_id] = ConversationState.SPEAKING
+            interrupt_event = asyncio.Event()
+            self.interrupt_events[channel_id] = interrupt_event
+
+            interrupt_task = asyncio.create_task(self.monitor_interruption(channel))
+            done_task = asyncio.create_task(playback.done.wait())
+            interrupt_wait = asyncio.create_task(interrupt_event.wait())
+            await asyncio.wait([done_task, interrupt_wait], return_when=asyncio.FIRST_COMPLETED)
+            interrupt_task.cancel()
+            done_task.cancel()
+            interrupt_wait.cancel()
+
+            interrupted = interrupt_event.is_set()
+            if interrupted:
+                # Detener localmente: sin ida y vuelta a ARI
+                playback.stop()
+                self.logger.info(f"Streaming RTP interrumpido por usuario en canal {channel_id}")
+                self.conversation_states[channel_id] = ConversationState.INTERRUPTED
+            else:
+                self.logger.info(f"Streaming RTP completado: {playback.sent_frames} frames")
+                self.conversation_states[channel_id] = ConversationState.LISTENING
+
+            if channel_id in self.interrupt_events:
+                del self.interrupt_events[channel_id]
+            return interrupted
+
+        except Exception as e:
+            self.logger.error(f"Error en streaming con barge-in: {e}")
+            self.rtp.stop_playback(channel_id)
+            if channel_id in self.conversation_states:
+                self.conversation_states[channel_id] = ConversationState.LISTENING
+            raise
+
     async def monitor_interruption(self, channel):
         """Monitorea audio entrante durante TTS para detectar interrupciones"""
         try:
@@ -380,10 +630,7 @@ class VoIPAgent:
 
                     if audio_chunk is not None:
                         # Verificar si hay voz usando VAD
-                        loop = asyncio.get_event_loop()
-                        is_speech = await loop.run_in_executor(
-                            self.executor, self.vad.is_speech, audio_chunk
-                        )
+                        is_speech = await self.detect_speech(channel_id, audio_chunk)
 
                         if is_speech:
                             self.logger.info(f"Voz detectada durante TTS en canal {channel_id} - Interrumpiendo")
@@ -406,32 +653,118 @@ class VoIPAgent:
         except Exception as e:
             self.logger.error(f"Error fatal en monitoreo de interrupción: {e}")
 
-    async def get_cached_tts(self, text):
-        """Obtiene TTS con cache para respuestas comunes"""
-        # Crear hash del texto para cache
-        import hashlib
-        text_hash = hashlib.md5(text.encode('utf-8')).hexdigest()[:12]
-
-        if text_hash in self.tts_cache:
-            self.logger.info(f"Cache HIT para TTS: {text[:30]}...")
-            return self.tts_cache[text_hash]
-
-        # TTS asíncrono
+    async def update_partial(self, stt_stream, audio):
+        """Actualiza la hipótesis parcial de la expresión en curso"""
+        try:
+            event = await self.stt_service.update(stt_stream, audio)
+            self.logger.info(f"Parcial [{stt_stream.channel_id}]: {event['text']}")
+        except (STTOverloaded, STTDeadlineExceeded) as e:
+            self.logger.debug(f"Parcial omitido [{stt_stream.channel_id}]: {e}")
+        except Exception as e:
+            self.logger.error(f"Error en transcripción parcial: {e}")
+
+    def schedule_partial(self, channel_id, ring, speech_end):
+        """Lanza una re-decodificación parcial si hay audio nuevo suficiente y no hay otra en curso"""
+        stt_stream = self.stt.streams.get(channel_id)
+        if stt_stream is None:
+            return
+        pending = self.partial_tasks.get(channel_id)
+        if pending and not pending.done():
+            return
+        length = ring.utterance_length(speech_end)
+        if length - stt_stream.partial_samples < self.stt_partial_ms * stt_stream.sample_rate // 1000:
+            return
+        stt_stream.partial_samples = length
+        # Copia: la re-decodificación corre en otro hilo mientras el ring sigue recibiendo audio
+        audio = ring.utterance(speech_end).copy()
+        self.partial_tasks[channel_id] = asyncio.create_task(self.update_partial(stt_stream, audio))
+
+    async def detect_speech(self, channel_id, audio_chunk):
+        """VAD del chunk con el estado del canal: por lotes si el scheduler está activo"""
+        speech, _ = await self.detect_speech_events(channel_id, audio_chunk)
+        return speech
+
+    async def detect_speech_events(self, channel_id, audio_chunk):
+        """Como detect_speech, pero devuelve también los eventos de inicio/fin de voz"""
+        if self.vad_scheduler:
+            return await self.vad_scheduler.submit(channel_id, audio_chunk)
         loop = asyncio.get_event_loop()
-        rate, audio = await loop.run_in_executor(
-            self.executor, self.tts.synthesize, text
+        return await loop.run_in_executor(
+            self.executor, self.vad.process_stream, channel_id, audio_chunk
         )
 
-        # Cachear solo respuestas cortas (<100 chars) para evitar uso excesivo de memoria
-        if len(text) < 100 and len(self.tts_cache) < 50:  # Limitar cache a 50 entradas
-            self.tts_cache[text_hash] = (rate, audio)
-            self.logger.info(f"Cache MISS - Guardado: {text[:30]}...")
+    def utterance_segments(self, segments, start, end):
+        """Segmentos de voz [inicio, fin) dentro de la expresión [start, end), relativos a start"""
+        result = []
+        for seg_start, seg_end in segments:
+            seg_end = end if seg_end is None else min(seg_end, end)
+            seg_start = max(seg_start, start)
+            if seg_end > seg_start:
+                result.append((seg_start - start, seg_end - start))
+        return result
+
+    async def get_cached_tts(self, text, splice=True):
+        """Entrada de la cache de TTS para `text`; sólo sintetiza (y escribe) si no está.
+
+        Si `text` sigue una plantilla se arma por partes (`render_spliced`) en vez de
+        sintetizar la frase completa.
+        """
+        entry = self.tts_cache.lookup(text, self.output_rate)
+        if entry:
+            self.logger.info(f"Cache HIT para TTS: {text[:30]}...")
+            return entry
 
-        return rate, audio
+        loop = asyncio.get_event_loop()
+        parts = self.splicer.match(text) if splice else None
+        if parts:
+            rate, audio = self.output_rate, await self.render_spliced(parts)
+        else:
+            rate, audio = await self.synthesize(text, fallback=False)
+            audio = (audio * 0.7).astype(np.int16)
+        entry = await loop.run_in_executor(self.executor, self.tts_cache.store, text, rate, audio)
+        self.logger.info(f"Cache MISS - Guardado: {text[:30]}...")
+        return entry
+
+    async def render_spliced(self, parts):
+        """Audio listo para reproducir de una respuesta por plantilla"""
+        loop = asyncio.get_event_loop()
+        pieces = []
+        for kind, text in parts:
+            if kind == "fixed":
+                entry = await self.get_cached_tts(text, splice=False)
+                pieces.append(await loop.run_in_executor(self.executor, self.tts_cache.read, entry))
+            else:
+                _, audio = await self.synthesize(text, fallback=False)
+                pieces.append((audio * 0.7).astype(np.int16))
+            tts_splice_chars.labels(part="cached" if kind == "fixed" else "synthesized").inc(len(text))
+        self.logger.info(f"TTS por plantilla: {len(parts)} partes, sintetizado sólo "
+                         f"{[text for kind, text in parts if kind == 'slot']}")
+        return self.splicer.join(pieces, self.output_rate)
+
+    async def speak_cached(self, channel, text):
+        """Reproduce `text` desde la cache de TTS con barge-in; devuelve si hubo interrupción"""
+        start_time = asyncio.get_event_loop().time()
+        try:
+            entry = await self.get_cached_tts(text)
+        except TTSError as e:
+            self.logger.error(f"Error en TTS: {e}")
+            await self.play_simple_tone(channel)
+            return False
+        elapsed = asyncio.get_event_loop().time() - start_time
+        self.tts_latency.set(elapsed)
+        self.tts_seconds_avg = self.moving_average(self.tts_seconds_avg, elapsed)
+
+        if self.playback_mode == "rtp":
+            loop = asyncio.get_event_loop()
+            audio_int16 = await loop.run_in_executor(self.executor, self.tts_cache.read, entry)
+            return await self.stream_with_bargein(channel, audio_int16)
+        # El archivo de la cache ya está en el directorio de sonidos de Asterisk
+        return await self.play_with_bargein(channel, self.tts_cache.media(entry))
 
     async def init_common_tts_cache(self):
-        """Pre-genera cache para respuestas comunes"""
+        """Pre-genera en la cache las respuestas comunes que falten (persisten entre reinicios)"""
         common_responses = [
+            WELCOME_TEXT,
             "Hola, soy tu asistente virtual. Por favor, mantente en línea y dime tu nombre después del tono. Bip.",
             "Te escucho, por favor continúa.",
             "Disculpa, no pude entender. ¿Puedes repetir?",
@@ -442,14 +775,20 @@ class VoIPAgent:
             "Muy bien, gracias."
         ]
 
-        self.logger.info("Pre-generando cache de TTS para respuestas comunes...")
-        for response in common_responses:
+        self.logger.info("Pre-generando cache de TTS para respuestas comunes y partes fijas de plantillas...")
+        loop = asyncio.get_event_loop()
+        for response in common_responses + self.splicer.fixed_pieces():
+            if self.tts_cache.contains(response, self.output_rate):
+                continue
             try:
-                await self.get_cached_tts(response)
+                rate, audio = await self.synthesize(response, fallback=False)
+                await loop.run_in_executor(
+                    self.executor, self.tts_cache.store, response, rate, (audio * 0.7).astype(np.int16)
+                )
             except Exception as e:
                 self.logger.error(f"Error pre-generando TTS para '{response[:30]}': {e}")
 
-        self.logger.info(f"Cache TTS inicializado con {len(self.tts_cache)} entradas")
+        self.logger.info(f"Cache TTS inicializado con {len(self.tts_cache.entries)} entradas")
 
     async def cleanup_temp_file(self, filepath, delay_seconds):
         try:
@@ -467,6 +806,23 @@ class VoIPAgent:
             bridge = await self.ari.bridges.create(type='mixing', bridgeId=bridge_id)
             await bridge.addChannel(channel=channel.id)
             self.logger.info(f"Bridge {bridge_id} creado para hold")
+            # Stream RTP del llamante vía ExternalMedia en lugar de grabaciones a disco
+            external_channel = await self.ari.channels.externalMedia(
+                app=self.ari_app,
+                external_host=f"{self.rtp_in_host}:{self.rtp_in_port}",
+                format=self.rtp.media_format
+            )
+            if channel.id in self.active_channels:
+                self.active_channels[channel.id]['external_channel'] = external_channel
+            await bridge.addChannel(channel=external_channel.id)
+            await self.rtp.open_stream(channel.id, external_channel)
+            # Estado de VAD en streaming propio del canal
+            self.vad.open_stream(channel.id, self.rtp.sample_rate)
+            if self.stt_streaming:
+                self.stt.open_stream(channel.id, self.rtp.sample_rate)
+            self.logger.info(f"ExternalMedia {external_channel.id} agregado al bridge {bridge_id}")
+            # Bienvenida una vez que el stream RTP está listo
+            await self.play_welcome_message(channel)
             def on_dtmf(channel_obj, event):
                 digit = event.get('digit', '?')
                 self.logger.info(f"DTMF recibido: {digit}")
@@ -487,121 +843,163 @@ class VoIPAgent:
         except Exception as e:
             self.logger.error(f"Error iniciando procesamiento de audio: {e}")
 
+    async def close_external_media(self, channel_id, external_channel):
+        """Cierra el stream RTP de un canal y cuelga su canal ExternalMedia"""
+        await self.rtp.cleanup_channel(channel_id)
+        if external_channel is None:
+            return
+        try:
+            await external_channel.hangup()
+        except Exception as e:
+            self.logger.debug(f"ExternalMedia {external_channel.id} ya finalizado: {e}")
+
     async def continuous_audio_processing(self, channel):
         """Procesamiento continuo de audio con VAD y chunks pequeños para tiempo real"""
         channel_id = channel.id
         self.logger.info(f"Iniciando procesamiento continuo para canal {channel_id}")
 
-        audio_buffer = []
-        silence_duration = 0
-        speech_detected = False
-
-        while channel_id in self.active_channels:
-            try:
-                # Capturar chunks pequeños (100ms) para tiempo real
-                audio_chunk = await asyncio.wait_for(
-                    self.rtp.receive_audio(channel, duration=0.1),
-                    timeout=0.2
-                )
-
-                if audio_chunk is None:
-                    silence_duration += 0.1
-                    # Si hay silencio prolongado y ya había voz, procesar buffer
-                    if speech_detected and silence_duration > 1.0:  # 1 segundo de silencio
-                        if audio_buffer:
-                            await self.process_audio_buffer(channel, audio_buffer)
-                            audio_buffer = []
-                            speech_detected = False
-                            silence_duration = 0
-                    continue
-
-                # VAD asíncrono en chunk para detectar voz
-                loop = asyncio.get_event_loop()
-                is_speech = await loop.run_in_executor(
-                    self.executor, self.vad.is_speech, audio_chunk
-                )
-
-                if is_speech:
-                    if not speech_detected:
-                        self.logger.info("🎙️ Inicio de voz detectado - Iniciando captura")
-                        speech_detected = True
-                        audio_buffer = []
+        # Buffer circular de la llamada: memoria fija reservada una sola vez
+        sample_rate = self.rtp.sample_rate
+        max_samples = int(sample_rate * self.max_utterance_seconds)
+        pre_roll = sample_rate * self.pre_roll_ms // 1000
+        ring = AudioRingBuffer(max_samples + pre_roll, pre_roll=pre_roll)
+        self.audio_buffers[channel_id] = ring
+        self.logger.info(f"Ring buffer de {ring.nbytes} bytes para canal {channel_id}")
+
+        # Fin de turno con silencio adaptado a las pausas de este llamante
+        endpointer = create_endpointer()
+        # Posición absoluta hasta donde llega la expresión (voz + pausas cortas)
+        speech_end = 0
+        # STT lanzado en la primera pausa corta sobre ring.utterance(speech_end)
+        speculative = None
+        # Segmentos de voz [inicio, fin) del VAD en streaming, en posiciones del ring; si
+        # no hay estado de VAD del canal no se conocen y el STT hace su propio VAD
+        segments = []
+        segments_known = True
 
-                    audio_buffer.append(audio_chunk)
-                    silence_duration = 0
-
-                    # Procesar si buffer es muy largo (evitar memoria excesiva)
-                    if len(audio_buffer) > 50:  # 5 segundos max
-                        await self.process_audio_buffer(channel, audio_buffer)
-                        audio_buffer = []
-                        speech_detected = False
+        try:
+            while channel_id in self.active_channels:
+                try:
+                    # Capturar chunks pequeños (100ms) para tiempo real
+                    audio_chunk = await asyncio.wait_for(
+                        self.rtp.receive_audio(channel, duration=0.1),
+                        timeout=0.2
+                    )
 
-                else:
-                    if speech_detected:
-                        silence_duration += 0.1
-                        # Pequeña pausa en el habla, seguir acumulando
-                        if silence_duration < 0.5:  # 500ms de tolerancia
-                            audio_buffer.append(audio_chunk)
-                        # Pausa más larga, procesar lo acumulado
-                        elif silence_duration > 1.0:  # 1 segundo de silencio
-                            if audio_buffer:
-                                await self.process_audio_buffer(channel, audio_buffer)
-                                audio_buffer = []
-                                speech_detected = False
-                                silence_duration = 0
+                    if audio_chunk is None:
+                        decision = endpointer.update(False, 0.1)
+                    else:
+                        # VAD asíncrono en chunk para detectar voz
+                        is_speech, events = await self.detect_speech_events(channel_id, audio_chunk)
+
+                        vad_stream = self.vad.streams.get(channel_id)
+                        if is_speech and not ring.active:
+                            self.logger.info("🎙️ Inicio de voz detectado - Iniciando captura")
+                            # Incluye el pre-roll ya almacenado antes de este chunk
+                            ring.start_utterance()
+                            segments = [seg for seg in segments if seg[1] is None or seg[1] > ring.utterance_start]
+                            segments_known = vad_stream is not None
+                            if (vad_stream and vad_stream.triggered
+                                    and not any(event["event"] == "start" for event in events)
+                                    and not (segments and segments[-1][1] is None)):
+                                # El "start" lo consumió monitor_interruption (barge-in): la voz
+                                # ya venía de antes, el segmento abre al inicio de la expresión
+                                segments.append([ring.utterance_start, None])
+                            if channel_id in self.stt.streams:
+                                self.stt.streams[channel_id].reset()
+
+                        ring.write(audio_chunk)
+                        if vad_stream is None:
+                            segments_known = False
+                        elif events:
+                            # El VAD también consume audio fuera de este bucle (barge-in):
+                            # se alinean sus posiciones con las del ring en cada chunk
+                            offset = ring.write_pos - vad_stream.consumed
+                            for event in events:
+                                if event["event"] == "start":
+                                    segments.append([event["sample"] + offset, None])
+                                elif segments and segments[-1][1] is None:
+                                    segments[-1][1] = event["sample"] + offset
+                        decision = endpointer.update(is_speech, 0.1)
+                        # Tras lanzar la especulación el final de la expresión queda fijo, así
+                        # el resultado especulativo corresponde exactamente al audio a procesar
+                        if ring.active and (is_speech or not endpointer.speculating):
+                            speech_end = ring.write_pos
+                        if is_speech:
+                            self.schedule_partial(channel_id, ring, speech_end)
 
-            except asyncio.TimeoutError:
-                # No hay audio, continuar monitoreando
-                silence_duration += 0.2
-                if speech_detected and silence_duration > 1.5:  # 1.5s timeout
-                    if audio_buffer:
-                        await self.process_audio_buffer(channel, audio_buffer)
-                        audio_buffer = []
-                        speech_detected = False
-                        silence_duration = 0
-                continue
+                except asyncio.TimeoutError:
+                    # No hay audio, continuar monitoreando
+                    decision = endpointer.update(False, 0.2)
 
-            except asyncio.CancelledError:
-                self.logger.info(f"Procesamiento continuo cancelado para canal {channel_id}")
-                break
+                except asyncio.CancelledError:
+                    self.logger.info(f"Procesamiento continuo cancelado para canal {channel_id}")
+                    break
 
-            except Exception as e:
-                self.logger.error(f"Error en procesamiento continuo: {e}")
-                await asyncio.sleep(0.1)  # Pequeña pausa antes de continuar
+                except Exception as e:
+                    self.logger.error(f"Error en procesamiento continuo: {e}")
+                    await asyncio.sleep(0.1)  # Pequeña pausa antes de continuar
+                    continue
 
-    async def process_audio_buffer(self, channel, audio_buffer):
-        """Procesa buffer de audio acumulado"""
+                if decision == SPECULATE:
+                    # Copia: el STT corre mientras el ring sigue recibiendo audio
+                    speculative = asyncio.create_task(self.transcribe_utterance(
+                        channel_id, ring.utterance(speech_end).copy(), sample_rate,
+                        self.utterance_segments(segments, ring.utterance_start, speech_end)
+                        if segments_known else None
+                    ))
+                elif decision == CANCEL and speculative:
+                    # El llamante siguió hablando: el resultado especulativo no sirve
+                    speculative.cancel()
+                    speculative = None
+                    endpoint_speculations.labels(outcome="discarded").inc()
+                elif decision == END or (ring.active and ring.utterance_length() >= max_samples):
+                    if decision == END:
+                        endpoint_silence_timeout.observe(endpointer.timeout)
+                        self.logger.info(f"Fin de turno tras {endpointer.timeout:.2f}s de silencio")
+                    else:
+                        # La expresión llenó el buffer
+                        endpointer.end_turn()
+                    await self.process_audio_buffer(
+                        channel, ring.utterance(speech_end), speculative,
+                        self.utterance_segments(segments, ring.utterance_start, speech_end)
+                        if segments_known else None
+                    )
+                    ring.end_utterance()
+                    speculative = None
+                    # Sólo queda un segmento abierto si la expresión se cortó por longitud
+                    segments = [[max(seg[0], speech_end), None] for seg in segments if seg[1] is None]
+        finally:
+            # También si se cancela la tarea (cuelgue) mientras se procesa un turno
+            if speculative:
+                speculative.cancel()
+            self.audio_buffers.pop(channel_id, None)
+            if self.vad_scheduler:
+                self.vad_scheduler.close_stream(channel_id)
+            self.vad.close_stream(channel_id)
+            self.stt.close_stream(channel_id)
+            self.partial_tasks.pop(channel_id, None)
+            self.suppressed_turns.pop(channel_id, None)
+
+    async def process_audio_buffer(self, channel, audio, speculative=None, speech_segments=None):
+        """Procesa la expresión acumulada (vista del ring buffer de la llamada)"""
         try:
-            if not audio_buffer:
+            if audio is None or len(audio) == 0:
                 return
 
-            # Concatenar chunks de audio
-            import numpy as np
-            full_audio = np.concatenate(audio_buffer)
-
-            self.logger.info(f"Procesando buffer de audio ({len(audio_buffer)} chunks)")
+            self.logger.info(f"Procesando expresión de audio ({len(audio)} samples)")
 
             # Procesar con pipeline optimizado
-            response = await self.process_audio(full_audio)
+            response = await self.process_audio(audio, self.rtp.sample_rate, channel.id, speculative,
+                                                speech_segments)
 
             if response:
-                # TTS con cache
-                start_time = asyncio.get_event_loop().time()
-                rate, audio = await self.get_cached_tts(response)
-                self.tts_latency.set(asyncio.get_event_loop().time() - start_time)
-
-                tts_filename = f"{channel.id.replace('.', '_')}_response_{int(asyncio.get_event_loop().time())}"
-                tts_file = f"/var/lib/asterisk/sounds/tts/{tts_filename}.slin"
-                audio_int16 = (audio * 0.7).astype(np.int16)
-
-                # Escritura asíncrona
-                await self.write_audio_file(tts_file, audio_int16.tobytes())
-
-                self.logger.info(f"Archivo TTS SLIN creado: {tts_file}")
-
-                # Reproducir con soporte para barge-in
-                interrupted = await self.play_with_bargein(channel, f"sound:tts/{tts_filename}", tts_file)
-
+                if (self.playback_mode == "rtp" and not self.tts_cache.contains(response, self.output_rate)
+                        and not self.splicer.match(response)):
+                    # Sin cache ni plantilla: síntesis por oraciones, la primera suena mientras se generan las demás
+                    interrupted = await self.speak_streaming(channel, response)
+                else:
+                    interrupted = await self.speak_cached(channel, response)
                 if interrupted:
                     self.logger.info("TTS interrumpido, continuando captura")
 
@@ -654,12 +1052,21 @@ class VoIPAgent:
     async def run(self):
         self.logger.info("Iniciando VoIP Agent")
         app = web.Application()
-        app.add_routes([web.get("/metrics", self.metrics_handler)])
+        app.add_routes([web.get("/metrics", self.metrics_handler),
+                        web.get("/tts_cache", self.tts_cache_handler)])
         runner = web.AppRunner(app)
         await runner.setup()
         site = web.TCPSite(runner, "0.0.0.0", self.prometheus_port)
         await site.start()
         self.logger.info(f"Servidor de métricas iniciado en puerto {self.prometheus_port}")
+        # Receptor RTP para los canales ExternalMedia
+        await self.rtp.start(self.rtp_in_host, self.rtp_in_port,
+                             out_addr=(self.rtp_out_host, self.rtp_out_port))
+        if self.vad_scheduler:
+            self.vad_scheduler.start()
+        self.stt_service.start()
+        if self.tts_pool:
+            await self.tts_pool.start()
         # Inicializar cache de TTS
         await self.init_common_tts_cache()
 
@@ -685,6 +1092,18 @@ class VoIPAgent:
                     await self.ari.close()
                 except:
                     pass
+            # Cerrar receptor RTP
+            self.rtp.close()
+            if self.vad_scheduler:
+                await self.vad_scheduler.stop()
+            await self.stt_service.stop()
+            if self.tts_pool:
+                self.tts_pool.stop()
+            # Guardar aciertos y orden LRU de la cache de TTS
+            try:
+                self.tts_cache.save()
+            except OSError as e:
+                self.logger.error(f"Error guardando índice de cache TTS: {e}")
             # Cerrar sesión HTTP
             if self.http_session:
                 try:
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Autotune de inferencia: mide en esta máquina combinaciones de compute_type, hilos y
+workers para Whisper y de hilos ONNX para Piper, y escribe el perfil que STTWorker y
+TTSWorker cargan al iniciar.
+
+Uso: python autotune.py [--quick] [--output tuning_profile.json]
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+import wave
+import numpy as np
+from scipy.signal import resample_poly
+from utils import get_env, TUNING_PROFILE
+from models import load_whisper, load_piper
+
+AUDIO_FILES = ("test.wav", "test_audio.wav")
+COMPUTE_TYPES = ("int8", "int8_float32", "float32")
+TTS_PHRASES = (
+    "Hola, gracias por llamar. ¿En qué puedo ayudarle?",
+    "Su cita quedó agendada para mañana a las diez de la mañana.",
+    "Un momento por favor, estoy revisando la información.",
+)
+# Una configuración se considera si su latencia no supera la mejor en este factor
+LATENCY_TOLERANCE = 1.25
+
+def load_clips(seconds=4):
+    """Fragmentos float32 a 16 kHz de los wav incluidos"""
+    clips = []
+    for path in AUDIO_FILES:
+        with wave.open(path) as wav_file:
+            rate = wav_file.getframerate()
+            audio = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+        audio = resample_poly(audio.astype(np.float32) / 32768.0, 16000, rate).astype(np.float32)
+        step = 16000 * seconds
+        clips.extend(audio[i:i + step] for i in range(0, max(1, len(audio) - step + 1), step))
+    return clips
+
+def stt_candidates(cores, quick=False):
+    compute_types = COMPUTE_TYPES[:1] if quick else COMPUTE_TYPES
+    candidates = []
+    for compute_type in compute_types:
+        for workers in (1, 2, 4):
+            if workers > cores:
+                continue
+            for threads in sorted({max(1, cores // workers), max(1, cores // (2 * workers))}):
+                candidates.append({"compute_type": compute_type, "num_workers": workers, "cpu_threads": threads})
+    return candidates
+
+def transcribe(model, clip):
+    segments, _ = model.transcribe(clip, language="es", beam_size=5, vad_filter=False)
+    return " ".join(segment.text for segment in segments)
+
+def bench_stt(model_name, config, clips, rounds):
+    """Latencia de una expresión aislada y throughput con num_workers expresiones en paralelo"""
+    model = load_whisper(model_name, "cpu", config["compute_type"],
+                         cpu_threads=config["cpu_threads"], num_workers=config["num_workers"])
+    transcribe(model, clips[0])  # calentamiento
+    latencies = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        transcribe(model, clips[i % len(clips)])
+        latencies.append(time.perf_counter() - start)
+    jobs = [clips[i % len(clips)] for i in range(2 * config["num_workers"] * rounds)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=config["num_workers"]) as pool:
+        start = time.perf_counter()
+        list(pool.map(lambda clip: transcribe(model, clip), jobs))
+        elapsed = time.perf_counter() - start
+    audio_seconds = sum(len(clip) for clip in jobs) / 16000
+    del model
+    return {"latency": float(np.median(latencies)), "throughput": audio_seconds / elapsed}
+
+def synthesize(voice, text):
+    return sum(len(chunk.audio_int16_array) for chunk in voice.synthesize(text))
+
+def bench_tts(voice_path, threads, cores, rounds):
+    """Latencia por frase y throughput con cores // threads síntesis en paralelo"""
+    voice = load_piper(voice_path, threads)
+    synthesize(voice, TTS_PHRASES[0])  # calentamiento
+    latencies = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        synthesize(voice, TTS_PHRASES[i % len(TTS_PHRASES)])
+        latencies.append(time.perf_counter() - start)
+    workers = max(1, cores // threads)
+    jobs = [TTS_PHRASES[i % len(TTS_PHRASES)] for i in range(2 * workers * rounds)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        start = time.perf_counter()
+        samples = sum(pool.map(lambda text: synthesize(voice, text), jobs))
+        elapsed = time.perf_counter() - start
+    del voice
+    return {"latency": float(np.median(latencies)), "throughput": samples / 22050 / elapsed, "workers": workers}
+
+def pick(results):
+    """Mayor throughput entre las configuraciones con latencia cercana a la mejor"""
+    best_latency = min(result["latency"] for _, result in results)
+    eligible = [(config, result) for config, result in results
+                if result["latency"] <= best_latency * LATENCY_TOLERANCE]
+    return max(eligible, key=lambda item: item[1]["throughput"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Autotune de STT/TTS para esta máquina")
+    parser.add_argument("--output", default=get_env("TUNING_PROFILE", TUNING_PROFILE))
+    parser.add_argument("--whisper-model", default=get_env("WHISPER_MODEL", "large-v3-turbo"))
+    parser.add_argument("--voice", default="/root/.cache/piper/es_MX-claude-high.onnx")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="sólo int8 para STT")
+    parser.add_argument("--skip-stt", action="store_true")
+    parser.add_argument("--skip-tts", action="store_true")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    # Se conserva la sección que no se vuelve a medir (--skip-stt / --skip-tts)
+    try:
+        with open(args.output) as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        profile = {}
+    profile.update({"host": {"cpus": cores}, "created": time.strftime("%Y-%m-%dT%H:%M:%S")})
+    print(f"🔧 Autotune en {cores} CPUs")
+
+    if not args.skip_stt:
+        clips = load_clips()
+        print(f"\n📊 STT {args.whisper_model}, {len(clips)} fragmentos de prueba")
+        print(f"{'compute_type':>14} {'workers':>8} {'hilos':>6} {'latencia s':>11} {'audio s/s':>10}")
+        results = []
+        for config in stt_candidates(cores, args.quick):
+            try:
+                result = bench_stt(args.whisper_model, config, clips, args.rounds)
+            except Exception as e:
+                print(f"{config['compute_type']:>14} {config['num_workers']:>8} {config['cpu_threads']:>6}  ❌ {e}")
+                continue
+            results.append((config, result))
+            print(f"{config['compute_type']:>14} {config['num_workers']:>8} {config['cpu_threads']:>6} "
+                  f"{result['latency']:>11.3f} {result['throughput']:>10.2f}")
+        if results:
+            config, result = pick(results)
+            profile["stt"] = dict(config, latency=result["latency"], throughput=result["throughput"])
+            print(f"✅ STT: {config}")
+
+    if not args.skip_tts:
+        print(f"\n📊 TTS {os.path.basename(args.voice)}")
+        print(f"{'hilos':>6} {'workers':>8} {'latencia s':>11} {'audio s/s':>10}")
+        results = []
+        for threads in sorted({1, 2, 4, cores} & set(range(1, cores + 1))):
+            try:
+                result = bench_tts(args.voice, threads, cores, args.rounds)
+            except Exception as e:
+                print(f"{threads:>6}  ❌ {e}")
+                continue
+            results.append(({"intra_op_threads": threads, "workers": result["workers"]}, result))
+            print(f"{threads:>6} {result['workers']:>8} {result['latency']:>11.3f} {result['throughput']:>10.2f}")
+        if results:
+            config, result = pick(results)
+            profile["tts"] = dict(config, latency=result["latency"], throughput=result["throughput"])
+            print(f"✅ TTS: {config}")
+
+    with open(args.output, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(f"\n💾 Perfil escrito en {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del códec G.711 por tablas: frames de 20 ms (160 muestras a 8 kHz)
+"""
+import time
+import numpy as np
+from g711 import ulaw_decode, ulaw_encode, alaw_decode, alaw_encode
+
+FRAME_SAMPLES = 160
+FRAMES = 20000
+
+def bench(name, func, frames):
+    """Ejecuta `func` sobre cada frame y devuelve frames por milisegundo"""
+    func(frames[0])
+    start = time.perf_counter()
+    for frame in frames:
+        func(frame)
+    per_frame = (time.perf_counter() - start) / len(frames)
+    print(f"{name:<14} {per_frame * 1e6:8.2f} µs/frame  {1e-3 / per_frame:10.0f} frames/ms")
+    return 1e-3 / per_frame
+
+def bench_batch(name, func, data, frame_count):
+    """Ejecuta `func` sobre todos los frames concatenados (una llamada por lote)"""
+    func(data)
+    start = time.perf_counter()
+    func(data)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<14} {elapsed * 1e3:8.2f} ms/lote    {frame_count / (elapsed * 1e3):10.0f} frames/ms")
+
+def main():
+    rng = np.random.default_rng(0)
+    pcm = (rng.standard_normal(FRAMES * FRAME_SAMPLES) * 4000).astype(np.int16)
+    pcm_frames = np.split(pcm, FRAMES)
+    ulaw = ulaw_encode(pcm)
+    alaw = alaw_encode(pcm)
+    ulaw_frames = [ulaw[i:i + FRAME_SAMPLES] for i in range(0, len(ulaw), FRAME_SAMPLES)]
+    alaw_frames = [alaw[i:i + FRAME_SAMPLES] for i in range(0, len(alaw), FRAME_SAMPLES)]
+
+    print(f"📊 G.711: {FRAMES} frames de {FRAME_SAMPLES} muestras")
+    print("--- Frame a frame (camino RTP) ---")
+    bench("ulaw decode", ulaw_decode, ulaw_frames)
+    bench("ulaw encode", ulaw_encode, pcm_frames)
+    bench("alaw decode", alaw_decode, alaw_frames)
+    bench("alaw encode", alaw_encode, pcm_frames)
+    print("--- Lote completo ---")
+    bench_batch("ulaw decode", ulaw_decode, ulaw, FRAMES)
+    bench_batch("ulaw encode", ulaw_encode, pcm, FRAMES)
+    bench_batch("alaw decode", alaw_decode, alaw, FRAMES)
+    bench_batch("alaw encode", alaw_encode, pcm, FRAMES)
+
+if __name__ == "__main__":
+    main()
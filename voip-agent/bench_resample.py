@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark de remuestreo: FFT sobre toda la frase (scipy.signal.resample, el camino
+anterior) y scipy.signal.resample_poly directo vs. resample.py, de una vez (`resample`)
+y por chunks de 20 ms (`Resampler`)
+"""
+import time
+import numpy as np
+from scipy.signal import resample as fft_resample, resample_poly
+from resample import Resampler, resample, ratio, COMMON_RATES
+
+SECONDS = 3.07  # longitud arbitraria, como una frase real de TTS
+CHUNK_MS = 20
+ROUNDS = 20
+# Dentro de la banda telefónica y sin ciclos enteros en la frase (como la voz real)
+TONES = (311.7, 1013.3, 2791.1)
+ALIAS_TONE = 0.45  # fracción de la frecuencia de entrada, por encima del Nyquist de salida
+EDGE_MS = 20
+
+def tones(rate, freqs, seconds=SECONDS):
+    t = np.arange(int(rate * seconds)) / rate
+    return sum(np.sin(2 * np.pi * f * t) for f in freqs).astype(np.float32) / len(freqs)
+
+def snr_db(reference, signal):
+    n = min(len(reference), len(signal))
+    noise = np.sum((reference[:n] - signal[:n]) ** 2)
+    return 10 * np.log10(np.sum(reference[:n] ** 2) / max(noise, 1e-20))
+
+def fft_path(audio, in_rate, out_rate):
+    return fft_resample(audio, int(len(audio) * out_rate / in_rate))
+
+def poly_path(audio, in_rate, out_rate):
+    up, down = ratio(in_rate, out_rate)
+    return resample_poly(audio, up, down)
+
+def streaming_path(audio, in_rate, out_rate):
+    resampler = Resampler(in_rate, out_rate)
+    step = in_rate * CHUNK_MS // 1000
+    parts = [resampler.process(audio[i:i + step]) for i in range(0, len(audio), step)]
+    return np.concatenate(parts + [resampler.flush()])
+
+def timed(func, audio, in_rate, out_rate):
+    func(audio, in_rate, out_rate)  # calentamiento
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        func(audio, in_rate, out_rate)
+    return (time.perf_counter() - start) / ROUNDS / SECONDS
+
+def quality(func, in_rate, out_rate):
+    """SNR contra los tonos ideales (total y en los primeros/últimos 20 ms) y alias residual"""
+    ideal = tones(out_rate, TONES)
+    out = func(tones(in_rate, TONES), in_rate, out_rate)
+    edge = out_rate * EDGE_MS // 1000
+    # El filtro arranca y termina con ceros: se compara el interior contra el ideal
+    inner = slice(edge, len(ideal) - edge)
+    edges = np.concatenate([out[inner.stop:len(ideal)], out[:inner.start]])
+    ideal_edges = np.concatenate([ideal[inner.stop:], ideal[:inner.start]])
+    alias = None
+    if out_rate < in_rate:
+        leaked = func(tones(in_rate, [ALIAS_TONE * in_rate]), in_rate, out_rate)[inner]
+        alias = 20 * np.log10(max(np.sqrt(np.mean(leaked ** 2)) / np.sqrt(0.5), 1e-10))
+    return snr_db(ideal[inner], out[inner]), snr_db(ideal_edges, edges), alias
+
+def main():
+    paths = (("FFT", fft_path), ("resample_poly", poly_path), ("resample()", resample),
+             (f"chunks {CHUNK_MS} ms", streaming_path))
+    print(f"📊 Remuestreo de {SECONDS:.2f} s de audio, {ROUNDS} rondas por configuración")
+    print(f"{'conversión':>14} {'método':>14} {'µs por s audio':>15} {'SNR dB':>8} {'SNR bordes dB':>14} {'alias dB':>9}")
+    for in_rate, out_rate in COMMON_RATES:
+        audio = tones(in_rate, TONES)
+        for name, func in paths:
+            cost = timed(func, audio, in_rate, out_rate)
+            snr, edge_snr, alias = quality(func, in_rate, out_rate)
+            alias_text = f"{alias:>9.1f}" if alias is not None else f"{'-':>9}"
+            print(f"{f'{in_rate}->{out_rate}':>14} {name:>14} {cost * 1e6:>15.0f} {snr:>8.1f} {edge_snr:>14.1f} {alias_text}")
+    # Chunks de 20 ms: sólo el polifásico puede remuestrear mientras Piper genera
+    resampler = Resampler(22050, 8000)
+    frame = tones(22050, TONES, CHUNK_MS / 1000)
+    start = time.perf_counter()
+    for _ in range(1000):
+        resampler.process(frame)
+    print(f"\n⏱️ 22050->8000 por chunk de {CHUNK_MS} ms: {(time.perf_counter() - start) * 1e3:.1f} µs")
+
+if __name__ == "__main__":
+    main()
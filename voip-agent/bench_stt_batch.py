@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark de STT por micro-lotes: throughput y latencia p95 según ventana de lote y
+número de llamadas que terminan de hablar casi al mismo tiempo
+"""
+import asyncio
+import random
+import time
+import wave
+import numpy as np
+from scipy.signal import resample_poly
+from stt import STTWorker
+from stt_service import STTService
+from stt_batch import STTBatcher
+
+SAMPLE_RATE = 8000
+WINDOWS_MS = (0, 50, 100, 200, 400)
+CONCURRENCY = (1, 4, 8, 16)
+# Las llamadas terminan de hablar repartidas en este intervalo
+SPREAD_MS = 300
+ROUNDS = 3
+
+def load_utterances(paths=("test.wav", "test_audio.wav"), seconds=3):
+    """Expresiones de prueba a 8 kHz de ~3 s"""
+    utterances = []
+    for path in paths:
+        with wave.open(path) as wav_file:
+            rate = wav_file.getframerate()
+            audio = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+        audio = resample_poly(audio.astype(np.float32), SAMPLE_RATE, rate).astype(np.int16)
+        step = SAMPLE_RATE * seconds
+        utterances.extend(audio[i:i + step] for i in range(0, max(1, len(audio) - step + 1), step))
+    return utterances
+
+async def run_round(stt, window_ms, concurrency, utterances):
+    service = STTService(stt, max_queue=10 * concurrency, degrade_depth=10 * concurrency, deadline_ms=60000)
+    # Ventana 0: una pasada por expresión (sin lotes)
+    batcher = STTBatcher(service, window_ms=window_ms, max_batch=1 if window_ms == 0 else concurrency)
+    service.start()
+    latencies = []
+
+    async def caller(i):
+        await asyncio.sleep(random.uniform(0, SPREAD_MS / 1000))
+        start = time.perf_counter()
+        await batcher.transcribe(utterances[i % len(utterances)], SAMPLE_RATE)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[caller(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    await service.stop()
+    return elapsed, latencies
+
+async def main():
+    stt = STTWorker()
+    utterances = load_utterances()
+    audio_seconds = len(utterances[0]) / SAMPLE_RATE
+    print(f"📊 Whisper {stt.model_name}, {stt.num_workers} workers x {stt.cpu_threads} hilos, "
+          f"expresiones de {audio_seconds:.1f}s, llegadas en {SPREAD_MS} ms")
+    # Calentamiento
+    stt.transcribe_batch([(utterances[0], SAMPLE_RATE, None)])
+    print(f"{'llamadas':>8} {'ventana ms':>10} {'expr/s':>8} {'p50 s':>7} {'p95 s':>7}")
+    for concurrency in CONCURRENCY:
+        for window_ms in WINDOWS_MS:
+            total = 0.0
+            latencies = []
+            for _ in range(ROUNDS):
+                elapsed, round_latencies = await run_round(stt, window_ms, concurrency, utterances)
+                total += elapsed
+                latencies.extend(round_latencies)
+            throughput = concurrency * ROUNDS / total
+            print(f"{concurrency:>8} {window_ms:>10} {throughput:>8.2f} "
+                  f"{np.percentile(latencies, 50):>7.2f} {np.percentile(latencies, 95):>7.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
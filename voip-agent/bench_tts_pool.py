@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark de TTS: síntesis concurrentes por segundo con Piper en hilos (TTSWorker en
+un ThreadPoolExecutor, como antes) vs. el pool de procesos, y el retraso que sufre el
+event loop (ticks de 20 ms, el ritmo del RTP saliente) mientras se sintetiza
+"""
+import asyncio
+import concurrent.futures
+import time
+import numpy as np
+from tts import TTSWorker
+from tts_pool import TTSPool
+
+SAMPLE_RATE = 8000
+CONCURRENCY = (1, 2, 4, 8)
+THREADS = 4  # el executor compartido de VoIPAgent
+ROUNDS = 3
+TICK_MS = 20
+PHRASES = (
+    "Hola, gracias por llamar. ¿En qué puedo ayudarle?",
+    "Su cita quedó agendada para mañana a las diez de la mañana.",
+    "Un momento por favor, estoy revisando la información.",
+    "Nuestro horario es de lunes a viernes de nueve de la mañana a seis de la tarde.",
+)
+
+async def loop_lag(stop):
+    """Mayor retraso de un tick de 20 ms del event loop"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_MS / 1000)
+        worst = max(worst, time.perf_counter() - start - TICK_MS / 1000)
+    return worst
+
+async def run(synthesize, concurrency):
+    """Síntesis por segundo, p95 de latencia y retraso máximo del loop"""
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    latencies = []
+
+    async def caller(i):
+        for r in range(ROUNDS):
+            start = time.perf_counter()
+            await synthesize(PHRASES[(i + r) % len(PHRASES)])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[caller(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return concurrency * ROUNDS / elapsed, np.percentile(latencies, 95), await lag
+
+async def main():
+    loop = asyncio.get_event_loop()
+    tts = TTSWorker()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=THREADS)
+
+    async def threaded(text):
+        return await loop.run_in_executor(executor, tts.synthesize, text, SAMPLE_RATE)
+
+    pool = TTSPool()
+    await pool.start()
+
+    async def pooled(text):
+        return await pool.synthesize(text, SAMPLE_RATE)
+
+    # Calentamiento
+    await threaded(PHRASES[0])
+    await asyncio.gather(*[pooled(PHRASES[0]) for _ in range(pool.workers)])
+    print(f"📊 Piper {tts.voice.rsplit('/', 1)[-1]}: {THREADS} hilos vs. {pool.workers} procesos, "
+          f"{ROUNDS} frases por llamada")
+    print(f"{'concurrencia':>12} {'modo':>8} {'síntesis/s':>11} {'p95 s':>7} {'lag loop ms':>12}")
+    try:
+        for concurrency in CONCURRENCY:
+            results = {}
+            for name, synthesize in (("hilos", threaded), ("procesos", pooled)):
+                results[name] = await run(synthesize, concurrency)
+                rate, p95, lag = results[name]
+                print(f"{concurrency:>12} {name:>8} {rate:>11.2f} {p95:>7.2f} {lag * 1000:>12.1f}")
+            print(f"{'':>12} mejora: {results['procesos'][0] / results['hilos'][0]:.2f}x")
+    finally:
+        pool.stop()
+        executor.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Benchmark de VAD: costo de CPU por frame de 32 ms con inferencia por canal vs. por lotes
+"""
+import time
+import wave
+import numpy as np
+from scipy.signal import resample_poly
+from vad import VadController
+
+SAMPLE_RATE = 8000
+CHANNEL_COUNTS = (1, 10, 50, 100)
+ROUNDS = 50
+
+def load_frames(vad, path="test_tts.wav"):
+    """Audio de prueba a 8 kHz cortado en ventanas de VAD"""
+    with wave.open(path) as wav_file:
+        rate = wav_file.getframerate()
+        audio = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+    audio = resample_poly(audio.astype(np.float32) / 32768.0, SAMPLE_RATE, rate).astype(np.float32)
+    stream = vad.open_stream("bench", SAMPLE_RATE)
+    frames = [frame.copy() for frame in stream.frames(audio)]
+    vad.close_stream("bench")
+    return frames
+
+def bench_unbatched(vad, streams, frames):
+    start = time.process_time()
+    for r in range(ROUNDS):
+        for i, stream in enumerate(streams):
+            frame = frames[(r + i) % len(frames)]
+            prob, state = vad.infer(stream.prepare(frame), stream.state, SAMPLE_RATE)
+            stream.advance(float(prob[0][0]), state)
+    return (time.process_time() - start) / (ROUNDS * len(streams))
+
+def bench_batched(vad, streams, frames):
+    start = time.process_time()
+    for r in range(ROUNDS):
+        inputs = np.stack([stream.prepare(frames[(r + i) % len(frames)])[0] for i, stream in enumerate(streams)])
+        states = np.concatenate([stream.state for stream in streams], axis=1)
+        probs, new_states = vad.infer(inputs, states, SAMPLE_RATE)
+        for i, stream in enumerate(streams):
+            stream.advance(float(probs[i][0]), new_states[:, i:i + 1, :])
+    return (time.process_time() - start) / (ROUNDS * len(streams))
+
+def main():
+    vad = VadController()
+    frames = load_frames(vad)
+    print(f"📊 VAD silero @ {SAMPLE_RATE} Hz, {ROUNDS} ticks por configuración")
+    print(f"{'canales':>8} {'sin lotes µs/frame':>20} {'por lotes µs/frame':>20} {'mejora':>8}")
+    for count in CHANNEL_COUNTS:
+        streams = [vad.open_stream(f"ch-{i}", SAMPLE_RATE) for i in range(count)]
+        unbatched = bench_unbatched(vad, streams, frames)
+        streams = [vad.open_stream(f"ch-{i}", SAMPLE_RATE) for i in range(count)]
+        batched = bench_batched(vad, streams, frames)
+        print(f"{count:>8} {unbatched * 1e6:>20.1f} {batched * 1e6:>20.1f} {unbatched / batched:>7.1f}x")
+        # Presupuesto: todos los canales deben caber en un tick de 32 ms
+        print(f"{'':>8} CPU por tick: {unbatched * count * 1e3:.2f} ms sin lotes, {batched * count * 1e3:.2f} ms por lotes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+from abc import ABC, abstractmethod
+from collections import deque
+import numpy as np
+from utils import get_env
+
+# Decisiones que devuelve un endpointer tras cada chunk
+CONTINUE = "continue"
+SPECULATE = "speculate"  # primera pausa corta: lanzar STT especulativo
+CANCEL = "cancel"        # el llamante siguió hablando: descartar lo especulado
+END = "end"              # fin de turno
+
+class Endpointer(ABC):
+    """Decide el fin de turno de una llamada a partir de la secuencia voz/silencio.
+
+    `update` recibe si el chunk tuvo voz y su duración en segundos y devuelve una
+    decisión. Las subclases sólo definen `timeout` (silencio que cierra el turno).
+    """
+
+    def __init__(self, speculate_after=None):
+        self.speculate_after = speculate_after or float(get_env("ENDPOINT_SPECULATE_MS", 200)) / 1000
+        self.in_turn = False
+        self.silence = 0.0
+        self.speculating = False
+
+    @property
+    @abstractmethod
+    def timeout(self):
+        """Silencio (s) que cierra el turno."""
+
+    def on_pause(self, duration):
+        """Pausa dentro del turno (el llamante retomó la palabra)."""
+
+    def end_turn(self):
+        self.in_turn = False
+        self.silence = 0.0
+        self.speculating = False
+
+    def update(self, speech, duration):
+        if speech:
+            if self.in_turn and self.silence > 0:
+                self.on_pause(self.silence)
+            self.in_turn = True
+            self.silence = 0.0
+            if self.speculating:
+                self.speculating = False
+                return CANCEL
+            return CONTINUE
+        if not self.in_turn:
+            return CONTINUE
+        self.silence += duration
+        if self.silence >= self.timeout:
+            self.end_turn()
+            return END
+        if not self.speculating and self.silence >= self.speculate_after:
+            self.speculating = True
+            return SPECULATE
+        return CONTINUE
+
+class FixedEndpointer(Endpointer):
+    """Silencio fijo de fin de turno (comportamiento anterior: 1 s)."""
+
+    def __init__(self, silence=None, **kwargs):
+        super().__init__(**kwargs)
+        self.silence_timeout = silence or float(get_env("ENDPOINT_SILENCE_MS", 1000)) / 1000
+
+    @property
+    def timeout(self):
+        return self.silence_timeout
+
+class AdaptiveEndpointer(Endpointer):
+    """Silencio de fin de turno aprendido de las pausas del propio llamante.
+
+    Guarda las últimas pausas dentro de turno y usa su percentil 90 más un margen,
+    acotado a [min_silence, max_silence]. Hasta tener `min_pauses` muestras usa
+    `initial`. Quien hace pausas cortas recibe respuesta antes; quien piensa mientras
+    habla no es interrumpido.
+    """
+
+    def __init__(self, min_silence=None, max_silence=None, initial=None, margin=None,
+                 min_pauses=3, history=20, **kwargs):
+        super().__init__(**kwargs)
+        self.min_silence = min_silence or float(get_env("ENDPOINT_MIN_SILENCE_MS", 400)) / 1000
+        self.max_silence = max_silence or float(get_env("ENDPOINT_MAX_SILENCE_MS", 1200)) / 1000
+        self.initial = initial or float(get_env("ENDPOINT_INITIAL_SILENCE_MS", 700)) / 1000
+        self.margin = margin or float(get_env("ENDPOINT_MARGIN_MS", 150)) / 1000
+        self.min_pauses = min_pauses
+        self.pauses = deque(maxlen=history)
+        self.current_timeout = self.initial
+
+    @property
+    def timeout(self):
+        return self.current_timeout
+
+    def on_pause(self, duration):
+        self.pauses.append(duration)
+        if len(self.pauses) >= self.min_pauses:
+            learned = float(np.percentile(self.pauses, 90)) + self.margin
+            self.current_timeout = min(self.max_silence, max(self.min_silence, learned))
+
+ENDPOINTERS = {
+    "adaptive": AdaptiveEndpointer,
+    "fixed": FixedEndpointer,
+}
+
+def create_endpointer(kind=None, **kwargs):
+    """Endpointer configurado en ENDPOINTER ("adaptive" por defecto o "fixed")."""
+    kind = kind or get_env("ENDPOINTER", "adaptive")
+    if kind not in ENDPOINTERS:
+        raise ValueError(f"Endpointer desconocido: {kind}")
+    return ENDPOINTERS[kind](**kwargs)
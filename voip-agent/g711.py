@@ -0,0 +1,75 @@
+import numpy as np
+
+# Códec G.711 (μ-law / A-law) por tablas precalculadas:
+# decodificar es una indexación de 256 entradas y codificar una de 65536
+# entradas indexada por la muestra int16 vista como uint16.
+
+ULAW_BIAS = 0x84
+# Codificación sobre 14 bits como en la implementación de referencia (g711.c)
+ULAW_ENC_BIAS = 0x21
+ULAW_CLIP = 8159
+ULAW_SEG_END = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+ALAW_SEG_END = np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF])
+
+def _build_ulaw_decode():
+    u = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (u >> 4) & 0x07
+    mantissa = u & 0x0F
+    sample = (((mantissa << 3) + ULAW_BIAS) << exponent) - ULAW_BIAS
+    return np.where(u & 0x80, -sample, sample).astype(np.int16)
+
+def _build_ulaw_encode():
+    x = np.arange(65536, dtype=np.int32).astype(np.uint16).view(np.int16).astype(np.int32) >> 2
+    mask = np.where(x < 0, 0x7F, 0xFF)
+    pcm = np.minimum(np.abs(x), ULAW_CLIP) + ULAW_ENC_BIAS
+    seg = np.searchsorted(ULAW_SEG_END, pcm)
+    uval = (np.minimum(seg, 7) << 4) | ((pcm >> (seg + 1)) & 0x0F)
+    uval = np.where(seg >= 8, 0x7F, uval)
+    return (uval ^ mask).astype(np.uint8)
+
+def _build_alaw_decode():
+    a = np.arange(256, dtype=np.int32) ^ 0x55
+    t = (a & 0x0F) << 4
+    seg = (a & 0x70) >> 4
+    t = np.where(seg == 0, t + 8, t + 0x108)
+    t = np.where(seg > 1, t << np.maximum(seg - 1, 0), t)
+    return np.where(a & 0x80, t, -t).astype(np.int16)
+
+def _build_alaw_encode():
+    x = np.arange(65536, dtype=np.int32).astype(np.uint16).view(np.int16).astype(np.int32) >> 3
+    mask = np.where(x >= 0, 0xD5, 0x55)
+    pcm = np.where(x >= 0, x, -x - 1)
+    seg = np.searchsorted(ALAW_SEG_END, pcm)
+    shift = np.where(seg < 2, 1, seg)
+    aval = (np.minimum(seg, 7) << 4) | ((pcm >> shift) & 0x0F)
+    aval = np.where(seg >= 8, 0x7F, aval)
+    return (aval ^ mask).astype(np.uint8)
+
+ULAW_DECODE = _build_ulaw_decode()
+ULAW_ENCODE = _build_ulaw_encode()
+ALAW_DECODE = _build_alaw_decode()
+ALAW_ENCODE = _build_alaw_encode()
+
+def _as_codes(data):
+    if isinstance(data, np.ndarray):
+        return data.astype(np.uint8, copy=False)
+    return np.frombuffer(data, dtype=np.uint8)
+
+def _as_index(pcm):
+    return np.asarray(pcm, dtype=np.int16).view(np.uint16)
+
+def ulaw_decode(data):
+    """Decodifica bytes (o array uint8) μ-law a PCM int16."""
+    return ULAW_DECODE.take(_as_codes(data))
+
+def ulaw_encode(pcm):
+    """Codifica PCM int16 a bytes μ-law."""
+    return ULAW_ENCODE.take(_as_index(pcm)).tobytes()
+
+def alaw_decode(data):
+    """Decodifica bytes (o array uint8) A-law a PCM int16."""
+    return ALAW_DECODE.take(_as_codes(data))
+
+def alaw_encode(pcm):
+    """Codifica PCM int16 a bytes A-law."""
+    return ALAW_ENCODE.take(_as_index(pcm)).tobytes()
@@ -0,0 +1,121 @@
+import math
+import numpy as np
+from metrics import jitter_depth, jitter_late_packets, jitter_concealed_frames
+
+FRAME_MS = 20
+SEQ_MOD = 1 << 16
+TS_MOD = 1 << 32
+# Saltos de secuencia mayores a esto se tratan como reinicio del stream
+MAX_SEQ_JUMP = 200
+
+class JitterBuffer:
+    """Jitter buffer adaptativo por canal.
+
+    Reordena por número de secuencia, ajusta su profundidad al jitter medido
+    (estimador de RFC 3550) y oculta frames perdidos repitiendo el último frame
+    atenuado en lugar de entregar audio con huecos a VAD/STT.
+    """
+
+    def __init__(self, channel_id, sample_rate=8000, clock_rate=None, min_depth=1, max_depth=10, attenuation=0.5):
+        self.channel_id = channel_id
+        self.sample_rate = sample_rate
+        # Reloj de los timestamps RTP (distinto del muestreo en G.722/Opus)
+        self.clock_rate = clock_rate or sample_rate
+        self.frame_samples = sample_rate * FRAME_MS // 1000
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.attenuation = attenuation
+        self.target_depth = min_depth
+        self.packets = {}
+        self.next_seq = None
+        self.highest_seq = None
+        self.last_frame = None
+        self.lost_run = 0
+        self.jitter = 0.0  # en unidades del reloj RTP
+        self.last_arrival = None
+        self.last_timestamp = None
+        self.late = 0
+        self.concealed = 0
+
+    def _extend(self, seq):
+        """Extiende la secuencia de 16 bits para sobrevivir al wrap-around."""
+        if self.highest_seq is None:
+            return seq
+        delta = (seq - self.highest_seq) % SEQ_MOD
+        if delta >= SEQ_MOD // 2:
+            delta -= SEQ_MOD
+        return self.highest_seq + delta
+
+    def _update_jitter(self, timestamp, arrival):
+        if self.last_arrival is not None:
+            ts_delta = (timestamp - self.last_timestamp) % TS_MOD
+            if ts_delta >= TS_MOD // 2:
+                ts_delta -= TS_MOD
+            d = abs((arrival - self.last_arrival) * self.clock_rate - ts_delta)
+            self.jitter += (d - self.jitter) / 16
+        self.last_arrival = arrival
+        self.last_timestamp = timestamp
+        jitter_ms = self.jitter * 1000 / self.clock_rate
+        depth = 1 + math.ceil(3 * jitter_ms / FRAME_MS)
+        self.target_depth = max(self.min_depth, min(self.max_depth, depth))
+
+    def _reset(self, seq):
+        self.packets.clear()
+        self.next_seq = seq
+        self.highest_seq = seq
+        self.lost_run = 0
+
+    def _conceal(self):
+        """Frame de reemplazo: último frame atenuado; silencio tras varias pérdidas seguidas."""
+        self.concealed += 1
+        jitter_concealed_frames.inc()
+        self.lost_run += 1
+        if self.last_frame is None or self.lost_run > 3:
+            return np.zeros(self.frame_samples, dtype=np.int16)
+        gain = self.attenuation ** self.lost_run
+        return (self.last_frame * gain).astype(np.int16)
+
+    def push(self, seq, timestamp, pcm, arrival):
+        """Inserta un frame decodificado y devuelve la lista de frames listos en orden."""
+        ext_seq = self._extend(seq)
+        if self.next_seq is None or abs(ext_seq - self.highest_seq) > MAX_SEQ_JUMP:
+            self._reset(ext_seq)
+        self._update_jitter(timestamp, arrival)
+
+        if ext_seq < self.next_seq or ext_seq in self.packets:
+            self.late += 1
+            jitter_late_packets.inc()
+            return []
+        self.packets[ext_seq] = pcm
+        self.highest_seq = max(self.highest_seq, ext_seq)
+
+        ready = []
+        while True:
+            frame = self.packets.pop(self.next_seq, None)
+            if frame is not None:
+                self.last_frame = frame
+                self.lost_run = 0
+            elif self.highest_seq - self.next_seq > self.target_depth:
+                # El hueco lleva más de `target_depth` frames: se da por perdido
+                frame = self._conceal()
+            else:
+                break
+            ready.append(frame)
+            self.next_seq += 1
+        jitter_depth.labels(channel=self.channel_id).set(self.depth)
+        return ready
+
+    @property
+    def depth(self):
+        """Frames retenidos esperando reordenamiento."""
+        return len(self.packets)
+
+    @property
+    def jitter_ms(self):
+        return self.jitter * 1000 / self.clock_rate
+
+    def close(self):
+        try:
+            jitter_depth.remove(self.channel_id)
+        except KeyError:
+            pass
@@ -1,4 +1,4 @@
-from prometheus_client import Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
 # Métricas de latencia
 stt_latency = Gauge('stt_processing_time_seconds', 'Tiempo de procesamiento STT en segundos')
@@ -9,3 +9,51 @@ def update_metrics(stt_time, llm_time, tts_time):
     stt_latency.set(stt_time)
     llm_latency.set(llm_time)
     tts_latency.set(tts_time)
+
+# Modelos cargados en el registro compartido
+model_resident_bytes = Gauge('model_resident_bytes', 'Memoria residente atribuida a cada modelo', ['model'])
+
+# Jitter buffer de audio entrante
+jitter_depth = Gauge('jitter_buffer_depth_frames', 'Frames retenidos en el jitter buffer', ['channel'])
+jitter_late_packets = Counter('jitter_buffer_late_packets_total', 'Paquetes RTP descartados por llegar tarde o duplicados')
+jitter_concealed_frames = Counter('jitter_buffer_concealed_frames_total', 'Frames perdidos reemplazados por ocultamiento')
+
+# Servicio de STT: cola con control de admisión
+stt_queue_depth = Gauge('stt_queue_depth', 'Peticiones de STT en cola', ['kind'])
+stt_queue_wait = Histogram('stt_queue_wait_seconds', 'Espera en cola antes de decodificar', ['kind'],
+                           buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5))
+stt_real_time_factor = Histogram('stt_real_time_factor', 'Tiempo de decodificación / duración del audio', ['kind'],
+                                 buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2))
+stt_rejected = Counter('stt_requests_rejected_total', 'Peticiones de STT rechazadas o descartadas', ['kind', 'reason'])
+stt_batch_size = Histogram('stt_batch_size', 'Expresiones decodificadas por pasada de Whisper',
+                           buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+
+# STT por niveles: modelo rápido con escalado al completo
+stt_tier_latency = Histogram('stt_tier_latency_seconds', 'Tiempo de cada pasada de STT por nivel', ['tier'],
+                             buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2, 5))
+stt_tier_requests = Counter('stt_tier_requests_total', 'Expresiones decodificadas por nivel', ['tier'])
+stt_escalations = Counter('stt_escalations_total', 'Expresiones escaladas al modelo completo', ['reason'])
+
+# Fin de turno adaptativo y STT especulativo
+endpoint_silence_timeout = Histogram('endpoint_silence_timeout_seconds', 'Silencio que cerró cada turno',
+                                     buckets=(0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 1.0, 1.2))
+endpoint_speculations = Counter('endpoint_speculations_total', 'STT especulativos por resultado', ['outcome'])
+
+# Estrategia de decodificación de Whisper: greedy con respaldo a beam search
+stt_decode_seconds = Histogram('stt_decode_seconds', 'Tiempo de decodificación por expresión o lote', ['path'],
+                               buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2, 5))
+stt_decode_fallbacks = Counter('stt_decode_fallbacks_total', 'Decodificaciones greedy repetidas con beam search', ['reason'])
+
+# Filtro de turnos entre STT y LLM
+turn_gate_suppressed = Counter('turn_gate_suppressed_total', 'Turnos descartados antes del LLM', ['reason'])
+turn_gate_saved_seconds = Counter('turn_gate_saved_seconds_total', 'Segundos estimados de LLM/TTS ahorrados', ['stage'])
+
+# Cache de TTS en disco (direccionada por contenido)
+tts_cache_lookups = Counter('tts_cache_lookups_total', 'Consultas a la cache de TTS', ['result'])
+tts_cache_bytes = Gauge('tts_cache_bytes', 'Bytes de audio en la cache de TTS')
+tts_cache_entries = Gauge('tts_cache_entries', 'Frases en la cache de TTS')
+tts_cache_evictions = Counter('tts_cache_evictions_total', 'Frases expulsadas de la cache de TTS por presupuesto')
+tts_splice_chars = Counter('tts_splice_chars_total', 'Caracteres de respuestas por plantilla según su origen', ['part'])
+tts_pool_queue_depth = Gauge('tts_pool_queue_depth', 'Peticiones pendientes por worker del pool de TTS', ['worker'])
+tts_pool_requests = Counter('tts_pool_requests_total', 'Peticiones al pool de TTS', ['kind'])
+tts_pool_worker_deaths = Counter('tts_pool_worker_deaths_total', 'Workers del pool de TTS que terminaron inesperadamente')
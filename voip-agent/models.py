@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from utils import setup_log
+from metrics import model_resident_bytes
+
+def resident_bytes():
+    """Memoria residente (RSS) actual del proceso."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def load_whisper(name, device="cpu", compute_type="int8", **options):
+    import faster_whisper
+    return faster_whisper.WhisperModel(name, device=device, compute_type=compute_type, **options)
+
+def load_piper(path, intra_op_threads=0, **options):
+    """Carga una voz Piper; con `intra_op_threads` se recrea la sesión ONNX con ese número
+    de hilos (Piper no expone las SessionOptions de onnxruntime)."""
+    from piper import PiperVoice
+    voice = PiperVoice.load(path, **options)
+    if intra_op_threads:
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = intra_op_threads
+        session_options.inter_op_num_threads = 1
+        voice.session = onnxruntime.InferenceSession(
+            path, sess_options=session_options, providers=["CPUExecutionProvider"]
+        )
+    return voice
+
+class ModelRegistry:
+    """Registro de modelos del proceso: cada modelo (silero, Whisper, Piper) se carga una
+    sola vez, bajo demanda y de forma thread-safe, y todos los componentes comparten el
+    mismo handle. El estado por sesión (p. ej. el estado oculto de silero) vive en cada
+    llamada, no en el modelo.
+    """
+
+    def __init__(self):
+        self.logger = setup_log("models")
+        self.models = {}
+        self.resident = {}
+        self.load_seconds = {}
+        # Las cargas se serializan para que la medición de RSS de cada modelo sea fiable
+        self.load_lock = threading.Lock()
+
+    def get(self, key, loader):
+        """Devuelve el modelo `key`, cargándolo con `loader()` la primera vez."""
+        model = self.models.get(key)
+        if model is not None:
+            return model
+        with self.load_lock:
+            model = self.models.get(key)
+            if model is not None:
+                return model
+            self.logger.info(f"Cargando modelo {key}...")
+            rss_before = resident_bytes()
+            start = time.perf_counter()
+            model = loader()
+            self.load_seconds[key] = time.perf_counter() - start
+            self.resident[key] = max(0, resident_bytes() - rss_before)
+            self.models[key] = model
+            model_resident_bytes.labels(model=key).set(self.resident[key])
+            self.logger.info(f"Modelo {key} cargado en {self.load_seconds[key]:.2f}s, "
+                             f"{self.resident[key] / 2**20:.1f} MiB residentes")
+        return model
+
+    def silero(self):
+        """silero-vad en ONNX: una sesión compartida, estado por VadStream."""
+        def load():
+            import silero_vad
+            return silero_vad.load_silero_vad(onnx=True)
+        return self.get("silero-vad", load)
+
+    def whisper(self, name, device="cpu", compute_type="int8", **options):
+        """faster-whisper; una instancia por combinación de modelo y parámetros."""
+        suffix = ",".join(f"{k}={v}" for k, v in sorted(options.items()))
+        key = f"whisper:{name}:{device}:{compute_type}" + (f":{suffix}" if suffix else "")
+        return self.get(key, lambda: load_whisper(name, device, compute_type, **options))
+
+    def piper(self, path, intra_op_threads=0, **options):
+        """Voz Piper; la sesión ONNX se comparte entre síntesis."""
+        key = f"piper:{os.path.basename(path)}" + (f":threads={intra_op_threads}" if intra_op_threads else "")
+        return self.get(key, lambda: load_piper(path, intra_op_threads, **options))
+
+    def memory_report(self):
+        """Bytes residentes atribuidos a cada modelo cargado."""
+        return dict(self.resident)
+
+registry = ModelRegistry()
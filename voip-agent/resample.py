@@ -0,0 +1,114 @@
+from functools import lru_cache
+from math import gcd
+import numpy as np
+from scipy.signal import firwin, resample_poly
+
+# Conversiones del agente: Piper -> teléfono, banda ancha <-> estrecha y audio de 48 kHz
+COMMON_RATES = ((22050, 8000), (22050, 16000), (16000, 8000), (8000, 16000), (48000, 8000))
+# Salidas calculadas por bloque dentro de un chunk
+BLOCK = 2048
+
+def ratio(in_rate, out_rate):
+    divisor = gcd(in_rate, out_rate)
+    return out_rate // divisor, in_rate // divisor
+
+@lru_cache(maxsize=None)
+def lowpass(up, down):
+    """Filtro paso bajo FIR que diseña scipy.signal.resample_poly (ventana Kaiser), sin el
+    factor `up` que resample_poly aplica; se diseña una vez por conversión."""
+    max_rate = max(up, down)
+    h = firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0))
+    h.setflags(write=False)
+    return h
+
+@lru_cache(maxsize=None)
+def polyphase_filter(up, down):
+    """Filtro de `lowpass` dividido en `up` fases de T coeficientes:
+    phases[p, t] = h[p + t * up]. Devuelve (phases, half_len)."""
+    h = lowpass(up, down) * up
+    half_len = (len(h) - 1) // 2
+    taps = -(-len(h) // up)
+    h = np.concatenate([h, np.zeros(taps * up - len(h))])
+    phases = np.ascontiguousarray(h.reshape(taps, up).T, dtype=np.float32)
+    return phases, half_len
+
+class Resampler:
+    """Remuestreo polifásico racional con estado, para procesar audio por chunks.
+
+    Sólo calcula las muestras de salida (nunca la señal sobremuestreada): cada salida es
+    el producto de T coeficientes de una fase por T muestras de entrada. Guarda entre
+    llamadas las últimas muestras de entrada y la posición de la siguiente salida, así
+    procesar por chunks da el mismo resultado que procesar todo junto (y que
+    `scipy.signal.resample_poly`, incluida la compensación del retardo del filtro).
+    """
+
+    def __init__(self, in_rate, out_rate):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.up, self.down = ratio(in_rate, out_rate)
+        self.phases, self.half_len = polyphase_filter(self.up, self.down)
+        self.taps = self.phases.shape[1]
+        self.reset()
+
+    def reset(self):
+        # buffer[0] corresponde a la muestra de entrada de índice global `base`
+        self.buffer = np.zeros(self.taps - 1, dtype=np.float32)
+        self.base = -(self.taps - 1)
+        self.received = 0
+        self.produced = 0
+
+    def _outputs(self, available):
+        """Salidas calculables con las entradas [0, available)."""
+        # La salida n usa la entrada i = (n * down + half_len) // up y las T - 1 anteriores
+        last = (available * self.up - 1 - self.half_len) // self.down
+        return max(0, last + 1 - self.produced)
+
+    def _run(self, count):
+        # Por bloques: las matrices (salidas x T) de un bloque caben en caché
+        out = np.empty(count, dtype=np.float32)
+        offsets = np.arange(self.taps)
+        for start in range(0, count, BLOCK):
+            n = np.arange(self.produced + start, self.produced + min(count, start + BLOCK), dtype=np.int64)
+            m = n * self.down + self.half_len
+            index = m // self.up - self.base
+            window = self.buffer[index[:, None] - offsets]
+            out[start:start + len(n)] = np.einsum("ij,ij->i", self.phases[m % self.up], window)
+        self.produced += count
+        # Conservar sólo lo necesario para las próximas salidas
+        keep_from = (self.produced * self.down + self.half_len) // self.up - (self.taps - 1) - self.base
+        if keep_from > 0:
+            self.buffer = self.buffer[keep_from:]
+            self.base += keep_from
+        return out
+
+    def process(self, samples):
+        """Consume un chunk (int16 o float) y devuelve las muestras de salida float32 disponibles."""
+        if samples.dtype != np.float32:
+            samples = samples.astype(np.float32)
+        if len(samples):
+            self.buffer = np.concatenate([self.buffer, samples])
+            self.received += len(samples)
+        return self._run(self._outputs(self.received))
+
+    def flush(self):
+        """Completa la salida como si la entrada terminara con ceros; después se reinicia."""
+        total = -(-self.received * self.up // self.down)
+        pad = (total * self.down + self.half_len) // self.up + self.taps - self.base - len(self.buffer)
+        if pad > 0:
+            self.buffer = np.concatenate([self.buffer, np.zeros(pad, dtype=np.float32)])
+        out = self._run(max(0, total - self.produced))
+        self.reset()
+        return out
+
+def resample(samples, in_rate, out_rate):
+    """Remuestrea un buffer completo (float32). Con todo el audio disponible resample_poly
+    (upfirdn en C) es más rápido que `Resampler`, que queda para el audio por chunks."""
+    if samples.dtype != np.float32:
+        samples = samples.astype(np.float32)
+    if in_rate == out_rate:
+        return samples
+    up, down = ratio(in_rate, out_rate)
+    return resample_poly(samples, up, down, window=lowpass(up, down)).astype(np.float32, copy=False)
+
+for _in_rate, _out_rate in COMMON_RATES:
+    polyphase_filter(*ratio(_in_rate, _out_rate))
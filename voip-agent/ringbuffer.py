@@ -0,0 +1,93 @@
+import numpy as np
+
+class AudioRingBuffer:
+    """Ring buffer int16 de capacidad fija por llamada.
+
+    Se reserva una sola vez y cada muestra se escribe dos veces (en i e i + capacidad),
+    así cualquier ventana de hasta `capacity` muestras es contigua y se entrega como
+    vista sin copia. Al llenarse sobrescribe lo más antiguo. Las posiciones son
+    absolutas (total de muestras escritas).
+    """
+
+    __slots__ = ("capacity", "pre_roll", "buffer", "write_pos", "utterance_start", "overruns")
+
+    def __init__(self, capacity, pre_roll=0):
+        if pre_roll > capacity:
+            raise ValueError("pre_roll no puede superar la capacidad")
+        self.capacity = capacity
+        self.pre_roll = pre_roll
+        self.buffer = np.zeros(2 * capacity, dtype=np.int16)
+        self.write_pos = 0
+        self.utterance_start = None
+        self.overruns = 0
+
+    @property
+    def nbytes(self):
+        """Memoria reservada por el buffer."""
+        return self.buffer.nbytes
+
+    @property
+    def oldest(self):
+        """Posición absoluta de la muestra más antigua aún disponible."""
+        return max(0, self.write_pos - self.capacity)
+
+    def write(self, samples):
+        """Agrega muestras; si no caben, se descartan las más antiguas."""
+        n = len(samples)
+        if n == 0:
+            return
+        if n > self.capacity:
+            samples = samples[-self.capacity:]
+            self.write_pos += n - self.capacity
+            n = self.capacity
+        start = self.write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        buf = self.buffer
+        cap = self.capacity
+        buf[start:start + first] = samples[:first]
+        buf[start + cap:start + cap + first] = samples[:first]
+        if first < n:
+            rest = n - first
+            buf[:rest] = samples[first:]
+            buf[cap:cap + rest] = samples[first:]
+        self.write_pos += n
+        if self.utterance_start is not None and self.utterance_start < self.oldest:
+            # La expresión superó la capacidad: se pierde su inicio
+            self.overruns += 1
+            self.utterance_start = self.oldest
+
+    def start_utterance(self):
+        """Marca el inicio de una expresión incluyendo el pre-roll ya escrito."""
+        self.utterance_start = max(self.oldest, self.write_pos - self.pre_roll)
+
+    @property
+    def active(self):
+        return self.utterance_start is not None
+
+    def utterance_length(self, end=None):
+        if self.utterance_start is None:
+            return 0
+        end = self.write_pos if end is None else end
+        return max(0, end - self.utterance_start)
+
+    def view(self, start, end):
+        """Vista sin copia de las muestras en [start, end) (posiciones absolutas)."""
+        start = max(start, self.oldest)
+        end = min(end, self.write_pos)
+        if end <= start:
+            return self.buffer[:0]
+        offset = start % self.capacity
+        return self.buffer[offset:offset + end - start]
+
+    def utterance(self, end=None):
+        """Vista de la expresión actual hasta `end` (por defecto, lo último escrito)."""
+        if self.utterance_start is None:
+            return self.buffer[:0]
+        return self.view(self.utterance_start, self.write_pos if end is None else end)
+
+    def end_utterance(self):
+        self.utterance_start = None
+
+    def reset(self):
+        self.write_pos = 0
+        self.utterance_start = None
@@ -1,76 +1,154 @@
-import asyncio
 import numpy as np
-import opuslib
-import silero_vad
-from utils import setup_log
-import os
+from collections import namedtuple
+from g711 import ulaw_decode, ulaw_encode, alaw_decode, alaw_encode
+from utils import get_env, setup_log
 
-class RTPProcessor:
-    def __init__(self, sample_rate=8000):
-        self.logger = setup_log(__name__)
+# Códecs opcionales: opuslib (pip install opuslib) y G722 (pip install G722)
+try:
+    import opuslib
+except ImportError:
+    opuslib = None
+try:
+    from G722 import G722
+except ImportError:
+    G722 = None
+
+FRAME_MS = 20
+
+CodecInfo = namedtuple("CodecInfo", ["sample_rate", "clock_rate", "payload_type", "stateful"])
+
+# Formatos ExternalMedia soportados. G.722 usa reloj RTP de 8 kHz aunque muestrea a 16 kHz
+# (RFC 3551) y Opus siempre usa reloj de 48 kHz.
+CODECS = {
+    "slin": CodecInfo(8000, 8000, None, False),
+    "slin16": CodecInfo(16000, 16000, None, False),
+    "ulaw": CodecInfo(8000, 8000, 0, False),
+    "alaw": CodecInfo(8000, 8000, 8, False),
+    "g722": CodecInfo(16000, 8000, 9, True),
+    "opus": CodecInfo(None, 48000, None, True),
+}
+
+def decode_slin(payload):
+    """slin en RTP viaja en orden de red (big-endian)."""
+    return np.frombuffer(payload, dtype=">i2").astype(np.int16)
+
+def encode_slin(pcm):
+    return pcm.astype(">i2").tobytes()
+
+STATELESS_CODECS = {
+    "slin": (decode_slin, encode_slin),
+    "slin16": (decode_slin, encode_slin),
+    "ulaw": (ulaw_decode, ulaw_encode),
+    "alaw": (alaw_decode, alaw_encode),
+}
+
+class CodecSession:
+    """Estado de códec de una llamada: codificador y decodificador propios, tomados del pool."""
+
+    def __init__(self, channel_id, codec, sample_rate, encoder=None, decoder=None):
+        info = CODECS[codec]
+        self.channel_id = channel_id
+        self.codec = codec
         self.sample_rate = sample_rate
-        self.encoder = opuslib.Encoder(fs=sample_rate, channels=1, application=opuslib.APPLICATION_VOIP)
-        self.encoder.bitrate = 20000
-        self.vad_model = silero_vad.load_silero_vad()
-        self.logger.info(f"RTPProcessor inicializado con sample_rate: {sample_rate}")
+        self.clock_rate = info.clock_rate
+        self.payload_type = info.payload_type
+        self.frame_samples = sample_rate * FRAME_MS // 1000
+        # Muestras de reloj RTP por frame de 20 ms
+        self.timestamp_step = info.clock_rate * FRAME_MS // 1000
+        self.encoder = encoder
+        self.decoder = decoder
+        if codec in STATELESS_CODECS:
+            self._decode, self._encode = STATELESS_CODECS[codec]
+
+    def decode(self, payload):
+        """Payload RTP -> PCM int16."""
+        if self.codec == "opus":
+            # Tamaño máximo de paquete Opus: 120 ms
+            pcm = self.decoder.decode(bytes(payload), self.sample_rate * 120 // 1000)
+            return np.frombuffer(pcm, dtype=np.int16)
+        if self.codec == "g722":
+            return np.asarray(self.decoder.decode(bytes(payload)), dtype=np.int16)
+        return self._decode(payload)
 
     def encode(self, pcm):
-        """Codificar audio PCM a Opus."""
-        self.logger.info("Codificando audio para RTP")
-        try:
-            return self.encoder.encode(pcm.astype(np.int16).tobytes(), frame_size=len(pcm))
-        except Exception as e:
-            self.logger.error(f"Error codificando audio: {e}")
-            return None
-
-    def vad_process(self, pcm):
-        """Procesar audio con VAD para detectar voz."""
-        try:
-            if pcm.dtype != np.float32:
-                audio = pcm.astype(np.float32) / 32768.0
-            else:
-                audio = pcm
-            speech_timestamps = silero_vad.get_speech_timestamps(audio, self.vad_model, sampling_rate=self.sample_rate)
-            self.logger.debug(f"VAD detectó {len(speech_timestamps)} segmentos de voz")
-            return len(speech_timestamps) > 0
-        except Exception as e:
-            self.logger.error(f"Error en VAD: {e}")
-            return False
-
-    def decode(self, opus_data, frame_size=160):
-        """Decodificar audio Opus a PCM."""
-        try:
-            decoder = opuslib.Decoder(fs=self.sample_rate, channels=1)
-            return decoder.decode(opus_data, frame_size)
-        except Exception as e:
-            self.logger.error(f"Error decodificando audio: {e}")
-            return None
-
-    async def receive_audio(self, channel, duration=5):
-        """Capturar audio entrante desde el canal PJSIP."""
-        try:
-            self.logger.info(f"Iniciando captura de audio RTP para canal {channel.id}")
-            recording_name = f"recording_{channel.id}"
-            recording_file = f"/var/spool/asterisk/recording/{recording_name}.slin"
-            # Crear directorio si no existe
-            os.makedirs(os.path.dirname(recording_file), exist_ok=True)
-            await channel.record(
-                name=recording_name,
-                format="slin",
-                maxDurationSeconds=duration,
-                maxSilenceSeconds=2,
-                ifExists="overwrite"
-            )
-            self.logger.info(f"Grabación iniciada: {recording_file}")
-            await asyncio.sleep(duration + 1)
-            if not os.path.exists(recording_file):
-                self.logger.error(f"Archivo de grabación no encontrado: {recording_file}")
-                return None
-            with open(recording_file, 'rb') as f:
-                audio_data = np.frombuffer(f.read(), dtype=np.int16)
-            self.logger.info(f"Audio capturado: {len(audio_data)} samples")
-            os.unlink(recording_file)
-            return audio_data
-        except Exception as e:
-            self.logger.error(f"Error capturando audio RTP: {e}")
-            return None
+        """PCM int16 -> payload RTP."""
+        if self.codec == "opus":
+            return self.encoder.encode(pcm.astype(np.int16).tobytes(), len(pcm))
+        if self.codec == "g722":
+            return bytes(self.encoder.encode(pcm.astype(np.int16)))
+        return self._encode(pcm)
+
+class CodecPool:
+    """Pool de códecs por (códec, sample_rate) y sesiones de códec por canal.
+
+    Los codificadores/decodificadores Opus se crean una vez y se reutilizan entre
+    llamadas (se reinician con reset_state). G.722 no expone reinicio de su estado
+    ADPCM, así que se crea uno por sesión y se descarta al cerrarla. En ningún caso
+    se instancia nada en el camino por paquete.
+    """
+
+    def __init__(self):
+        self.logger = setup_log(__name__)
+        self.opus_rate = int(get_env("OPUS_SAMPLE_RATE", 16000))
+        self.opus_bitrate = int(get_env("OPUS_BITRATE", 20000))
+        self.pool = {}
+        self.sessions = {}
+        self.created = 0
+
+    def sample_rate_for(self, codec):
+        info = CODECS[codec]
+        return info.sample_rate or self.opus_rate
+
+    def _create(self, codec, sample_rate, direction):
+        self.created += 1
+        if codec == "opus":
+            if opuslib is None:
+                raise RuntimeError("opuslib no disponible para el códec opus")
+            if direction == "encoder":
+                encoder = opuslib.Encoder(fs=sample_rate, channels=1, application=opuslib.APPLICATION_VOIP)
+                encoder.bitrate = self.opus_bitrate
+                return encoder
+            return opuslib.Decoder(fs=sample_rate, channels=1)
+        if codec == "g722":
+            if G722 is None:
+                raise RuntimeError("G722 no disponible para el códec g722 (pip install G722)")
+            return G722(sample_rate, 64000)
+        raise ValueError(f"Códec sin estado: {codec}")
+
+    def _acquire(self, codec, sample_rate, direction):
+        free = self.pool.get((codec, sample_rate, direction))
+        if free:
+            return free.pop()
+        return self._create(codec, sample_rate, direction)
+
+    def _release(self, codec, sample_rate, direction, state):
+        if state is None:
+            return
+        if hasattr(state, "reset_state"):
+            state.reset_state()
+        elif codec == "g722":
+            # G.722 no expone reset: se descarta para no arrastrar el estado ADPCM
+            return
+        self.pool.setdefault((codec, sample_rate, direction), []).append(state)
+
+    def open_session(self, channel_id, codec="ulaw"):
+        """Crea la sesión de códec de un canal con estado tomado del pool."""
+        if codec not in CODECS:
+            raise ValueError(f"Códec no soportado: {codec}")
+        sample_rate = self.sample_rate_for(codec)
+        encoder = decoder = None
+        if CODECS[codec].stateful:
+            encoder = self._acquire(codec, sample_rate, "encoder")
+            decoder = self._acquire(codec, sample_rate, "decoder")
+        session = CodecSession(channel_id, codec, sample_rate, encoder, decoder)
+        self.sessions[channel_id] = session
+        self.logger.info(f"Sesión de códec {codec}@{sample_rate} Hz abierta para canal {channel_id}")
+        return session
+
+    def close_session(self, channel_id):
+        """Devuelve el estado de códec del canal al pool."""
+        session = self.sessions.pop(channel_id, None)
+        if session is None:
+            return
+        self._release(session.codec, session.sample_rate, "encoder", session.encoder)
+        self._release(session.codec, session.sample_rate, "decoder", session.decoder)
@@ -2,33 +2,127 @@ import asyncio
 import numpy as np
 import os
 import logging
-from utils import setup_log
+from utils import get_env, setup_log
+from rtp_stream import RTPSession, RTPIngressProtocol, RTPPlayback, FRAME_MS
+from rtp import CodecPool
 
 class RTPProcessor:
     def __init__(self):
         self.logger = setup_log("rtp")
-        self.sample_rate = 8000
+        # G.711 nativo evita que Asterisk transcodifique a slin en cada llamada;
+        # slin16/g722/opus dan un camino de 16 kHz de punta a punta
+        self.media_format = get_env("RTP_MEDIA_FORMAT", "ulaw")
+        self.codecs = CodecPool()
+        self.sample_rate = self.codecs.sample_rate_for(self.media_format)
         self.logger.info(f"RTPProcessor inicializado con sample_rate: {self.sample_rate}")
-        # Manejar grabaciones activas para evitar conflictos
+        self.recording_dir = get_env("RECORDING_DIR", "/var/spool/asterisk/recording")
+        # Estado de grabación por canal: cada llamada sólo espera a sus propias grabaciones
         self.active_recordings = {}
-        self.recording_lock = asyncio.Lock()
+        self.recording_locks = {}
+        # Streams RTP por canal (ExternalMedia)
+        self.sessions = {}
+        self.ingress = None
+        self.transport = None
+        self.out_addr = None
+        self.out_payload_type = int(get_env("RTP_OUT_PAYLOAD_TYPE", 118))
+        self.playbacks = {}
+
+    async def start(self, host, port, out_addr=None):
+        """Abre el socket UDP donde Asterisk envía el RTP de los canales ExternalMedia."""
+        loop = asyncio.get_event_loop()
+        self.transport, self.ingress = await loop.create_datagram_endpoint(
+            RTPIngressProtocol, local_addr=(host, port)
+        )
+        # Destino por defecto del audio saliente si aún no se conoce el origen RTP de Asterisk
+        self.out_addr = out_addr
+        self.logger.info(f"Receptor RTP escuchando en {host}:{port}")
+
+    async def open_stream(self, channel_id, external_channel):
+        """Registra el stream ExternalMedia de un canal usando la dirección RTP local de Asterisk."""
+        session = RTPSession(channel_id, self.codecs.open_session(channel_id, self.media_format))
+        remote_addr = None
+        try:
+            address = await external_channel.getChannelVar(variable="UNICASTRTP_LOCAL_ADDRESS")
+            port = await external_channel.getChannelVar(variable="UNICASTRTP_LOCAL_PORT")
+            remote_addr = (address['value'], int(port['value']))
+        except Exception as e:
+            self.logger.warning(f"No se obtuvo dirección RTP de {external_channel.id}, se asociará al primer paquete: {e}")
+        self.ingress.bind(session, remote_addr)
+        self.sessions[channel_id] = session
+        self.logger.info(f"Stream RTP abierto para canal {channel_id} (origen {remote_addr})")
+        return session
+
+    def start_playback(self, channel_id):
+        """Inicia una reproducción RTP en streaming hacia el canal; el audio se agrega con write()."""
+        session = self.sessions.get(channel_id)
+        if session is None or self.transport is None:
+            return None
+        self.stop_playback(channel_id)
+        remote_addr = session.remote_addr or self.out_addr
+        if remote_addr is None:
+            self.logger.error(f"Sin destino RTP para canal {channel_id}")
+            return None
+        payload_type = session.payload_type
+        if payload_type is None:
+            payload_type = session.codec.payload_type if session.codec.payload_type is not None else self.out_payload_type
+        playback = RTPPlayback(self.transport, session, remote_addr, payload_type)
+        self.playbacks[channel_id] = playback
+        task = asyncio.create_task(playback.run())
+
+        def on_done(_):
+            if self.playbacks.get(channel_id) is playback:
+                del self.playbacks[channel_id]
+
+        task.add_done_callback(on_done)
+        return playback
+
+    def play(self, channel_id, pcm):
+        """Reproduce un buffer PCM completo por RTP."""
+        playback = self.start_playback(channel_id)
+        if playback is not None:
+            playback.write(pcm)
+            playback.finish()
+        return playback
+
+    def stop_playback(self, channel_id):
+        playback = self.playbacks.pop(channel_id, None)
+        if playback is not None:
+            playback.stop()
+
+    def close_stream(self, channel_id):
+        self.stop_playback(channel_id)
+        session = self.sessions.pop(channel_id, None)
+        if session is None:
+            return
+        session.close()
+        self.codecs.close_session(channel_id)
+        if self.ingress:
+            self.ingress.unbind(session)
+        jitter = session.jitter_buffer
+        self.logger.info(f"Stream RTP cerrado para canal {channel_id}: {session.packets} paquetes, {session.dropped} descartados, "
+                         f"{jitter.late} tardíos, {jitter.concealed} ocultados, jitter {jitter.jitter_ms:.1f} ms")
+
+    async def receive_audio(self, channel, duration=0.1):
+        """Devuelve `duration` segundos de audio del stream RTP del canal, en frames de 20 ms."""
+        session = self.sessions.get(channel.id)
+        if session is None:
+            return None
+        frame_count = max(1, round(duration * 1000 / FRAME_MS))
+        frames = await session.read_frames(frame_count)
+        if not frames:
+            return None
+        return np.concatenate(frames)
 
     async def capture_audio(self, channel, duration=5):
-        """Capturar audio entrante desde el canal PJSIP con manejo de conflictos."""
-        async with self.recording_lock:
-            channel_id = channel.id
-
-            # Verificar si ya hay una grabación activa para este canal
-            if channel_id in self.active_recordings:
-                self.logger.warning(f"Grabación ya activa para canal {channel_id}, esperando...")
-                try:
-                    await asyncio.wait_for(self.active_recordings[channel_id], timeout=duration + 2)
-                except asyncio.TimeoutError:
-                    self.logger.warning(f"Timeout esperando grabación anterior para canal {channel_id}")
-                except Exception as e:
-                    self.logger.error(f"Error esperando grabación anterior: {e}")
-
-            # Crear nueva grabación
+        """Capturar audio entrante desde el canal PJSIP con manejo de conflictos.
+
+        Las grabaciones del mismo canal se serializan; canales distintos graban en paralelo.
+        """
+        channel_id = channel.id
+        lock = self.recording_locks.setdefault(channel_id, asyncio.Lock())
+        if lock.locked():
+            self.logger.warning(f"Grabación ya activa para canal {channel_id}, esperando...")
+        async with lock:
             recording_task = asyncio.create_task(self._do_recording(channel, duration))
             self.active_recordings[channel_id] = recording_task
 
@@ -37,7 +131,7 @@ class RTPProcessor:
                 return result
             finally:
                 # Limpiar grabación completada
-                if channel_id in self.active_recordings:
+                if self.active_recordings.get(channel_id) is recording_task:
                     del self.active_recordings[channel_id]
 
     async def _do_recording(self, channel, duration):
@@ -45,7 +139,7 @@ class RTPProcessor:
         try:
             self.logger.info(f"Iniciando captura de audio RTP para canal {channel.id}")
             recording_name = f"recording_{channel.id}_{int(asyncio.get_event_loop().time())}"
-            recording_file = f"/var/spool/asterisk/recording/{recording_name}.slin"
+            recording_file = os.path.join(self.recording_dir, f"{recording_name}.slin")
 
             # Crear directorio si no existe
             os.makedirs(os.path.dirname(recording_file), exist_ok=True)
@@ -99,10 +193,19 @@ class RTPProcessor:
 
     async def cleanup_channel(self, channel_id):
         """Limpiar recursos para un canal específico."""
+        self.recording_locks.pop(channel_id, None)
         if channel_id in self.active_recordings:
             try:
                 self.active_recordings[channel_id].cancel()
                 del self.active_recordings[channel_id]
                 self.logger.info(f"Recursos RTP limpiados para canal {channel_id}")
             except Exception as e:
-                self.logger.error(f"Error limpiando recursos RTP: {e}")
\ No newline at end of file
+                self.logger.error(f"Error limpiando recursos RTP: {e}")
+        self.close_stream(channel_id)
+
+    def close(self):
+        for channel_id in list(self.sessions):
+            self.close_stream(channel_id)
+        if self.transport:
+            self.transport.close()
+            self.transport = None
@@ -0,0 +1,237 @@
+import asyncio
+import random
+import struct
+import time
+from collections import deque, namedtuple
+import numpy as np
+from utils import setup_log
+from jitter import JitterBuffer
+
+FRAME_MS = 20
+RTP_VERSION = 2
+RTP_HEADER = struct.Struct("!BBHII")
+
+RTPPacket = namedtuple("RTPPacket", ["seq", "timestamp", "ssrc", "payload_type", "marker", "payload"])
+
+def parse_rtp(data):
+    """Parsea un paquete RTP (RFC 3550). Devuelve RTPPacket o None si es inválido."""
+    if len(data) < RTP_HEADER.size:
+        return None
+    b0, b1, seq, timestamp, ssrc = RTP_HEADER.unpack_from(data)
+    if b0 >> 6 != RTP_VERSION:
+        return None
+    offset = RTP_HEADER.size + 4 * (b0 & 0x0F)
+    if b0 & 0x10:
+        # Extensión de cabecera: 16 bits de perfil + 16 bits de longitud en palabras
+        if len(data) < offset + 4:
+            return None
+        ext_words = struct.unpack_from("!H", data, offset + 2)[0]
+        offset += 4 + 4 * ext_words
+    end = len(data)
+    if b0 & 0x20:
+        end -= data[-1]
+    if offset > end:
+        return None
+    return RTPPacket(seq, timestamp, ssrc, b1 & 0x7F, bool(b1 & 0x80), data[offset:end])
+
+def build_rtp(seq, timestamp, ssrc, payload_type, payload, marker=False):
+    """Construye un paquete RTP sin CSRC ni extensiones."""
+    b1 = (0x80 if marker else 0) | (payload_type & 0x7F)
+    return RTP_HEADER.pack(RTP_VERSION << 6, b1, seq & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc) + payload
+
+class RTPSession:
+    """Stream RTP entrante de un canal: entrega frames PCM de 20 ms según llegan."""
+
+    def __init__(self, channel_id, codec, max_frames=250):
+        self.channel_id = channel_id
+        # Sesión de códec del canal (rtp.CodecSession)
+        self.codec = codec
+        self.sample_rate = codec.sample_rate
+        self.frame_samples = codec.frame_samples
+        self.remote_addr = None
+        self.ssrc = None
+        self.payload_type = None
+        # Estado del stream saliente: continúa entre reproducciones del mismo canal
+        self.out_ssrc = random.getrandbits(32)
+        self.out_seq = random.getrandbits(16)
+        self.out_timestamp = random.getrandbits(32)
+        self.jitter_buffer = JitterBuffer(channel_id, sample_rate=codec.sample_rate, clock_rate=codec.clock_rate)
+        self.frames = deque(maxlen=max_frames)
+        self.frame_ready = asyncio.Event()
+        self.packets = 0
+        self.dropped = 0
+        self.closed = False
+
+    def feed(self, packet, arrival=None):
+        """Decodifica un paquete, lo pasa por el jitter buffer y encola los frames listos."""
+        if self.ssrc is None:
+            self.ssrc = packet.ssrc
+            self.payload_type = packet.payload_type
+        pcm = self.codec.decode(packet.payload)
+        if len(pcm) == 0:
+            return
+        self.packets += 1
+        if arrival is None:
+            arrival = time.monotonic()
+        ready = self.jitter_buffer.push(packet.seq, packet.timestamp, pcm, arrival)
+        for frame in ready:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(frame)
+        if ready:
+            self.frame_ready.set()
+
+    async def read_frames(self, count=1):
+        """Espera hasta tener `count` frames y los devuelve; no pierde audio si se cancela."""
+        while len(self.frames) < count:
+            if self.closed:
+                return None
+            self.frame_ready.clear()
+            await self.frame_ready.wait()
+        return [self.frames.popleft() for _ in range(count)]
+
+    async def read_frame(self):
+        frames = await self.read_frames(1)
+        return frames[0] if frames else None
+
+    def close(self):
+        self.closed = True
+        self.jitter_buffer.close()
+        self.frame_ready.set()
+
+class RTPPlayback:
+    """Reproducción saliente: envía PCM como paquetes RTP de 20 ms al ritmo real.
+
+    Se puede escribir audio mientras se reproduce (`write`) y detener al instante
+    para barge-in (`stop`), sin ida y vuelta a ARI.
+    """
+
+    def __init__(self, transport, session, remote_addr, payload_type):
+        self.transport = transport
+        self.session = session
+        self.remote_addr = remote_addr
+        self.payload_type = payload_type
+        self.frame_samples = session.frame_samples
+        self.pending = deque()
+        self.pending_samples = 0
+        self.data_ready = asyncio.Event()
+        self.done = asyncio.Event()
+        self.finished = False
+        self.stopped = False
+        self.sent_frames = 0
+
+    def write(self, pcm):
+        """Agrega muestras int16 a la cola de envío."""
+        if self.stopped or len(pcm) == 0:
+            return
+        self.pending.append(np.asarray(pcm, dtype=np.int16))
+        self.pending_samples += len(pcm)
+        self.data_ready.set()
+
+    def finish(self):
+        """No habrá más audio: la reproducción termina al vaciar la cola."""
+        self.finished = True
+        self.data_ready.set()
+
+    def stop(self):
+        """Detiene el envío inmediatamente (barge-in)."""
+        self.stopped = True
+        self.pending.clear()
+        self.pending_samples = 0
+        self.data_ready.set()
+
+    def _next_frame(self):
+        if self.pending_samples < self.frame_samples and not self.finished:
+            return None
+        if self.pending_samples == 0:
+            return None
+        frame = np.zeros(self.frame_samples, dtype=np.int16)
+        filled = 0
+        while filled < self.frame_samples and self.pending:
+            chunk = self.pending[0]
+            take = min(len(chunk), self.frame_samples - filled)
+            frame[filled:filled + take] = chunk[:take]
+            filled += take
+            if take == len(chunk):
+                self.pending.popleft()
+            else:
+                self.pending[0] = chunk[take:]
+        self.pending_samples -= filled
+        return frame
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        session = self.session
+        frame_seconds = FRAME_MS / 1000
+        next_time = loop.time()
+        marker = True
+        try:
+            while not self.stopped:
+                frame = self._next_frame()
+                if frame is None:
+                    if self.finished:
+                        break
+                    # Sin audio todavía: esperar sin adelantar el reloj
+                    self.data_ready.clear()
+                    await self.data_ready.wait()
+                    next_time = max(next_time, loop.time())
+                    marker = True
+                    continue
+                packet = build_rtp(session.out_seq, session.out_timestamp, session.out_ssrc,
+                                   self.payload_type, session.codec.encode(frame), marker)
+                self.transport.sendto(packet, self.remote_addr)
+                session.out_seq = (session.out_seq + 1) & 0xFFFF
+                session.out_timestamp = (session.out_timestamp + session.codec.timestamp_step) & 0xFFFFFFFF
+                self.sent_frames += 1
+                marker = False
+                next_time += frame_seconds
+                delay = next_time - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        finally:
+            self.done.set()
+
+class RTPIngressProtocol(asyncio.DatagramProtocol):
+    """Socket UDP único que demultiplexa el RTP de todos los canales ExternalMedia por dirección origen."""
+
+    def __init__(self):
+        self.logger = setup_log("rtp")
+        self.sessions = {}
+        # Sesiones sin dirección conocida: se asocian al primer origen desconocido (RTP simétrico)
+        self.unbound = deque()
+        self.transport = None
+        self.invalid_packets = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def bind(self, session, remote_addr=None):
+        if remote_addr:
+            session.remote_addr = remote_addr
+            self.sessions[remote_addr] = session
+        else:
+            self.unbound.append(session)
+
+    def unbind(self, session):
+        if session.remote_addr in self.sessions:
+            del self.sessions[session.remote_addr]
+        if session in self.unbound:
+            self.unbound.remove(session)
+
+    def datagram_received(self, data, addr):
+        session = self.sessions.get(addr)
+        if session is None:
+            if not self.unbound:
+                return
+            session = self.unbound.popleft()
+            session.remote_addr = addr
+            self.sessions[addr] = session
+            self.logger.info(f"Stream RTP {addr} asociado al canal {session.channel_id}")
+        packet = parse_rtp(data)
+        if packet is None:
+            self.invalid_packets += 1
+            return
+        session.feed(packet, time.monotonic())
+
+    def error_received(self, exc):
+        self.logger.error(f"Error en socket RTP: {exc}")
@@ -1,36 +1,465 @@
-import asyncio
+import os
+import time
+import zlib
+from collections import deque, namedtuple
 import numpy as np
-import faster_whisper
-from utils import get_env, setup_log
+from utils import get_env, setup_log, load_tuning_profile
 from vad import VadController
-import tempfile
-import wave
-import os
+from models import registry
+from resample import resample
+from metrics import stt_tier_latency, stt_tier_requests, stt_escalations, stt_decode_seconds, stt_decode_fallbacks
+
+# faster-whisper trabaja internamente a 16 kHz
+WHISPER_RATE = 16000
+# Palabras confirmadas que se pasan como prompt al re-decodificar la cola
+PROMPT_WORDS = 30
+# Ventana del codificador de Whisper: 30 s = 3000 frames mel
+WHISPER_FRAMES = 3000
+# Margen alrededor de los segmentos de voz del VAD al recortar la expresión
+TRIM_PAD_MS = 100
+# Escalera de temperaturas de faster-whisper, usada sólo en la decodificación de respaldo
+FALLBACK_TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+# Texto transcrito con su confianza (promedios ponderados por duración de segmento)
+STTResult = namedtuple("STTResult", ["text", "avg_logprob", "no_speech_prob"])
+EMPTY_RESULT = STTResult("", 0.0, 1.0)
+
+def segment_confidence(segments):
+    """(avg_logprob, no_speech_prob) de una lista de segmentos, ponderados por duración."""
+    logprob = no_speech = weight = 0.0
+    for segment in segments:
+        duration = max(segment.end - segment.start, 0.01)
+        logprob += segment.avg_logprob * duration
+        no_speech += segment.no_speech_prob * duration
+        weight += duration
+    if not weight:
+        return EMPTY_RESULT.avg_logprob, EMPTY_RESULT.no_speech_prob
+    return logprob / weight, no_speech / weight
+
+def normalize_word(word):
+    return word.strip().strip(".,;:¿?¡!\"'").lower()
+
+def compression_ratio(text):
+    """Relación de compresión gzip del texto; valores altos indican repeticiones (alucinación)."""
+    data = text.encode("utf-8")
+    return len(data) / len(zlib.compress(data)) if data else 0.0
+
+class STTStream:
+    """Transcripción incremental de la expresión en curso de una llamada.
+
+    Cada `update` re-decodifica la ventana aún no confirmada; las palabras que coinciden
+    entre dos pasadas consecutivas (prefijo estable) se confirman y el inicio de la
+    ventana avanza hasta el final de la última palabra confirmada. Al terminar la voz,
+    `finalize` sólo decodifica la cola corta que quedó sin confirmar.
+    """
+
+    def __init__(self, worker, channel_id, sample_rate):
+        self.worker = worker
+        self.channel_id = channel_id
+        self.sample_rate = sample_rate
+        self.events = deque(maxlen=50)
+        self.reset()
+
+    def reset(self):
+        self.committed_words = []
+        # Muestras de la expresión ya cubiertas por palabras confirmadas
+        self.committed_samples = 0
+        self.previous_words = []
+        self.passes = 0
+        # Longitud de la expresión en la última re-decodificación lanzada
+        self.partial_samples = 0
+        # Confianza de la última pasada parcial con palabras
+        self.confidence = None
+
+    def _decode(self, audio):
+        """Decodifica audio[committed_samples:] con marcas de tiempo por palabra.
+
+        Devuelve (palabras, avg_logprob, no_speech_prob).
+        """
+        window = audio[self.committed_samples:]
+        if len(window) < self.sample_rate // 10:
+            return [], EMPTY_RESULT.avg_logprob, EMPTY_RESULT.no_speech_prob
+        prompt = " ".join(self.committed_words[-PROMPT_WORDS:]) or None
+        segments = self.worker.decode_tiered(
+            self.worker.prepare_audio(window, self.sample_rate),
+            initial_prompt=prompt,
+            condition_on_previous_text=False,
+            word_timestamps=True
+        )
+        self.passes += 1
+        words = []
+        for segment in segments:
+            for word in segment.words or []:
+                text = word.word.strip()
+                if text:
+                    end = self.committed_samples + int(word.end * self.sample_rate)
+                    words.append((text, end))
+        return (words, *segment_confidence(segments))
+
+    def _emit(self, kind, text):
+        event = {"type": kind, "channel": self.channel_id, "text": text}
+        self.events.append(event)
+        return event
+
+    def update(self, audio):
+        """Re-decodifica la ventana creciente y confirma el prefijo estable; devuelve el evento parcial."""
+        words, avg_logprob, no_speech_prob = self._decode(audio)
+        if words:
+            self.confidence = STTResult("", avg_logprob, no_speech_prob)
+        stable = 0
+        for (new, _), (old, _) in zip(words, self.previous_words):
+            if normalize_word(new) != normalize_word(old):
+                break
+            stable += 1
+        if stable:
+            self.committed_words.extend(text for text, _ in words[:stable])
+            self.committed_samples = words[stable - 1][1]
+        self.previous_words = words[stable:]
+        tentative = " ".join(text for text, _ in self.previous_words)
+        return self._emit("partial", " ".join(self.committed_words + ([tentative] if tentative else [])))
+
+    def tail(self, audio):
+        """Cola sin confirmar y prompt, para decodificarla en un lote con otras llamadas."""
+        prompt = " ".join(self.committed_words[-PROMPT_WORDS:]) or None
+        return audio[self.committed_samples:], prompt
+
+    def decode_tail(self, audio):
+        """Decodifica sólo la cola sin confirmar, sin cerrar la expresión (admite especular)."""
+        words, avg_logprob, no_speech_prob = self._decode(audio)
+        return STTResult(" ".join(word for word, _ in words), avg_logprob, no_speech_prob)
+
+    def finalize(self, audio):
+        """Decodifica sólo la cola sin confirmar y devuelve el evento final."""
+        return self.finish(self.decode_tail(audio))
+
+    def finish(self, tail):
+        """Cierra la expresión con el resultado de la cola y devuelve el evento final.
+
+        La confianza es la de la cola o, si ya estaba todo confirmado, la de la última
+        pasada parcial.
+        """
+        text = " ".join(self.committed_words + ([tail.text] if tail.text else []))
+        confidence = tail if tail.text or not self.confidence else self.confidence
+        self.worker.logger.info(f"Transcripción final ({self.passes} pasadas, "
+                                f"{self.committed_samples / self.sample_rate:.2f}s confirmados): {text}")
+        self.reset()
+        event = self._emit("final", text)
+        event["avg_logprob"] = confidence.avg_logprob
+        event["no_speech_prob"] = confidence.no_speech_prob
+        return event
 
 class STTWorker:
-    def __init__(self):
+    def __init__(self, vad=None):
         self.logger = setup_log("stt")
         self.model_name = get_env("WHISPER_MODEL", "large-v3-turbo")
-        self.vad = VadController()
+        # Reutiliza el VadController del agente si se proporciona
+        self.vad = vad or VadController()
         self.sample_rate = 8000  # Ajustado a 8kHz para compatibilidad con Asterisk
+        # CTranslate2: num_workers réplicas que decodifican en paralelo, cpu_threads hilos
+        # cada una; por defecto se reparten los núcleos sin sobresuscribir la máquina.
+        # Prioridad: variables de entorno, perfil de autotune.py, valores por defecto
+        profile = load_tuning_profile("stt")
+        cores = os.cpu_count() or 1
+        self.compute_type = get_env("WHISPER_COMPUTE_TYPE", profile.get("compute_type", "int8"))
+        self.num_workers = int(get_env("STT_NUM_WORKERS", profile.get("num_workers", max(1, min(4, cores // 4)))))
+        self.cpu_threads = int(get_env("STT_CPU_THREADS", profile.get("cpu_threads", max(1, cores // self.num_workers))))
+        # Nivel rápido: primera pasada con un modelo chico; se escala al modelo completo
+        # sólo si la confianza es baja o la expresión es larga (WHISPER_FAST_MODEL="" desactiva)
+        self.fast_model_name = get_env("WHISPER_FAST_MODEL", "small")
+        self.fast_max_seconds = float(get_env("STT_FAST_MAX_SECONDS", 4.0))
+        self.escalate_logprob = float(get_env("STT_ESCALATE_LOGPROB", -0.7))
+        self.escalate_no_speech = float(get_env("STT_ESCALATE_NO_SPEECH", 0.5))
+        # Decodificación: "fast" = greedy y, sólo si la confianza es baja, beam search con
+        # escalera de temperaturas; "full" = siempre los valores por defecto de faster-whisper
+        self.decode_mode = get_env("STT_DECODE_MODE", "fast")
+        self.fallback_logprob = float(get_env("STT_FALLBACK_LOGPROB", -1.0))
+        self.fallback_compression = float(get_env("STT_FALLBACK_COMPRESSION", 2.4))
+        self.fallback_beam_size = int(get_env("STT_FALLBACK_BEAM_SIZE", 5))
+        self.fast_model = None
         try:
-            self.model = faster_whisper.WhisperModel(
-                self.model_name,
-                device="cpu",
-                compute_type="int8"
-            )
-            self.logger.info(f"STT inicializado con modelo: {self.model_name}")
+            self.model = self._load_model(self.model_name)
+            if self.fast_model_name and self.fast_model_name != self.model_name:
+                self.fast_model = self._load_model(self.fast_model_name)
+            self.logger.info(f"STT inicializado con modelo: {self.model_name} "
+                             f"(rápido: {self.fast_model_name or 'ninguno'}, {self.compute_type}, "
+                             f"{self.num_workers} workers x {self.cpu_threads} hilos)")
         except Exception as e:
             self.logger.error(f"Error inicializando Whisper: {e}")
             raise
         self.window_ms = 300
+        self.streams = {}
+
+    def _load_model(self, name):
+        return registry.whisper(
+            name,
+            device="cpu",
+            compute_type=self.compute_type,
+            cpu_threads=self.cpu_threads,
+            num_workers=self.num_workers
+        )
+
+    def escalation_reason(self, text, avg_logprob, no_speech_prob):
+        """Motivo para repetir con el modelo completo un resultado del nivel rápido, o None."""
+        if not text:
+            return None
+        if avg_logprob < self.escalate_logprob:
+            return "logprob"
+        if no_speech_prob > self.escalate_no_speech:
+            return "no_speech"
+        return None
+
+    def fallback_reason(self, text, avg_logprob, ratio, no_speech_prob=0.0):
+        """Motivo para repetir una decodificación greedy con beam search, o None."""
+        if ratio > self.fallback_compression:
+            return "compression"
+        # Como en Whisper: baja confianza sobre silencio no se re-decodifica
+        if text and avg_logprob < self.fallback_logprob and no_speech_prob <= 0.6:
+            return "logprob"
+        return None
+
+    def decode(self, model, audio_16k, **options):
+        """`model.transcribe` con la estrategia de decodificación configurada.
 
-    async def process_audio(self, audio):
-        """Procesa audio en streaming con ventanas de 300 ms."""
+        En modo "fast" la primera pasada es greedy a temperatura 0; si algún segmento
+        supera los umbrales de compresión o avg_logprob se repite con beam search y la
+        escalera de temperaturas. Devuelve la lista de segmentos.
+        """
+        start = time.perf_counter()
+        if self.decode_mode != "fast":
+            segments, _ = model.transcribe(audio_16k, language="es", task="transcribe", **options)
+            segments = list(segments)
+            path = "beam"
+        else:
+            segments, _ = model.transcribe(audio_16k, language="es", task="transcribe",
+                                           beam_size=1, temperature=0.0, **options)
+            segments = list(segments)
+            path = "greedy"
+            for segment in segments:
+                reason = self.fallback_reason(segment.text.strip(), segment.avg_logprob,
+                                              segment.compression_ratio, segment.no_speech_prob)
+                if reason:
+                    stt_decode_fallbacks.labels(reason=reason).inc()
+                    segments, _ = model.transcribe(audio_16k, language="es", task="transcribe",
+                                                   beam_size=self.fallback_beam_size,
+                                                   temperature=FALLBACK_TEMPERATURES, **options)
+                    segments = list(segments)
+                    path = "fallback"
+                    break
+        stt_decode_seconds.labels(path=path).observe(time.perf_counter() - start)
+        return segments
+
+    def speech_bounds(self, segments, length, sample_rate):
+        """[inicio, fin) de la voz según los segmentos del VAD, con margen, dentro de [0, length)."""
+        pad = sample_rate * TRIM_PAD_MS // 1000
+        return max(0, segments[0][0] - pad), min(length, segments[-1][1] + pad)
+
+    def prepare_audio(self, audio, sample_rate):
+        """int16 (o float32) a la frecuencia del canal -> float32 a 16 kHz para Whisper.
+
+        Una sola conversión y un solo resample polifásico; a 16 kHz no se remuestrea.
+        """
+        if audio.dtype != np.float32:
+            audio = audio.astype(np.float32) / 32768.0
+        if sample_rate != WHISPER_RATE:
+            audio = resample(audio, sample_rate, WHISPER_RATE)
+        return audio
+
+    def transcribe_array(self, audio_16k, vad_filter=True):
+        """Transcribe un array float32 a 16 kHz directamente en memoria.
+
+        Con nivel rápido, las expresiones cortas pasan primero por el modelo chico y sólo
+        se re-decodifican con el completo si `escalation_reason` lo pide.
+        """
+        if self.fast_model is not None:
+            if len(audio_16k) / WHISPER_RATE > self.fast_max_seconds:
+                reason = "length"
+            else:
+                result = self._transcribe_with("fast", self.fast_model, audio_16k, vad_filter)
+                reason = self.escalation_reason(*result)
+                if reason is None:
+                    return result
+                self.logger.info(f"Escalando al modelo completo ({reason}, logprob {result.avg_logprob:.2f}, "
+                                 f"no_speech {result.no_speech_prob:.2f})")
+            stt_escalations.labels(reason=reason).inc()
+        return self._transcribe_with("full", self.model, audio_16k, vad_filter)
+
+    def decode_tiered(self, audio_16k, **options):
+        """`decode` con los mismos niveles que `transcribe_array`, para las pasadas del
+        stream incremental (parciales y cola): ventanas cortas con el modelo rápido y
+        escalado al completo por duración o baja confianza. Devuelve los segmentos."""
+        tier, model = "full", self.model
+        if self.fast_model is not None:
+            if len(audio_16k) / WHISPER_RATE > self.fast_max_seconds:
+                stt_escalations.labels(reason="length").inc()
+            else:
+                tier, model = "fast", self.fast_model
+        start = time.perf_counter()
+        segments = self.decode(model, audio_16k, **options)
+        stt_tier_latency.labels(tier=tier).observe(time.perf_counter() - start)
+        stt_tier_requests.labels(tier=tier).inc()
+        if tier == "fast":
+            text = " ".join(segment.text.strip() for segment in segments).strip()
+            reason = self.escalation_reason(text, *segment_confidence(segments))
+            if reason:
+                stt_escalations.labels(reason=reason).inc()
+                start = time.perf_counter()
+                segments = self.decode(self.model, audio_16k, **options)
+                stt_tier_latency.labels(tier="full").observe(time.perf_counter() - start)
+                stt_tier_requests.labels(tier="full").inc()
+        return segments
+
+    def _transcribe_with(self, tier, model, audio_16k, vad_filter=True):
+        """Transcribe con un nivel; devuelve un STTResult."""
+        start = time.perf_counter()
+        segments = self.decode(
+            model,
+            audio_16k,
+            vad_filter=vad_filter,
+            vad_parameters=dict(min_silence_duration_ms=500) if vad_filter else None,
+            word_timestamps=False
+        )
+        result = []
+        for segment in segments:
+            text = segment.text.strip()
+            if text:
+                result.append(text)
+                self.logger.info(f"Transcripción ({tier}): {text}")
+        stt_tier_latency.labels(tier=tier).observe(time.perf_counter() - start)
+        stt_tier_requests.labels(tier=tier).inc()
+        return STTResult(" ".join(result), *segment_confidence(segments))
+
+    def transcribe_batch(self, items, vad_checks=None):
+        """Transcribe varias expresiones cortas (de distintas llamadas) en una sola pasada.
+
+        `items` es una lista de (audio, sample_rate, prompt). Devuelve un STTResult por
+        expresión, en el mismo orden. Con nivel rápido, el lote pasa primero por el modelo chico
+        y sólo las expresiones largas o de baja confianza van, juntas, al completo. Las
+        expresiones marcadas en `vad_checks` pasan antes por silero, como en `process_audio`
+        sin segmentos de voz, y sin voz devuelven EMPTY_RESULT sin decodificarse.
+        """
+        results = [EMPTY_RESULT] * len(items)
+        audios = [None] * len(items)
+        voiced = []
+        for i, (audio, sample_rate, _) in enumerate(items):
+            if audio.dtype != np.float32:
+                audio = audio.astype(np.float32) / 32768.0
+            if vad_checks and vad_checks[i] and not self.vad.process(audio, sample_rate):
+                continue
+            audios[i] = self.prepare_audio(audio, sample_rate)
+            voiced.append(i)
+        prompts = [prompt for _, _, prompt in items]
+        escalate = voiced
+        if self.fast_model is not None:
+            escalate = []
+            fast = []
+            for i in voiced:
+                audio = audios[i]
+                if len(audio) / WHISPER_RATE > self.fast_max_seconds:
+                    stt_escalations.labels(reason="length").inc()
+                    escalate.append(i)
+                else:
+                    fast.append(i)
+            if fast:
+                outputs = self._generate_batch("fast", self.fast_model,
+                                               [audios[i] for i in fast], [prompts[i] for i in fast])
+                for i, output in zip(fast, outputs):
+                    reason = self.escalation_reason(*output)
+                    if reason:
+                        stt_escalations.labels(reason=reason).inc()
+                        escalate.append(i)
+                    else:
+                        results[i] = output
+        if escalate:
+            outputs = self._generate_batch("full", self.model,
+                                           [audios[i] for i in escalate], [prompts[i] for i in escalate])
+            for i, output in zip(escalate, outputs):
+                results[i] = output
+        self.logger.info(f"Lote STT de {len(items)} expresiones ({len(escalate)} con modelo completo): "
+                         f"{[result.text for result in results]}")
+        return results
+
+    def _generate_batch(self, tier, model, audios, prompts):
+        """Una pasada por lotes de un modelo: cada expresión ocupa una ventana de 30 s del
+        codificador y todas se decodifican con un solo `generate` de CTranslate2.
+
+        Devuelve un STTResult por expresión.
+        """
+        from faster_whisper.audio import pad_or_trim
+        from faster_whisper.tokenizer import Tokenizer
+
+        start = time.perf_counter()
+        tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual,
+                              task="transcribe", language="es")
+        features = np.stack([pad_or_trim(model.feature_extractor(audio), WHISPER_FRAMES) for audio in audios])
+        prompt_tokens = []
+        for prompt in prompts:
+            previous = tokenizer.encode(" " + prompt.strip()) if prompt else []
+            prompt_tokens.append(model.get_prompt(tokenizer, previous, without_timestamps=True))
+        if self.decode_mode != "fast":
+            outputs = self._generate(model, tokenizer, model.encode(features), prompt_tokens, 5)
+            path = "beam"
+        else:
+            # Greedy para todo el lote; sólo las expresiones de baja confianza se repiten con beam search
+            outputs = self._generate(model, tokenizer, model.encode(features), prompt_tokens, 1)
+            path = "greedy"
+            retry = []
+            for i, (text, avg_logprob, no_speech_prob) in enumerate(outputs):
+                reason = self.fallback_reason(text, avg_logprob, compression_ratio(text), no_speech_prob)
+                if reason:
+                    stt_decode_fallbacks.labels(reason=reason).inc()
+                    retry.append(i)
+            if retry:
+                retried = self._generate(model, tokenizer, model.encode(features[retry]),
+                                         [prompt_tokens[i] for i in retry], self.fallback_beam_size)
+                for i, output in zip(retry, retried):
+                    outputs[i] = output
+                path = "fallback"
+        elapsed = time.perf_counter() - start
+        stt_decode_seconds.labels(path=path).observe(elapsed)
+        stt_tier_latency.labels(tier=tier).observe(elapsed)
+        stt_tier_requests.labels(tier=tier).inc(len(audios))
+        return outputs
+
+    def _generate(self, model, tokenizer, encoder_output, prompt_tokens, beam_size):
+        """`generate` de CTranslate2 sobre un lote ya codificado; un STTResult por expresión."""
+        results = model.model.generate(
+            encoder_output,
+            prompt_tokens,
+            beam_size=beam_size,
+            max_length=model.max_length,
+            suppress_blank=True,
+            suppress_tokens=[-1],
+            return_scores=True,
+            return_no_speech_prob=True
+        )
+        outputs = []
+        for result in results:
+            tokens = [token for token in result.sequences_ids[0] if token < tokenizer.eot]
+            # scores viene normalizado por longitud; igual que faster-whisper, promedio sobre len + 1
+            avg_logprob = result.scores[0] * len(tokens) / (len(tokens) + 1)
+            outputs.append(STTResult(tokenizer.decode(tokens).strip(), avg_logprob, result.no_speech_prob))
+        return outputs
+
+    def process_audio(self, audio, sample_rate=None, speech_segments=None):
+        """Transcribe el buffer int16 de la llamada sin archivos temporales; devuelve un STTResult.
+
+        Con `speech_segments` (segmentos [inicio, fin) del VAD en streaming, relativos al
+        buffer) se recorta el silencio inicial y final y no se vuelve a pasar silero ni
+        el filtro VAD de faster-whisper.
+        """
+        sample_rate = sample_rate or self.sample_rate
         try:
             if audio is None or len(audio) == 0:
                 self.logger.error("No se recibió audio para transcripción")
-                return []
+                return EMPTY_RESULT
+
+            if speech_segments is not None:
+                if not speech_segments:
+                    self.logger.debug("No se detectó voz")
+                    return EMPTY_RESULT
+                start, end = self.speech_bounds(speech_segments, len(audio), sample_rate)
+                audio_16k = self.prepare_audio(audio[start:end], sample_rate)
+                return self.transcribe_array(audio_16k, vad_filter=False)
 
             # Convertir a float32 para VAD
             if audio.dtype != np.float32:
@@ -39,44 +468,25 @@ class STTWorker:
                 audio_float = audio
 
             # Usar VAD para filtrar audio sin voz
-            if not self.vad.process(audio_float):
+            if not self.vad.process(audio_float, sample_rate):
                 self.logger.debug("No se detectó voz")
-                return []
-
-            # Guardar audio temporalmente como WAV
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
-                tmp_path = tmp_file.name
-                with wave.open(tmp_path, 'wb') as wav_file:
-                    wav_file.setnchannels(1)
-                    wav_file.setsampwidth(2)
-                    wav_file.setframerate(self.sample_rate)
-                    wav_file.writeframes(audio.tobytes())
-
-            self.logger.info(f"Archivo WAV temporal creado: {tmp_path}")
-
-            # Transcribir con faster-whisper
-            segments, info = self.model.transcribe(
-                tmp_path,
-                language="es",
-                task="transcribe",
-                vad_filter=True,
-                vad_parameters=dict(min_silence_duration_ms=500),
-                word_timestamps=False
-            )
-
-            result = []
-            for segment in segments:
-                text = segment.text.strip()
-                if text:
-                    result.append(text)
-                    self.logger.info(f"Transcripción: {text}")
+                return EMPTY_RESULT
 
-            os.unlink(tmp_path)
-            return result if result else []
+            audio_16k = self.prepare_audio(audio_float, sample_rate)
+            return self.transcribe_array(audio_16k)
 
         except Exception as e:
             self.logger.error(f"Error en transcripción: {e}")
-            return []
+            return EMPTY_RESULT
+
+    def open_stream(self, channel_id, sample_rate=None):
+        """Crea el estado de transcripción incremental de una llamada."""
+        stream = STTStream(self, channel_id, sample_rate or self.sample_rate)
+        self.streams[channel_id] = stream
+        return stream
+
+    def close_stream(self, channel_id):
+        self.streams.pop(channel_id, None)
 
     def cleanup(self):
         """Limpia recursos del modelo."""
@@ -0,0 +1,88 @@
+import asyncio
+from utils import get_env, setup_log
+from metrics import stt_batch_size
+from stt import EMPTY_RESULT
+from stt_service import STTOverloaded
+
+class STTBatcher:
+    """Micro-lotes de transcripciones finales entre llamadas.
+
+    Si no hay ningún lote en curso la expresión sale de inmediato (una llamada sola no
+    espera). Mientras un lote se decodifica, las que llegan se juntan hasta que termina
+    o vence la ventana (STT_BATCH_WINDOW_MS desde la primera) y entran al servicio de
+    STT como una sola petición, que las decodifica en una pasada de Whisper
+    (`STTWorker.transcribe_batch`). Cada texto se devuelve al future de su llamada.
+    """
+
+    def __init__(self, service, window_ms=None, max_batch=None):
+        self.logger = setup_log("stt_batch")
+        self.service = service
+        self.window = (window_ms if window_ms is not None else int(get_env("STT_BATCH_WINDOW_MS", 100))) / 1000
+        self.max_batch = max_batch or int(get_env("STT_MAX_BATCH", 8))
+        self.pending = []
+        self.flush_handle = None
+        self.in_flight = 0
+
+    def submit(self, audio, sample_rate, prompt=None, vad_check=False):
+        """Agrega una expresión al lote en formación; devuelve un future con su texto.
+
+        Con `vad_check` la expresión pasa antes por silero (no hay segmentos de voz del VAD
+        en streaming)."""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.pending.append(((audio, sample_rate, prompt), vad_check, future))
+        if self.in_flight == 0 or len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self.flush)
+        return future
+
+    def flush(self):
+        if self.flush_handle:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        items = [item for item, _, _ in batch]
+        vad_checks = [vad_check for _, vad_check, _ in batch]
+        futures = [future for _, _, future in batch]
+        stt_batch_size.observe(len(items))
+        audio_seconds = sum(len(audio) / sample_rate for audio, sample_rate, _ in items)
+        try:
+            request = self.service.submit("final", self.service.stt.transcribe_batch, items, vad_checks,
+                                          audio_seconds=audio_seconds)
+        except STTOverloaded as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.in_flight += 1
+
+        def on_done(request):
+            self.in_flight -= 1
+            # Lo acumulado mientras corría este lote sale sin esperar el resto de la ventana
+            if self.pending and self.in_flight == 0:
+                self.flush()
+            for i, future in enumerate(futures):
+                if future.done():
+                    continue
+                if request.cancelled():
+                    future.cancel()
+                elif request.exception():
+                    future.set_exception(request.exception())
+                else:
+                    future.set_result(request.result()[i])
+
+        request.add_done_callback(on_done)
+
+    async def transcribe(self, audio, sample_rate, prompt=None, vad_check=False):
+        return await self.submit(audio, sample_rate, prompt, vad_check)
+
+    async def decode_tail(self, stream, audio):
+        """Decodifica la cola sin confirmar de un stream dentro del lote (no cierra la expresión)."""
+        tail, prompt = stream.tail(audio)
+        if not len(tail):
+            return EMPTY_RESULT
+        return await self.submit(tail, stream.sample_rate, prompt)
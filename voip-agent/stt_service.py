@@ -0,0 +1,150 @@
+import asyncio
+import concurrent.futures
+import time
+from collections import deque
+from utils import get_env, setup_log
+from metrics import stt_queue_depth, stt_queue_wait, stt_real_time_factor, stt_rejected
+
+class STTOverloaded(Exception):
+    """La cola de STT está llena: la petición no se admite."""
+
+class STTDeadlineExceeded(Exception):
+    """La petición esperó en cola más allá de su plazo y se descartó sin decodificar."""
+
+class STTRequest:
+    __slots__ = ("kind", "func", "args", "future", "enqueued", "deadline", "audio_seconds")
+
+    def __init__(self, kind, func, args, future, enqueued, deadline, audio_seconds):
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.future = future
+        self.enqueued = enqueued
+        self.deadline = deadline
+        self.audio_seconds = audio_seconds
+
+class STTService:
+    """Servicio de STT del agente: hilos propios, cola acotada y control de admisión.
+
+    Tantos hilos como réplicas (num_workers) tiene el modelo de Whisper, separados del
+    executor genérico que usan TTS, VAD y archivos. Las transcripciones finales tienen
+    prioridad sobre las parciales; las parciales se descartan (degradación) cuando la
+    cola pasa de `degrade_depth` y las finales se rechazan cuando llega a `max_queue`.
+    Cada petición lleva un plazo: si vence en cola se descarta sin decodificar.
+    """
+
+    KINDS = ("final", "partial")
+
+    def __init__(self, stt, max_queue=None, degrade_depth=None, deadline_ms=None, partial_deadline_ms=None):
+        self.logger = setup_log("stt_service")
+        self.stt = stt
+        self.workers = stt.num_workers
+        self.max_queue = max_queue or int(get_env("STT_MAX_QUEUE", 4 * self.workers))
+        self.degrade_depth = degrade_depth or int(get_env("STT_DEGRADE_DEPTH", self.workers))
+        self.deadline = (deadline_ms or int(get_env("STT_DEADLINE_MS", 3000))) / 1000
+        self.partial_deadline = (partial_deadline_ms or int(get_env("STT_PARTIAL_DEADLINE_MS", 800))) / 1000
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stt")
+        self.queues = {kind: deque() for kind in self.KINDS}
+        self.work_ready = asyncio.Event()
+        self.tasks = []
+
+    @property
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+            self.logger.info(f"Servicio STT iniciado: {self.workers} workers, cola máx {self.max_queue}, "
+                             f"degradación desde {self.degrade_depth}")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+        for queue in self.queues.values():
+            while queue:
+                request = queue.popleft()
+                if not request.future.done():
+                    request.future.cancel()
+        self.executor.shutdown(wait=True)
+
+    def _update_depth(self):
+        for kind, queue in self.queues.items():
+            stt_queue_depth.labels(kind=kind).set(len(queue))
+
+    def submit(self, kind, func, *args, audio_seconds=0.0, deadline=None):
+        """Encola `func(*args)`; devuelve un future o lanza STTOverloaded si no se admite."""
+        depth = self.depth
+        if kind == "partial" and depth >= self.degrade_depth:
+            stt_rejected.labels(kind=kind, reason="degraded").inc()
+            raise STTOverloaded(f"cola STT con {depth} peticiones: parcial descartado")
+        if depth >= self.max_queue:
+            stt_rejected.labels(kind=kind, reason="overload").inc()
+            raise STTOverloaded(f"cola STT llena ({depth}/{self.max_queue})")
+        if deadline is None:
+            deadline = self.partial_deadline if kind == "partial" else self.deadline
+        now = time.monotonic()
+        future = asyncio.get_event_loop().create_future()
+        self.queues[kind].append(STTRequest(kind, func, args, future, now, now + deadline, audio_seconds))
+        self._update_depth()
+        self.work_ready.set()
+        return future
+
+    def _next(self):
+        for kind in self.KINDS:
+            if self.queues[kind]:
+                return self.queues[kind].popleft()
+        return None
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self.work_ready.wait()
+            request = self._next()
+            if request is None:
+                self.work_ready.clear()
+                continue
+            self._update_depth()
+            if request.future.done():
+                continue
+            started = time.monotonic()
+            stt_queue_wait.labels(kind=request.kind).observe(started - request.enqueued)
+            if started > request.deadline:
+                stt_rejected.labels(kind=request.kind, reason="deadline").inc()
+                request.future.set_exception(STTDeadlineExceeded(
+                    f"{started - request.enqueued:.2f}s en cola"))
+                continue
+            try:
+                result = await loop.run_in_executor(self.executor, request.func, *request.args)
+            except Exception as e:
+                if not request.future.done():
+                    request.future.set_exception(e)
+                continue
+            elapsed = time.monotonic() - started
+            if request.audio_seconds > 0:
+                stt_real_time_factor.labels(kind=request.kind).observe(elapsed / request.audio_seconds)
+            if not request.future.done():
+                request.future.set_result(result)
+
+    async def transcribe(self, audio, sample_rate, speech_segments=None):
+        """Transcripción completa de una expresión (sin stream incremental)."""
+        return await self.submit("final", self.stt.process_audio, audio, sample_rate, speech_segments,
+                                 audio_seconds=len(audio) / sample_rate)
+
+    async def decode_tail(self, stream, audio):
+        """Texto de la cola sin confirmar de un stream incremental (no cierra la expresión)."""
+        tail = len(audio) - stream.committed_samples
+        return await self.submit("final", stream.decode_tail, audio,
+                                 audio_seconds=max(tail, 0) / stream.sample_rate)
+
+    async def update(self, stream, audio):
+        """Re-decodificación parcial; se descarta primero cuando hay carga."""
+        tail = len(audio) - stream.committed_samples
+        return await self.submit("partial", stream.update, audio,
+                                 audio_seconds=max(tail, 0) / stream.sample_rate)
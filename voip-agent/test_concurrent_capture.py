@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Prueba de concurrencia: N llamadas capturan audio en paralelo sin bloquearse entre sí
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from rtp_fixed import RTPProcessor
+
+CAPTURE_SECONDS = 0.2
+# _do_recording espera duration + 1 s a que Asterisk cierre el archivo
+EXPECTED_LATENCY = CAPTURE_SECONDS + 1.0
+TOLERANCE = 0.5
+
+class FakeChannel:
+    """Canal ARI simulado: record() escribe el .slin como lo haría Asterisk"""
+
+    def __init__(self, channel_id, recording_dir, sample_rate=8000):
+        self.id = channel_id
+        self.recording_dir = recording_dir
+        self.sample_rate = sample_rate
+
+    async def stop_recording(self, name):
+        raise RuntimeError("Sin grabación previa")
+
+    async def record(self, name, format, maxDurationSeconds, maxSilenceSeconds, ifExists):
+        samples = np.zeros(int(self.sample_rate * maxDurationSeconds), dtype=np.int16)
+        with open(os.path.join(self.recording_dir, f"{name}.slin"), 'wb') as f:
+            f.write(samples.tobytes())
+
+async def capture_calls(call_count):
+    """Captura audio en `call_count` canales a la vez y devuelve la latencia de cada uno"""
+    with tempfile.TemporaryDirectory() as recording_dir:
+        rtp = RTPProcessor()
+        rtp.recording_dir = recording_dir
+        channels = [FakeChannel(f"call-{i}", recording_dir) for i in range(call_count)]
+
+        async def timed_capture(channel):
+            start = time.perf_counter()
+            audio = await rtp.capture_audio(channel, duration=CAPTURE_SECONDS)
+            return time.perf_counter() - start, audio
+
+        results = await asyncio.gather(*(timed_capture(channel) for channel in channels))
+        for channel in channels:
+            await rtp.cleanup_channel(channel.id)
+    return results
+
+def test_parallel_capture():
+    """La latencia por llamada no depende del número de llamadas concurrentes"""
+    for call_count in (1, 4, 16):
+        results = asyncio.run(capture_calls(call_count))
+        latencies = [latency for latency, _ in results]
+        print(f"📞 {call_count:>2} llamadas: latencia máx {max(latencies):.2f}s, media {sum(latencies) / len(latencies):.2f}s")
+        assert all(audio is not None and len(audio) > 0 for _, audio in results)
+        assert max(latencies) < EXPECTED_LATENCY + TOLERANCE, f"Captura serializada con {call_count} llamadas"
+
+def test_same_channel_serialized():
+    """Dos capturas del mismo canal siguen ejecutándose una tras otra"""
+    async def run():
+        with tempfile.TemporaryDirectory() as recording_dir:
+            rtp = RTPProcessor()
+            rtp.recording_dir = recording_dir
+            channel = FakeChannel("call-0", recording_dir)
+            start = time.perf_counter()
+            await asyncio.gather(rtp.capture_audio(channel, CAPTURE_SECONDS), rtp.capture_audio(channel, CAPTURE_SECONDS))
+            return time.perf_counter() - start
+    elapsed = asyncio.run(run())
+    print(f"🔁 Mismo canal, 2 capturas: {elapsed:.2f}s")
+    assert elapsed >= 2 * EXPECTED_LATENCY - 0.1
+
+if __name__ == "__main__":
+    try:
+        test_parallel_capture()
+        test_same_channel_serialized()
+        print("✅ Captura concurrente sin bloqueo entre llamadas")
+    except AssertionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
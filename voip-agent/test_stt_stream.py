@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Prueba del cierre de expresión en streaming: si toda la expresión ya quedó confirmada
+(cola vacía), `finish` devuelve el texto confirmado tanto decodificando la cola en el
+stream como dentro del lote de STTBatcher
+"""
+import asyncio
+import logging
+import sys
+import numpy as np
+from stt import STTStream, STTResult
+from stt_batch import STTBatcher
+
+SAMPLE_RATE = 8000
+WORDS = ["hola", "quiero", "agendar", "una", "cita"]
+
+class FakeWorker:
+    """STTWorker mínimo: la cola está vacía, así que nunca se decodifica"""
+
+    def __init__(self):
+        self.logger = logging.getLogger("test_stt_stream")
+
+    def decode_tiered(self, audio, **options):
+        raise AssertionError("no debería decodificarse una cola vacía")
+
+class FakeService:
+    def submit(self, *args, **kwargs):
+        raise AssertionError("no debería enviarse una cola vacía al lote")
+
+def committed_stream(audio):
+    """Stream con todas las palabras confirmadas hasta el final del audio"""
+    stream = STTStream(FakeWorker(), "call-0", SAMPLE_RATE)
+    stream.committed_words = list(WORDS)
+    stream.committed_samples = len(audio)
+    stream.confidence = STTResult("", -0.2, 0.05)
+    return stream
+
+def check(name, event):
+    ok = event["type"] == "final" and event["text"] == " ".join(WORDS) and event["avg_logprob"] == -0.2
+    print(f"{'✅' if ok else '❌'} {name}: {event['text']!r} (avg_logprob {event['avg_logprob']})")
+    return ok
+
+async def main():
+    audio = np.zeros(SAMPLE_RATE, dtype=np.int16)
+    results = []
+    # Streaming: el stream decodifica la cola él mismo
+    results.append(check("streaming", committed_stream(audio).finalize(audio)))
+    # Lote: la cola se decodifica en STTBatcher y el resultado cierra el stream
+    stream = committed_stream(audio)
+    tail = await STTBatcher(FakeService(), window_ms=100).decode_tail(stream, audio)
+    results.append(check("lote", stream.finish(tail)))
+    if not all(results):
+        print("❌ La cola vacía no cierra la expresión")
+        return 1
+    print("✅ Cola vacía cerrada en streaming y en lote")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Prueba del filtro de turnos: las frases fantasma se descartan sólo como palabras
+completas, no cuando aparecen dentro de una frase real del llamante
+"""
+import sys
+from turn_gate import TurnGate
+
+# Confianza alta y voz suficiente: sólo la lista de frases fantasma puede descartar
+CONFIDENT = dict(avg_logprob=-0.2, no_speech_prob=0.05, speech_ratio=0.8)
+
+PHANTOMS = (
+    "Gracias por ver el video.",
+    "¡Gracias por ver!",
+    "Subtítulos realizados por la comunidad de Amara.org",
+    "Subtítulos por Amara.org",
+    "Suscríbete al canal.",
+)
+NEAR_MISSES = (
+    "Gracias por verificar mi pago.",
+    "Gracias por verme tan pronto.",
+    "Quiero ver mis subtítulos.",
+    "¿Puedo suscribirme al boletín?",
+    "Mi correo es amara.organizacion@example.com",
+)
+
+def main():
+    gate = TurnGate()
+    failures = 0
+    for text in PHANTOMS:
+        reason = gate.check(text, **CONFIDENT)
+        ok = reason == "phantom"
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} descartada ({reason}): {text}")
+    for text in NEAR_MISSES:
+        reason = gate.check(text, **CONFIDENT)
+        ok = reason is None
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} aceptada ({reason}): {text}")
+    if failures:
+        print(f"❌ {failures} casos fallaron")
+        return 1
+    print("✅ Frases fantasma sólo por palabras completas")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
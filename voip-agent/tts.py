@@ -1,22 +1,53 @@
 import os
+import re
 import numpy as np
-from piper import PiperVoice
-from utils import get_env, setup_log
+from utils import get_env, setup_log, load_tuning_profile
+from models import registry
+from resample import Resampler, resample
+
+# Frecuencia nativa de las voces Piper
+PIPER_RATE = 22050
+# Fin de oración y, para la primera oración larga, fin de cláusula
+SENTENCE_END = re.compile(r"(?<=[.!?;:…])\s+")
+CLAUSE_END = re.compile(r"(?<=,)\s+")
+
+def split_text(text, first_clause_chars=60):
+    """Divide la respuesta en oraciones; si la primera es larga se corta en su primera coma
+    para que el primer audio esté listo antes."""
+    sentences = [s.strip() for s in SENTENCE_END.split(text.strip()) if s.strip()]
+    if sentences and len(sentences[0]) > first_clause_chars:
+        head, *rest = CLAUSE_END.split(sentences[0], maxsplit=1)
+        sentences[:1] = [head] + rest
+    return sentences
+
+class TTSError(Exception):
+    """La síntesis falló y no se pidió el tono de respaldo."""
 
 class TTSWorker:
-    def __init__(self):
+    def __init__(self, load_model=True):
         self.logger = setup_log(__name__)
         self.voice = '/root/.cache/piper/es_MX-claude-high.onnx'
         self.rate = float(get_env('PIPER_RATE', '1.0'))
+        # Hilos de la sesión ONNX de Piper (0 = valor por defecto de onnxruntime)
+        profile = load_tuning_profile("tts")
+        self.intra_op_threads = int(get_env('PIPER_THREADS', profile.get('intra_op_threads', 0)))
+        if not load_model:
+            # La voz se carga en los procesos del pool de TTS (tts_pool.py)
+            self.model = None
+            return
         try:
-            self.model = PiperVoice.load(self.voice)
-            self.logger.info(f"Loaded Piper voice: {self.voice}")
+            self.model = registry.piper(self.voice, intra_op_threads=self.intra_op_threads)
+            self.logger.info(f"Loaded Piper voice: {self.voice} (hilos ONNX: {self.intra_op_threads or 'auto'})")
         except Exception as e:
             self.logger.error(f"Failed to load Piper voice {self.voice}: {e}")
             raise
 
-    def synthesize(self, text):
-        """Synthesize text to audio using Piper TTS optimizado para Asterisk 8kHz."""
+    def synthesize(self, text, sample_rate=8000, fallback=True):
+        """Synthesize text to audio using Piper TTS optimizado para Asterisk (8 o 16 kHz).
+
+        Con fallback=False un fallo lanza TTSError en vez de devolver el tono de respaldo
+        (para no guardar el tono en la cache).
+        """
         try:
             self.logger.info(f"Iniciando síntesis TTS para: {text[:50]}...")
 
@@ -70,7 +101,7 @@ class TTSWorker:
 
             if not audio_chunks:
                 self.logger.error("No se extrajo audio válido")
-                return self._generate_fallback_tone()
+                return self._fallback(sample_rate, fallback)
 
             # Concatenar chunks con verificación de tipos
             if len(audio_chunks) == 1:
@@ -89,7 +120,7 @@ class TTSWorker:
             self.logger.info(f"Audio final a 22kHz: {len(audio)} samples, dtype: {audio.dtype}")
 
             if len(audio) == 0:
-                return self._generate_fallback_tone()
+                return self._fallback(sample_rate, fallback)
 
             # Procesamiento final del audio
             if audio.dtype == np.int16:
@@ -102,21 +133,16 @@ class TTSWorker:
                 else:
                     audio_final = audio.astype(np.int16)
 
-            # CORRECCIÓN CRÍTICA: Resamplear de 22kHz a 8kHz para Asterisk
+            # CORRECCIÓN CRÍTICA: Resamplear de 22kHz a la frecuencia del canal para Asterisk
             try:
-                import scipy.signal
-                # Calcular nueva longitud para 8kHz
-                resample_ratio = 8000 / 22050
-                new_length = int(len(audio_final) * resample_ratio)
-                
-                # Resamplear usando scipy con filtro anti-aliasing
-                audio_8k = scipy.signal.resample(audio_final, new_length)
-                audio_8k_int16 = audio_8k.astype(np.int16)
+                # Polifásico con filtro anti-aliasing precalculado (sin FFT de toda la frase)
+                audio_8k = resample(audio_final, PIPER_RATE, sample_rate)
+                audio_8k_int16 = np.clip(audio_8k, -32768, 32767).astype(np.int16)
                 
-                self.logger.info(f"Audio resampleado: {len(audio_final)} samples (22kHz) -> {len(audio_8k_int16)} samples (8kHz)")
+                self.logger.info(f"Audio resampleado: {len(audio_final)} samples (22kHz) -> {len(audio_8k_int16)} samples ({sample_rate}Hz)")
                 
                 # Aplicar fade-in y fade-out suaves para evitar clicks
-                fade_samples = min(80, len(audio_8k_int16) // 10)  # 10ms fade a 8kHz
+                fade_samples = min(sample_rate // 100, len(audio_8k_int16) // 10)  # 10ms fade
                 if len(audio_8k_int16) > fade_samples * 2:
                     # Fade-in
                     fade_in = np.linspace(0, 1, fade_samples)
@@ -142,29 +168,65 @@ class TTSWorker:
                 else:
                     self.logger.warning(f"⚠️ Audio 8kHz con {audio_stats['saturated']} samples saturados")
 
-                # Retornar audio a 8kHz para compatibilidad con Asterisk
-                self.logger.info(f"✅ TTS completado: {len(audio_8k_int16)} samples a 8000Hz para Asterisk")
-                return 8000, audio_8k_int16
+                # Retornar audio a la frecuencia del canal para compatibilidad con Asterisk
+                self.logger.info(f"✅ TTS completado: {len(audio_8k_int16)} samples a {sample_rate}Hz para Asterisk")
+                return sample_rate, audio_8k_int16
                 
-            except ImportError:
-                self.logger.error("scipy no disponible para resample, usando audio original")
-                return 22050, audio_final
             except Exception as resample_error:
                 self.logger.error(f"Error en resample: {resample_error}, usando audio original")
+                if not fallback:
+                    raise TTSError(f"resample: {resample_error}")
                 return 22050, audio_final
 
+        except TTSError:
+            raise
         except Exception as e:
             self.logger.error(f"TTS synthesis failed: {e}")
             import traceback
             self.logger.error(f"Traceback: {traceback.format_exc()}")
-            return self._generate_fallback_tone()
-
-    def _generate_fallback_tone(self):
+            return self._fallback(sample_rate, fallback)
+
+    def synthesize_stream(self, text, sample_rate=8000):
+        """Genera audio int16 a `sample_rate` por oración o cláusula, a medida que Piper lo produce.
+
+        Un solo remuestreador con estado recorre todos los segmentos, así la salida es
+        continua entre ellos y se puede encolar uno tras otro sin clicks. Se retienen los
+        últimos 5 ms de cada bloque para aplicar el fundido de salida al final.
+        """
+        resampler = Resampler(PIPER_RATE, sample_rate) if sample_rate != PIPER_RATE else None
+        fade_samples = sample_rate // 200  # 5 ms
+        held = np.zeros(0, dtype=np.float32)
+        first = True
+        for part in split_text(text):
+            for chunk in self.model.synthesize(part):
+                audio = chunk.audio_int16_array.astype(np.float32) * 0.8
+                if resampler:
+                    audio = resampler.process(audio)
+                audio = np.concatenate([held, audio])
+                if len(audio) <= fade_samples:
+                    held = audio
+                    continue
+                audio, held = audio[:-fade_samples], audio[-fade_samples:]
+                if first and len(audio) >= fade_samples:
+                    audio[:fade_samples] *= np.linspace(0, 1, fade_samples)
+                    first = False
+                yield np.clip(audio, -32768, 32767).astype(np.int16)
+        if resampler:
+            held = np.concatenate([held, resampler.flush()])
+        if len(held):
+            held[-fade_samples:] *= np.linspace(1, 0, min(fade_samples, len(held)))
+            yield np.clip(held, -32768, 32767).astype(np.int16)
+
+    def _fallback(self, sample_rate, fallback):
+        if not fallback:
+            raise TTSError("síntesis sin audio")
+        return self._generate_fallback_tone(sample_rate)
+
+    def _generate_fallback_tone(self, sample_rate=8000):
         """Generar un tono simple como fallback cuando TTS falla."""
         try:
-            # Crear un tono simple de 1 segundo a 8kHz para Asterisk
+            # Crear un tono simple de 1 segundo a la frecuencia del canal
             duration = 1.0
-            sample_rate = 8000
             t = np.linspace(0, duration, int(sample_rate * duration), False)
             
             # Crear un tono agradable con múltiples frecuencias
@@ -183,9 +245,9 @@ class TTSWorker:
             
             audio_fallback_int16 = (audio_fallback * 32767).astype(np.int16)
 
-            self.logger.info("Generado audio fallback: tono armónico a 8kHz para Asterisk")
+            self.logger.info(f"Generado audio fallback: tono armónico a {sample_rate}Hz para Asterisk")
             return sample_rate, audio_fallback_int16
 
         except Exception as fallback_error:
             self.logger.error(f"Error generando fallback: {fallback_error}")
-            return 8000, np.array([], dtype=np.int16)
+            return sample_rate, np.array([], dtype=np.int16)
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import pwd
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from utils import get_env, setup_log
+from metrics import tts_cache_lookups, tts_cache_bytes, tts_cache_entries, tts_cache_evictions
+
+INDEX_FILE = "index.json"
+# Extensiones de signed linear que Asterisk reconoce por frecuencia
+EXTENSIONS = {8000: "slin", 16000: "slin16"}
+
+class CacheEntry:
+    __slots__ = ("key", "text", "voice", "rate", "size", "hits", "misses", "last_used")
+
+    def __init__(self, key, text, voice, rate, size, hits=0, misses=1, last_used=None):
+        self.key = key
+        self.text = text
+        self.voice = voice
+        self.rate = rate
+        self.size = size
+        self.hits = hits
+        self.misses = misses
+        self.last_used = last_used or time.time()
+
+    @property
+    def filename(self):
+        return f"{self.key}.{EXTENSIONS[self.rate]}"
+
+    @property
+    def hit_rate(self):
+        return self.hits / (self.hits + self.misses)
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+class TTSCache:
+    """Cache de TTS en disco, direccionada por contenido y compartida entre reinicios.
+
+    La clave es el hash de texto, voz y formato de salida; cada frase se guarda una vez
+    como archivo signed linear listo para reproducir (ganancia aplicada) en el directorio
+    de sonidos de Asterisk, así que un acierto no sintetiza ni escribe nada: en modo
+    archivo se reproduce con `media`, en modo RTP se lee con `read`. El índice (orden
+    LRU y aciertos por frase) se guarda en index.json; al superar TTS_CACHE_MAX_MB se
+    expulsan las frases usadas hace más tiempo.
+    """
+
+    def __init__(self, voice, directory=None, max_bytes=None):
+        self.logger = setup_log("tts_cache")
+        self.voice = voice
+        self.directory = directory or get_env("TTS_CACHE_DIR", "/var/lib/asterisk/sounds/tts/cache")
+        self.max_bytes = max_bytes or int(float(get_env("TTS_CACHE_MAX_MB", 200)) * 1024 * 1024)
+        # Nombre para channel.play relativo al directorio de sonidos de Asterisk
+        self.media_prefix = get_env("TTS_CACHE_MEDIA", "sound:tts/cache")
+        self.entries = OrderedDict()  # menos reciente primero
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.load()
+
+    def key(self, text, rate):
+        return hashlib.sha256(f"{self.voice}\0{EXTENSIONS[rate]}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+    def path(self, entry):
+        return os.path.join(self.directory, entry.filename)
+
+    def media(self, entry):
+        return f"{self.media_prefix}/{entry.key}"
+
+    def _update_metrics(self):
+        tts_cache_bytes.set(self.total_bytes)
+        tts_cache_entries.set(len(self.entries))
+
+    def load(self):
+        """Carga el índice; descarta entradas sin archivo y archivos sin entrada."""
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = []
+        for item in sorted(saved, key=lambda item: item["last_used"]):
+            entry = CacheEntry(**item)
+            if entry.rate in EXTENSIONS and os.path.exists(self.path(entry)):
+                self.entries[entry.key] = entry
+                self.total_bytes += entry.size
+        known = {entry.filename for entry in self.entries.values()} | {INDEX_FILE}
+        for name in os.listdir(self.directory):
+            if name not in known:
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        self._update_metrics()
+        self.logger.info(f"Cache TTS: {len(self.entries)} frases, {self.total_bytes / 1e6:.1f} MB en {self.directory}")
+
+    def save(self):
+        with self.lock:
+            items = [entry.to_dict() for entry in self.entries.values()]
+        tmp = os.path.join(self.directory, f".{INDEX_FILE}.tmp")
+        with self.save_lock:
+            with open(tmp, "w") as f:
+                json.dump(items, f, ensure_ascii=False)
+            os.replace(tmp, os.path.join(self.directory, INDEX_FILE))
+
+    def lookup(self, text, rate):
+        """Entrada de la frase (y la marca como usada) o None; cuenta acierto/fallo."""
+        with self.lock:
+            entry = self.entries.get(self.key(text, rate))
+            if entry is None:
+                tts_cache_lookups.labels(result="miss").inc()
+                return None
+            entry.hits += 1
+            entry.last_used = time.time()
+            self.entries.move_to_end(entry.key)
+        tts_cache_lookups.labels(result="hit").inc()
+        return entry
+
+    def contains(self, text, rate):
+        return self.key(text, rate) in self.entries
+
+    def read(self, entry):
+        """Audio int16 listo para reproducir (en un hilo del executor)."""
+        return np.fromfile(self.path(entry), dtype=np.int16)
+
+    def store(self, text, rate, audio_int16):
+        """Guarda una frase sintetizada (en un hilo del executor) y expulsa por presupuesto."""
+        audio_int16 = np.asarray(audio_int16, dtype=np.int16)
+        key = self.key(text, rate)
+        with self.lock:
+            previous = self.entries.get(key)
+        entry = CacheEntry(key, text, self.voice, rate, audio_int16.nbytes,
+                           misses=previous.misses + 1 if previous else 1)
+        path = self.path(entry)
+        tmp = f"{path}.tmp"
+        audio_int16.tofile(tmp)
+        os.chmod(tmp, 0o644)
+        try:
+            asterisk_user = pwd.getpwnam("asterisk")
+            os.chown(tmp, asterisk_user.pw_uid, asterisk_user.pw_gid)
+        except KeyError:
+            pass
+        os.replace(tmp, path)
+        evicted = []
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key).size
+            self.entries[key] = entry
+            self.total_bytes += entry.size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, old = self.entries.popitem(last=False)
+                self.total_bytes -= old.size
+                evicted.append(old)
+            self._update_metrics()
+        for old in evicted:
+            tts_cache_evictions.inc()
+            try:
+                os.unlink(self.path(old))
+            except OSError:
+                pass
+        self.save()
+        return entry
+
+    def stats(self, limit=20):
+        """Frases más pedidas con su tasa de aciertos"""
+        with self.lock:
+            entries = sorted(self.entries.values(), key=lambda e: e.hits + e.misses, reverse=True)[:limit]
+            summary = {"entries": len(self.entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes}
+        summary["phrases"] = [{"text": e.text, "hits": e.hits, "misses": e.misses,
+                               "hit_rate": round(e.hit_rate, 3), "bytes": e.size} for e in entries]
+        return summary
@@ -0,0 +1,296 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from utils import get_env, setup_log, load_tuning_profile
+from metrics import tts_pool_queue_depth, tts_pool_requests, tts_pool_worker_deaths
+from tts import TTSError
+
+# Cada cuánto revisa el hilo receptor que los workers sigan vivos (s)
+LIVENESS_INTERVAL = 1.0
+
+def share(audio):
+    """Copia `audio` a un bloque de memoria compartida nuevo; el proceso principal lo libera."""
+    audio = np.ascontiguousarray(audio, dtype=np.int16)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, audio.nbytes))
+    np.ndarray(audio.shape, dtype=np.int16, buffer=shm.buf)[:] = audio
+    # El bloque lo desvincula el receptor: que el resource tracker del worker no lo borre
+    resource_tracker.unregister(shm._name, "shared_memory")
+    name = shm.name
+    shm.close()
+    return name, len(audio)
+
+def receive(name, length):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray((length,), dtype=np.int16, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+def worker_main(index, requests, responses, cancelled):
+    """Proceso de TTS: carga la voz Piper una vez y atiende peticiones en orden."""
+    from tts import TTSWorker
+    logger = setup_log(f"tts_pool.{index}")
+    tts = TTSWorker()
+    responses.put((None, "ready", index))
+    logger.info(f"Worker TTS {index} listo (pid {os.getpid()})")
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, kind, text, sample_rate, fallback = request
+        try:
+            if kind == "stream":
+                for segment in tts.synthesize_stream(text, sample_rate):
+                    if cancelled.value == request_id:
+                        break
+                    responses.put((request_id, "chunk", share(segment)))
+                responses.put((request_id, "done", sample_rate))
+            else:
+                rate, audio = tts.synthesize(text, sample_rate, fallback)
+                responses.put((request_id, "chunk", share(audio)))
+                responses.put((request_id, "done", rate))
+        except TTSError as e:
+            responses.put((request_id, "tts_error", str(e)))
+        except Exception as e:
+            logger.error(f"Error en worker TTS {index}: {e}")
+            responses.put((request_id, "error", f"{type(e).__name__}: {e}"))
+
+class PoolRequest:
+    __slots__ = ("worker", "queue", "chunks", "future", "abandoned")
+
+    def __init__(self, worker, queue=None, future=None):
+        self.worker = worker
+        self.queue = queue
+        self.chunks = []
+        self.future = future
+        self.abandoned = False
+
+class TTSPool:
+    """Síntesis de Piper en procesos separados (fuera del GIL del proceso principal).
+
+    Cada worker carga la voz una vez. Las peticiones van al worker con menos peticiones
+    pendientes y el audio vuelve por memoria compartida (un bloque por resultado que el
+    hilo receptor copia y libera), no como arrays serializados. `synthesize` equivale a
+    TTSWorker.synthesize; `synthesize_stream` entrega los segmentos por oración a medida
+    que el worker los produce y, si se abandona, avisa al worker para que no siga.
+
+    El hilo receptor vigila además que los workers sigan vivos: si uno muere, sus
+    peticiones pendientes fallan con RuntimeError, deja de recibir trabajo y se relanza.
+    """
+
+    def __init__(self, workers=None):
+        self.logger = setup_log("tts_pool")
+        profile = load_tuning_profile("tts")
+        default_workers = profile.get("workers", max(1, (os.cpu_count() or 2) // 2))
+        self.workers = workers or int(get_env("TTS_POOL_WORKERS", default_workers))
+        self.context = multiprocessing.get_context("spawn")
+        self.responses = self.context.Queue()
+        self.request_queues = [None] * self.workers
+        self.cancelled = [None] * self.workers
+        self.processes = [None] * self.workers
+        # Sólo los workers que terminaron de cargar la voz reciben peticiones
+        self.alive = [False] * self.workers
+        self.pending_counts = [0] * self.workers
+        self.pending = {}
+        self.ids = itertools.count(1)
+        self.loop = None
+        self.reader = None
+        self.starting = {}
+        self.stopping = False
+
+    def _spawn(self, index):
+        # Cola y marca de cancelación nuevas: las del worker anterior pueden haber
+        # quedado a medias si murió
+        requests = self.context.Queue()
+        cancelled = self.context.Value("q", 0, lock=False)
+        process = self.context.Process(target=worker_main, name=f"tts-{index}", daemon=True,
+                                       args=(index, requests, self.responses, cancelled))
+        process.start()
+        self.request_queues[index] = requests
+        self.cancelled[index] = cancelled
+        self.processes[index] = process
+
+    async def start(self, timeout=120):
+        """Arranca los workers y espera a que todos carguen la voz sin bloquear el loop."""
+        self.loop = asyncio.get_running_loop()
+        self.stopping = False
+        self.starting = {index: self.loop.create_future() for index in range(self.workers)}
+        self.reader = threading.Thread(target=self.read_responses, name="tts-pool-reader", daemon=True)
+        self.reader.start()
+        try:
+            for index in range(self.workers):
+                await self.loop.run_in_executor(None, self._spawn, index)
+            await asyncio.wait_for(asyncio.gather(*self.starting.values()), timeout)
+        except BaseException:
+            self.stop()
+            raise
+        finally:
+            self.starting = {}
+        self.logger.info(f"Pool TTS iniciado: {self.workers} procesos")
+
+    def stop(self):
+        self.stopping = True
+        for requests in self.request_queues:
+            if requests is not None:
+                requests.put(None)
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.responses.put((None, "stop", None))
+        if self.reader:
+            self.reader.join(timeout=5)
+        self.processes = [None] * self.workers
+        self.request_queues = [None] * self.workers
+        self.cancelled = [None] * self.workers
+        self.alive = [False] * self.workers
+
+    def read_responses(self):
+        """Hilo receptor: copia el audio de la memoria compartida y entrega en el loop.
+
+        Entre respuestas (o cada LIVENESS_INTERVAL sin ellas) revisa que los workers sigan
+        vivos y avisa al loop de cada proceso que terminó.
+        """
+        reported = set()
+        last_check = time.monotonic()
+        while True:
+            try:
+                request_id, kind, payload = self.responses.get(timeout=LIVENESS_INTERVAL)
+            except queue.Empty:
+                kind = None
+            if kind == "stop":
+                return
+            if kind == "ready":
+                self.loop.call_soon_threadsafe(self.worker_ready, payload)
+            elif kind is not None:
+                audio = receive(*payload) if kind == "chunk" else None
+                self.loop.call_soon_threadsafe(self.deliver, request_id, kind, payload, audio)
+            if kind is None or time.monotonic() - last_check >= LIVENESS_INTERVAL:
+                last_check = time.monotonic()
+                for index, process in enumerate(self.processes):
+                    if process is not None and process not in reported and not process.is_alive():
+                        reported.add(process)
+                        self.loop.call_soon_threadsafe(self.worker_died, index, process.exitcode)
+
+    def worker_ready(self, index):
+        self.alive[index] = True
+        future = self.starting.get(index)
+        if future and not future.done():
+            future.set_result(index)
+        else:
+            self.logger.info(f"Worker TTS {index} relanzado")
+
+    def worker_died(self, index, exitcode):
+        """Falla las peticiones del worker muerto y lo relanza (salvo al arrancar o parar)."""
+        if self.stopping:
+            return
+        self.alive[index] = False
+        tts_pool_worker_deaths.inc()
+        self.logger.error(f"Worker TTS {index} terminó inesperadamente (código {exitcode})")
+        error = f"worker TTS {index} terminó (código {exitcode})"
+        for request_id, request in list(self.pending.items()):
+            if request.worker != index:
+                continue
+            del self.pending[request_id]
+            if request.abandoned:
+                continue
+            if request.queue is not None:
+                request.queue.put_nowait(RuntimeError(error))
+            elif not request.future.done():
+                request.future.set_exception(RuntimeError(error))
+        self.pending_counts[index] = 0
+        self._update_depth()
+        future = self.starting.get(index)
+        if future is not None:
+            # No cargó la voz: relanzarlo fallaría igual
+            if not future.done():
+                future.set_exception(RuntimeError(f"worker TTS no arrancó: {error}"))
+            return
+        self.loop.run_in_executor(None, self._spawn, index)
+
+    def deliver(self, request_id, kind, payload, audio):
+        request = self.pending.get(request_id)
+        if request is None:
+            return
+        if kind == "chunk":
+            if request.abandoned:
+                return
+            if request.queue is not None:
+                request.queue.put_nowait(audio)
+            else:
+                request.chunks.append(audio)
+            return
+        # La petición cuenta en la cola del worker hasta que éste termina con ella
+        del self.pending[request_id]
+        self.pending_counts[request.worker] -= 1
+        self._update_depth()
+        if request.abandoned:
+            return
+        if kind == "done":
+            result = None if request.queue is not None else (payload, request.chunks[0])
+        else:
+            result = TTSError(payload) if kind == "tts_error" else RuntimeError(payload)
+        if request.queue is not None:
+            request.queue.put_nowait(result)
+        elif request.future.done():
+            return
+        elif isinstance(result, Exception):
+            request.future.set_exception(result)
+        else:
+            request.future.set_result(result)
+
+    def _update_depth(self):
+        for index, count in enumerate(self.pending_counts):
+            tts_pool_queue_depth.labels(worker=str(index)).set(count)
+
+    def _submit(self, kind, text, sample_rate, fallback, request):
+        # El worker vivo con menos peticiones pendientes
+        workers = [index for index in range(self.workers) if self.alive[index]]
+        if not workers:
+            raise RuntimeError("ningún worker TTS disponible")
+        worker = min(workers, key=self.pending_counts.__getitem__)
+        request.worker = worker
+        request_id = next(self.ids)
+        self.pending[request_id] = request
+        self.pending_counts[worker] += 1
+        self._update_depth()
+        tts_pool_requests.labels(kind=kind).inc()
+        self.request_queues[worker].put((request_id, kind, text, sample_rate, fallback))
+        return request_id
+
+    async def synthesize(self, text, sample_rate=8000, fallback=True):
+        """(rate, audio int16) como TTSWorker.synthesize, calculado en un worker."""
+        request = PoolRequest(None, future=self.loop.create_future())
+        self._submit("synthesize", text, sample_rate, fallback, request)
+        return await request.future
+
+    async def synthesize_stream(self, text, sample_rate=8000):
+        """Segmentos int16 por oración a medida que el worker los produce."""
+        request = PoolRequest(None, queue=asyncio.Queue())
+        request_id = self._submit("stream", text, sample_rate, True, request)
+        finished = False
+        try:
+            while True:
+                item = await request.queue.get()
+                if item is None:
+                    finished = True
+                    return
+                if isinstance(item, Exception):
+                    finished = True
+                    raise item
+                yield item
+        finally:
+            if not finished:
+                # Abandonada (barge-in): el worker corta tras el segmento en curso y los
+                # segmentos que aún lleguen se liberan sin entregarse
+                self.cancelled[request.worker].value = request_id
+                request.abandoned = True
@@ -0,0 +1,106 @@
+import json
+import re
+import numpy as np
+from utils import get_env, setup_log
+
+# Respuestas semiestáticas: texto fijo con huecos {} para la parte variable
+DEFAULT_TEMPLATES = (
+    "Nuestro horario es {}.",
+    "Tu cita queda para el {} a las {}.",
+    "Tu número de caso es el {}.",
+    "Te comunico con {}, un momento por favor.",
+)
+SLOT = "{}"
+
+class Template:
+    def __init__(self, text):
+        self.text = text
+        self.pieces = text.split(SLOT)
+        # Partes que se pre-renderizan (las de sólo puntuación van con el hueco)
+        self.fixed = [piece.strip() for piece in self.pieces if re.search(r"\w", piece)]
+        pattern = "(.+?)".join(r"\s*".join(re.escape(word) for word in piece.split(" ")) for piece in self.pieces)
+        self.regex = re.compile(pattern, re.IGNORECASE)
+
+    def match(self, text, max_slot_chars):
+        """Partes ("fixed" | "slot", texto) de `text` o None si no sigue la plantilla."""
+        found = self.regex.fullmatch(text.strip())
+        if not found or any(not slot.strip() or len(slot.strip()) > max_slot_chars for slot in found.groups()):
+            return None
+        parts = []
+        for i, piece in enumerate(self.pieces):
+            piece = piece.strip()
+            if parts and piece and not re.search(r"\w", piece):
+                # Sólo puntuación ("."): va con el hueco anterior para que cierre la entonación
+                parts[-1] = ("slot", parts[-1][1] + piece)
+            elif piece:
+                parts.append(("fixed", piece))
+            if i < len(found.groups()):
+                parts.append(("slot", found.group(i + 1).strip()))
+        return parts
+
+class PhraseSplicer:
+    """Respuestas por plantilla: partes fijas pre-renderizadas + hueco sintetizado.
+
+    Si una respuesta sigue una plantilla ("Nuestro horario es {}."), las partes fijas
+    salen de la cache de TTS (se sintetizan una vez) y sólo el hueco pasa por Piper.
+    `join` pega los audios a la frecuencia de salida recortando el silencio de las
+    uniones y con un fundido cruzado corto. Plantillas adicionales en TTS_TEMPLATES
+    (archivo JSON con una lista de textos).
+    """
+
+    def __init__(self, templates=None):
+        self.logger = setup_log("tts_splice")
+        self.max_slot_chars = int(get_env("TTS_SPLICE_MAX_SLOT", 60))
+        self.crossfade_ms = int(get_env("TTS_SPLICE_CROSSFADE_MS", 10))
+        # Silencio que se conserva a cada lado de una unión
+        self.keep_ms = int(get_env("TTS_SPLICE_KEEP_MS", 20))
+        self.silence = int(get_env("TTS_SPLICE_SILENCE", 300))
+        if templates is None:
+            templates = list(DEFAULT_TEMPLATES)
+            path = get_env("TTS_TEMPLATES")
+            if path:
+                try:
+                    with open(path) as f:
+                        templates += json.load(f)
+                except (OSError, ValueError) as e:
+                    self.logger.error(f"No se pudieron cargar plantillas de {path}: {e}")
+        # Primero las plantillas con más texto fijo (más específicas)
+        self.templates = sorted((Template(t) for t in templates if SLOT in t),
+                                key=lambda t: len(t.text) - len(SLOT) * len(t.pieces), reverse=True)
+        self.logger.info(f"{len(self.templates)} plantillas de TTS por partes")
+
+    def fixed_pieces(self):
+        return sorted({piece for template in self.templates for piece in template.fixed})
+
+    def match(self, text):
+        for template in self.templates:
+            parts = template.match(text, self.max_slot_chars)
+            if parts:
+                return parts
+        return None
+
+    def trim(self, audio, keep, head=True, tail=True):
+        """Recorta el silencio de los bordes que se van a unir, dejando `keep` muestras"""
+        voiced = np.flatnonzero((audio > self.silence) | (audio < -self.silence))
+        if not len(voiced):
+            return audio
+        start = max(0, voiced[0] - keep) if head else 0
+        end = min(len(audio), voiced[-1] + 1 + keep) if tail else len(audio)
+        return audio[start:end]
+
+    def join(self, pieces, sample_rate):
+        """Une audios int16 con fundido cruzado; los bordes exteriores no se tocan"""
+        keep = sample_rate * self.keep_ms // 1000
+        fade = sample_rate * self.crossfade_ms // 1000
+        pieces = [self.trim(piece, keep, head=i > 0, tail=i < len(pieces) - 1)
+                  for i, piece in enumerate(pieces) if len(piece)]
+        if not pieces:
+            return np.zeros(0, dtype=np.int16)
+        out = pieces[0].astype(np.float32)
+        for piece in pieces[1:]:
+            piece = piece.astype(np.float32)
+            n = min(fade, len(out), len(piece))
+            ramp = np.linspace(0, 1, n, dtype=np.float32)
+            overlap = out[len(out) - n:] * (1 - ramp) + piece[:n] * ramp
+            out = np.concatenate([out[:len(out) - n], overlap, piece[n:]])
+        return np.clip(out, -32768, 32767).astype(np.int16)
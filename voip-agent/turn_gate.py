@@ -0,0 +1,66 @@
+from utils import get_env, setup_log
+from stt import normalize_word
+
+# Frases que Whisper inventa sobre ruido o silencio (subtítulos de su entrenamiento):
+# siempre se descartan
+PHANTOM_PHRASES = (
+    "amara.org",
+    "subtítulos realizados por",
+    "subtítulos por la comunidad",
+    "suscríbete",
+    "gracias por ver",
+)
+# Respuestas plausibles que también aparecen como alucinación: se descartan sólo si
+# además la confianza o la proporción de voz son bajas
+WEAK_PHANTOMS = {
+    "gracias",
+    "muchas gracias",
+    "música",
+    "adiós",
+    "chao",
+    "hasta luego",
+}
+
+class TurnGate:
+    """Filtro entre STT y el LLM: descarta turnos que son silencio, ruido o alucinación.
+
+    Usa la confianza de Whisper (no_speech_prob, avg_logprob), la proporción de voz de la
+    expresión según el VAD y una lista de frases fantasma. `check` devuelve el motivo del
+    descarte o None si el turno debe llegar al LLM.
+    """
+
+    def __init__(self):
+        self.logger = setup_log("turn_gate")
+        self.no_speech = float(get_env("GATE_NO_SPEECH", 0.6))
+        self.min_logprob = float(get_env("GATE_MIN_LOGPROB", -1.0))
+        self.min_speech_ratio = float(get_env("GATE_MIN_SPEECH_RATIO", 0.15))
+        extra = get_env("GATE_PHANTOM_PHRASES", "")
+        phrases = PHANTOM_PHRASES + tuple(extra.split(","))
+        # Normalizadas como el texto: se comparan por palabras completas
+        self.phantoms = tuple(p for p in (self.normalize(phrase) for phrase in phrases) if p)
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(normalize_word(word) for word in text.split() if normalize_word(word))
+
+    def is_phantom(self, normalized):
+        """Si el texto normalizado contiene una frase fantasma como secuencia de palabras
+        completas ("gracias por verificar" no contiene "gracias por ver")"""
+        padded = f" {normalized} "
+        return any(f" {phrase} " in padded for phrase in self.phantoms)
+
+    def check(self, text, avg_logprob, no_speech_prob, speech_ratio=None):
+        normalized = self.normalize(text)
+        if self.is_phantom(normalized):
+            return "phantom"
+        # Regla de silencio de Whisper: probablemente sin voz y con baja confianza
+        if no_speech_prob > self.no_speech and avg_logprob < self.min_logprob:
+            return "no_speech"
+        if speech_ratio is not None and speech_ratio < self.min_speech_ratio:
+            return "speech_ratio"
+        if normalized in WEAK_PHANTOMS:
+            # Umbrales más laxos: basta una señal débil para descartar la frase sospechosa
+            if (no_speech_prob > self.no_speech / 2 or avg_logprob < self.min_logprob / 2
+                    or (speech_ratio is not None and speech_ratio < 2 * self.min_speech_ratio)):
+                return "weak_phantom"
+        return None
@@ -3,7 +3,7 @@ import asyncio
 import logging
 import numpy as np
 from dotenv import load_dotenv
-from scipy.signal import resample
+from resample import resample
 
 load_dotenv()
 
@@ -18,10 +18,7 @@ def setup_log(name):
     return logging.getLogger(name)
 
 def resample_48k_to_8k(audio, orig_sr=48000, target_sr=8000):
-    if orig_sr == target_sr:
-        return audio
-    num_samples = int(len(audio) * target_sr / orig_sr)
-    return resample(audio, num_samples)
+    return resample(audio, orig_sr, target_sr)
 
 def write_wave(path, rate, data):
     import soundfile as sf
@@ -48,3 +45,15 @@ def preprocess_audio(data, rate, target_rate=8000):
         data = resample_48k_to_8k(data, rate, target_rate)
         rate = target_rate
     return data, rate
+
+TUNING_PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tuning_profile.json")
+
+def load_tuning_profile(section):
+    """Sección del perfil generado por autotune.py ({} si no existe)."""
+    import json
+    path = get_env("TUNING_PROFILE", TUNING_PROFILE)
+    try:
+        with open(path) as f:
+            return json.load(f).get(section, {})
+    except (OSError, ValueError):
+        return {}
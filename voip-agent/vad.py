@@ -1,6 +1,97 @@
 import numpy as np
-import silero_vad
 from utils import get_env, setup_log
+from models import registry
+
+# silero-vad procesa ventanas fijas de 32 ms más un contexto de la ventana anterior
+VAD_FRAME_MS = 32
+CONTEXT_SAMPLES = {8000: 32, 16000: 64}
+
+class VadStream:
+    """Estado de VAD en streaming de un canal: estado oculto de silero, contexto y eventos.
+
+    Consume audio de cualquier tamaño, lo corta en ventanas de 32 ms y hace una sola
+    pasada del modelo por ventana. Emite eventos de inicio/fin de voz con histéresis
+    (como VADIterator de silero).
+    """
+
+    def __init__(self, channel_id, sample_rate, threshold=0.5, min_silence_ms=100, speech_pad_ms=30):
+        if sample_rate not in CONTEXT_SAMPLES:
+            raise ValueError(f"silero-vad sólo soporta 8000 o 16000 Hz, no {sample_rate}")
+        self.channel_id = channel_id
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.neg_threshold = max(threshold - 0.15, 0.01)
+        self.frame_samples = sample_rate * VAD_FRAME_MS // 1000
+        self.context_samples = CONTEXT_SAMPLES[sample_rate]
+        self.min_silence_samples = sample_rate * min_silence_ms // 1000
+        self.speech_pad_samples = sample_rate * speech_pad_ms // 1000
+        # Entrada del modelo: [contexto | ventana], reutilizada en cada frame
+        self.input = np.zeros((1, self.context_samples + self.frame_samples), dtype=np.float32)
+        self.pending = np.zeros(self.frame_samples, dtype=np.float32)
+        self.pending_count = 0
+        self.reset()
+
+    def reset(self):
+        self.state = np.zeros((2, 1, 128), dtype=np.float32)
+        self.input[:] = 0
+        self.pending_count = 0
+        self.position = 0  # muestras consumidas por el modelo
+        self.triggered = False
+        self.temp_end = 0
+        self.last_prob = 0.0
+
+    @property
+    def consumed(self):
+        """Muestras recibidas por el stream (procesadas más pendientes)."""
+        return self.position + self.pending_count
+
+    def frames(self, audio):
+        """Divide audio float32 en ventanas completas, guardando el resto para la próxima llamada."""
+        offset = 0
+        if self.pending_count:
+            take = min(self.frame_samples - self.pending_count, len(audio))
+            self.pending[self.pending_count:self.pending_count + take] = audio[:take]
+            self.pending_count += take
+            offset = take
+            if self.pending_count < self.frame_samples:
+                return
+            self.pending_count = 0
+            yield self.pending
+        while offset + self.frame_samples <= len(audio):
+            yield audio[offset:offset + self.frame_samples]
+            offset += self.frame_samples
+        rest = len(audio) - offset
+        if rest:
+            self.pending[:rest] = audio[offset:]
+            self.pending_count = rest
+
+    def prepare(self, frame):
+        """Escribe la ventana tras el contexto y devuelve la entrada del modelo."""
+        self.input[0, self.context_samples:] = frame
+        return self.input
+
+    def advance(self, prob, state):
+        """Aplica la salida del modelo para una ventana; devuelve un evento o None."""
+        self.state = state
+        self.input[0, :self.context_samples] = self.input[0, -self.context_samples:]
+        self.position += self.frame_samples
+        self.last_prob = prob
+
+        if prob >= self.threshold:
+            self.temp_end = 0
+            if not self.triggered:
+                self.triggered = True
+                start = max(0, self.position - self.frame_samples - self.speech_pad_samples)
+                return {"event": "start", "sample": start, "time": start / self.sample_rate, "prob": prob}
+        elif prob < self.neg_threshold and self.triggered:
+            if not self.temp_end:
+                self.temp_end = self.position
+            if self.position - self.temp_end >= self.min_silence_samples:
+                end = self.temp_end + self.speech_pad_samples - self.frame_samples
+                self.triggered = False
+                self.temp_end = 0
+                return {"event": "end", "sample": end, "time": end / self.sample_rate, "prob": prob}
+        return None
 
 class VadController:
     def __init__(self):
@@ -8,17 +99,76 @@ class VadController:
         self.sample_rate = int(get_env("SAMPLE_RATE", 8000))
         self.vad_sensitivity = float(get_env("VAD_SENSITIVITY", 0.5))
         self.frame_ms = int(get_env("FRAME_MS", 20))
-        self.model = silero_vad.load_silero_vad()
+        self.min_silence_ms = int(get_env("VAD_MIN_SILENCE_MS", 100))
+        # Sesión ONNX compartida por todo el proceso; el estado oculto vive en cada VadStream
+        self.model = registry.silero()
+        self.streams = {}
+
+    def process(self, audio_data, sample_rate=None):
+        """Procesa audio para detectar voz usando silero-vad (8 o 16 kHz).
 
-    def process(self, audio_data):
-        """Procesa audio para detectar voz usando silero-vad."""
+        Usa un VadStream temporal: no toca el estado interno del modelo compartido.
+        """
         if audio_data.dtype != np.float32:
             audio_data = audio_data.astype(np.float32) / 32768.0
-        speech_timestamps = silero_vad.get_speech_timestamps(
-            audio_data,
-            self.model,
-            sampling_rate=self.sample_rate,
-            threshold=self.vad_sensitivity
+        stream = VadStream(None, sample_rate or self.sample_rate, threshold=self.vad_sensitivity,
+                           min_silence_ms=self.min_silence_ms)
+        segments = 0
+        for frame in stream.frames(audio_data):
+            prob, state = self.infer(stream.prepare(frame), stream.state, stream.sample_rate)
+            event = stream.advance(float(prob[0][0]), state)
+            if event and event["event"] == "start":
+                segments += 1
+        self.logger.info(f"VAD detectó {segments} segmentos de voz")
+        return segments > 0
+
+    def open_stream(self, channel_id, sample_rate=None):
+        """Crea (o reinicia) el estado de VAD en streaming de un canal."""
+        stream = VadStream(
+            channel_id,
+            sample_rate or self.sample_rate,
+            threshold=self.vad_sensitivity,
+            min_silence_ms=self.min_silence_ms
         )
-        self.logger.info(f"VAD detectó {len(speech_timestamps)} segmentos de voz")
-        return len(speech_timestamps) > 0
+        self.streams[channel_id] = stream
+        return stream
+
+    def close_stream(self, channel_id):
+        self.streams.pop(channel_id, None)
+
+    def infer(self, model_input, state, sample_rate):
+        """Una pasada del modelo silero: devuelve (probabilidades, nuevo estado)."""
+        prob, new_state = self.model.session.run(None, {
+            'input': model_input,
+            'state': state,
+            'sr': np.array(sample_rate, dtype=np.int64)
+        })
+        return prob, new_state
+
+    def process_stream(self, channel_id, audio_chunk, sample_rate=None):
+        """Consume un chunk en el stream del canal.
+
+        Devuelve (hay_voz, eventos): hay_voz indica si alguna ventana del chunk superó el
+        umbral; eventos es la lista de inicios/fines de voz con su timestamp.
+        """
+        stream = self.streams.get(channel_id)
+        if stream is None:
+            stream = self.open_stream(channel_id, sample_rate)
+        if audio_chunk.dtype != np.float32:
+            audio_chunk = audio_chunk.astype(np.float32) / 32768.0
+        speech = False
+        events = []
+        for frame in stream.frames(audio_chunk):
+            prob, state = self.infer(stream.prepare(frame), stream.state, stream.sample_rate)
+            prob = float(prob[0][0])
+            speech = speech or prob >= stream.threshold
+            event = stream.advance(prob, state)
+            if event:
+                self.logger.debug(f"VAD {event['event']} en canal {channel_id}: {event['time']:.2f}s")
+                events.append(event)
+        return speech, events
+
+    def is_speech(self, audio_chunk, channel_id=None, sample_rate=None):
+        """Indica si el chunk contiene voz, manteniendo el estado del canal entre llamadas."""
+        speech, _ = self.process_stream(channel_id, audio_chunk, sample_rate)
+        return speech
@@ -0,0 +1,160 @@
+import asyncio
+from collections import deque
+import numpy as np
+from utils import get_env, setup_log
+
+class VadRequest:
+    """Chunk enviado por un canal: se resuelve cuando todas sus ventanas pasaron por el modelo."""
+
+    __slots__ = ("future", "remaining", "speech", "events")
+
+    def __init__(self, future, remaining):
+        self.future = future
+        self.remaining = remaining
+        self.speech = False
+        self.events = []
+
+class VadScheduler:
+    """VAD por lotes entre canales sobre un reloj de frames común.
+
+    Cada tick (32 ms) toma la siguiente ventana de cada canal activo, apila entradas y
+    estados ocultos (2, B, 128) y hace una sola pasada del modelo para todos, en lugar
+    de una llamada ONNX y un salto de hilo por canal. Los resultados se reparten al
+    VadStream de cada canal, que conserva su histéresis y eventos.
+    """
+
+    def __init__(self, vad, executor=None, tick_ms=None, max_batch=None):
+        self.logger = setup_log("vad_batch")
+        self.vad = vad
+        self.executor = executor
+        self.tick = (tick_ms or int(get_env("VAD_TICK_MS", 32))) / 1000
+        self.max_batch = max_batch or int(get_env("VAD_MAX_BATCH", 128))
+        self.queues = {}
+        self.work_ready = asyncio.Event()
+        self.task = None
+        self.batches = 0
+        self.frames = 0
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    @staticmethod
+    def _cancel(queue, error=None):
+        """Descarta las ventanas encoladas cancelando los futures de sus chunks (o
+        fallándolos con `error`)."""
+        for _, request in queue:
+            if request.future.done():
+                continue
+            if error is None:
+                request.future.cancel()
+            else:
+                request.future.set_exception(error)
+        queue.clear()
+
+    def close_stream(self, channel_id):
+        queue = self.queues.pop(channel_id, None)
+        if queue:
+            self._cancel(queue)
+
+    def submit(self, channel_id, audio_chunk, sample_rate=None):
+        """Encola un chunk del canal; devuelve un future con (hay_voz, eventos)."""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        stream = self.vad.streams.get(channel_id)
+        if stream is None:
+            stream = self.vad.open_stream(channel_id, sample_rate)
+        if audio_chunk.dtype != np.float32:
+            audio_chunk = audio_chunk.astype(np.float32) / 32768.0
+        # Copia: stream.frames reutiliza su buffer de muestras pendientes
+        frames = [frame.copy() for frame in stream.frames(audio_chunk)]
+        if not frames:
+            future.set_result((False, []))
+            return future
+        request = VadRequest(future, len(frames))
+        queue = self.queues.setdefault(channel_id, deque())
+        for frame in frames:
+            queue.append((frame, request))
+        self.work_ready.set()
+        return future
+
+    async def is_speech(self, channel_id, audio_chunk, sample_rate=None):
+        speech, _ = await self.submit(channel_id, audio_chunk, sample_rate)
+        return speech
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self.logger.info(f"Scheduler de VAD por lotes iniciado (tick {self.tick * 1000:.0f} ms)")
+        while True:
+            await self.work_ready.wait()
+            tick_start = loop.time()
+            try:
+                await self.step()
+            except Exception as e:
+                # Sin esto las mismas ventanas se reintentarían en cada tick y nadie
+                # resolvería los chunks: se fallan todos los pendientes
+                self.logger.error(f"Error en scheduler de VAD: {e}")
+                for queue in self.queues.values():
+                    self._cancel(queue, e)
+            if not any(self.queues.values()):
+                self.work_ready.clear()
+            # Esperar al siguiente tick para juntar las ventanas de todos los canales
+            delay = self.tick - (loop.time() - tick_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def step(self):
+        """Procesa todas las ventanas encoladas en pasadas por lotes (una ventana por canal y pasada)."""
+        loop = asyncio.get_event_loop()
+        while True:
+            groups = {}
+            for channel_id, queue in self.queues.items():
+                if queue:
+                    stream = self.vad.streams.get(channel_id)
+                    if stream is None:
+                        # VadStream cerrado sin close_stream: nadie resolvería estos chunks
+                        self._cancel(queue)
+                        continue
+                    groups.setdefault(stream.sample_rate, []).append((channel_id, stream, queue))
+            if not groups:
+                return
+            for sample_rate, group in groups.items():
+                for offset in range(0, len(group), self.max_batch):
+                    batch = group[offset:offset + self.max_batch]
+                    try:
+                        inputs = np.stack([stream.prepare(queue[0][0])[0] for _, stream, queue in batch])
+                        states = np.concatenate([stream.state for _, stream, _ in batch], axis=1)
+                        probs, new_states = await loop.run_in_executor(
+                            self.executor, self.vad.infer, inputs, states, sample_rate
+                        )
+                    except Exception as e:
+                        # Los chunks del lote fallan (quien espera recibe el error) y sus
+                        # ventanas se descartan en vez de reintentarse en cada tick
+                        self.logger.error(f"Error en lote de VAD ({len(batch)} canales): {e}")
+                        for _, _, queue in batch:
+                            self._cancel(queue, e)
+                        continue
+                    self.batches += 1
+                    self.frames += len(batch)
+                    for i, (channel_id, stream, queue) in enumerate(batch):
+                        if not queue:
+                            # Canal cerrado mientras corría la inferencia
+                            continue
+                        _, request = queue.popleft()
+                        prob = float(probs[i][0])
+                        request.speech = request.speech or prob >= stream.threshold
+                        event = stream.advance(prob, new_states[:, i:i + 1, :])
+                        if event:
+                            request.events.append(event)
+                        request.remaining -= 1
+                        if request.remaining == 0 and not request.future.done():
+                            request.future.set_result((request.speech, request.events))